@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""sweeps.py: Compares the batched pattern generation (Generate*Batch) with a loop over the single pattern functions, as used for parameter sweeps.
+Run from the repository root: python -m benchmarks.sweeps [--res 800 600] [--sizes 1 10 100] [--dtype uint8] [--repeats 3]"""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+
+import numpy as np
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+
+WAVELENGTH = 800
+PIXEL_PITCH = 8
+ZERNIKE_TERMS = 15
+
+def best_time(function, repeats):
+    """Runs a function several times.
+
+    Args:
+        function (function): Function to time.
+        repeats (int): Number of runs.
+
+    Returns:
+        float: Shortest run time (s).
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def loop(generate, parameters, out):
+    """Fills a stack calling a single pattern function for each parameter (the sweep without batching).
+
+    Args:
+        generate (function): Function generating the pattern of one parameter.
+        parameters (np.array): Parameters of the sweep.
+        out (np.array): (N, res_Y, res_X) stack, uint8 stacks get the patterns wrapped to gray levels.
+    """
+    for k in range(len(parameters)):
+        pattern = generate(parameters[k])
+        out[k] = np.mod(pattern, 256) if out.dtype == np.uint8 else pattern
+
+def sweeps(generator, n, res_X, res_Y):
+    """Parameters of the sweeps and the batched and single pattern functions running them.
+
+    Args:
+        generator (:Patter_generator:): Pattern generator.
+        n (int): Number of patterns of each sweep.
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+
+    Returns:
+        list: (name, parameters, batch function, single pattern function) for each sweep.
+    """
+    orders = np.array([Phase_pattern._osa_to_nm(j)[0] for j in range(ZERNIKE_TERMS)])
+    coefficients = np.random.default_rng(0).normal(size = (n, ZERNIKE_TERMS))*0.2/(res_Y/2.)**orders
+    return [
+        ("lens", np.linspace(50, 500, n),
+            lambda focus, dtype: generator.GenerateLensBatch(focus, WAVELENGTH, PIXEL_PITCH, res_X, res_Y, dtype = dtype),
+            lambda focus: generator.GenerateLens(focus, WAVELENGTH, PIXEL_PITCH, res_X, res_Y)),
+        ("grating", np.linspace(1, 20, n),
+            lambda lmm, dtype: generator.GenerateGratingBatch(WAVELENGTH, PIXEL_PITCH, lmm, 0.3, res_X, res_Y, dtype = dtype),
+            lambda lmm: generator.GenerateGrating(WAVELENGTH, PIXEL_PITCH, lmm, 0.3, res_X, res_Y)),
+        ("zernike", coefficients,
+            lambda coefficients, dtype: generator.GenerateZernikeBatch(coefficients, res_X, res_Y, res_X//2, res_Y//2, dtype = dtype),
+            lambda coefficients: generator.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description = "Batched vs looped generation of parameter sweeps.")
+    parser.add_argument("--res", type = int, nargs = 2, default = (800, 600), metavar = ("X", "Y"), help = "SLM resolution")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = (1, 10, 100), help = "number of patterns of the sweeps")
+    parser.add_argument("--dtype", choices = ("uint8", "float32", "float64"), default = "uint8", help = "data type of the stacks")
+    parser.add_argument("--repeats", type = int, default = 3, help = "runs of each measurement (the best is kept)")
+    args = parser.parse_args()
+    res_X, res_Y = args.res
+    dtype = np.dtype(args.dtype)
+    generator = Phase_pattern.Patter_generator(np.float64 if dtype == np.float64 else np.float32)
+    print("%dx%d, %s stacks, times per pattern" % (res_X, res_Y, dtype))
+    print("%-8s %6s %12s %12s %8s" % ("sweep", "N", "batch (ms)", "loop (ms)", "speed-up"))
+    for n in args.sizes:
+        for name, parameters, batch, single in sweeps(generator, n, res_X, res_Y):
+            out = np.empty((n, res_Y, res_X), dtype = dtype)
+            # First runs compile the kernels and fill the Zernike basis cache
+            batch(parameters[:1], dtype)
+            loop(single, parameters[:1], out)
+            batch_time = best_time(lambda: batch(parameters, dtype), args.repeats)/n
+            loop_time = best_time(lambda: loop(single, parameters, out), args.repeats)/n
+            print("%-8s %6d %12.2f %12.2f %7.1fx" % (name, n, batch_time*1e3, loop_time*1e3, loop_time/batch_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""threads.py: Measures how the numba kernels scale with the number of threads (see Phase_pattern.configure_threads).
+Run from the repository root: python -m benchmarks.threads [--res 1920 1152] [--threads 1 2 4 8] [--repeats 5]
+The thread pool has NUMBA_NUM_THREADS threads (all the cores by default), larger thread counts are skipped."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import argparse
+import time
+
+import numpy as np
+import numba as nb
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Render_pipeline as Render_pipeline
+
+def best_time(function, repeats):
+    """Runs a function several times.
+
+    Args:
+        function (function): Function to time.
+        repeats (int): Number of runs.
+
+    Returns:
+        float: Shortest run time (s).
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def workloads(res_X, res_Y):
+    """Pattern generation and rendering steps used by the GUI.
+
+    Args:
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+
+    Returns:
+        list: (name, function) for each workload.
+    """
+    generator = Phase_pattern.Patter_generator(np.float32)
+    coefficients = np.full(15, 1e-9)
+    lens = generator.GenerateLens(300, 800, 8, res_X, res_Y)
+    grating = generator.GenerateGrating(800, 8, 3.3, 0.1, res_X, res_Y)
+    pattern = lens + grating
+    mask = np.ones((res_Y, res_X))
+    frame = Render_pipeline.frame_buffer(None, res_X, res_Y)
+    analytic = Phase_pattern.AnalyticPattern(res_X, res_Y)
+    analytic.add_grating(800, 8, 3.3, 0.1)
+    analytic.add_lens(300, 800, 8)
+    def zernike_basis():
+        generator.zernike_cache.clear()
+        generator.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    return [
+        ("lens", lambda: generator.GenerateLens(300, 800, 8, res_X, res_Y)),
+        ("grating", lambda: generator.GenerateGrating(800, 8, 3.3, 0.1, res_X, res_Y, out = grating)),
+        ("zernike basis", zernike_basis),
+        ("analytic", lambda: generator.GenerateAnalytic(analytic, out = pattern)),
+        ("render", lambda: Render_pipeline.render_frame(pattern, 255, (mask,), frame)),
+        ("render diffusion", lambda: Render_pipeline.render_frame(pattern, 255, (mask,), frame, quantizer = "diffusion")),
+        ("spot array (GS)", lambda: generator.GenerateSpotArray([10., 20., -15.], [5., -10., 12.], 8, res_X, res_Y, iterations = 5)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description = "Scaling of the numba kernels with the number of threads.")
+    parser.add_argument("--res", type = int, nargs = 2, default = (1920, 1152), metavar = ("X", "Y"), help = "SLM resolution")
+    parser.add_argument("--threads", type = int, nargs = "+", default = None, help = "thread counts (default: powers of 2 up to the pool size)")
+    parser.add_argument("--repeats", type = int, default = 5, help = "runs of each measurement (the best is kept)")
+    args = parser.parse_args()
+    res_X, res_Y = args.res
+    pool = nb.config.NUMBA_NUM_THREADS
+    counts = args.threads or sorted({2**k for k in range(pool.bit_length()) if 2**k <= pool} | {pool})
+    counts = [n for n in counts if 1 <= n <= pool]
+    print("%dx%d, thread pool of %d threads (%s layer), times in ms (speed-up)" % (res_X, res_Y, pool, nb.config.THREADING_LAYER))
+    print("%-18s" % "workload" + "".join("%16s" % ("%d threads" % n) for n in counts))
+    for name, function in workloads(res_X, res_Y):
+        # First run compiles the kernels
+        function()
+        times = []
+        for n in counts:
+            Phase_pattern.configure_threads(n)
+            times.append(best_time(function, args.repeats))
+        print("%-18s" % name + "".join("%16s" % ("%.1f (%.1fx)" % (t*1e3, times[0]/t)) for t in times))
+
+if __name__ == '__main__':
+    main()
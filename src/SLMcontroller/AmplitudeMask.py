@@ -9,11 +9,12 @@ __maintainer__ = "Matteo Mazzanti"
 
 # -*- coding: utf-8 -*-
 
-from PyQt6.QtWidgets import QMessageBox, QLineEdit, QGridLayout, QCheckBox, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QFileDialog
+from PyQt6.QtWidgets import QMessageBox, QLineEdit, QGridLayout, QCheckBox, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QFileDialog, QComboBox
 from PyQt6.QtCore import Qt
 
 
 import SLMcontroller.utils as utils
+import SLMcontroller.Render_pipeline as Render_pipeline
 import cv2
 import os
 import numpy as np
@@ -32,6 +33,9 @@ class AmplitudeMaskTab(QWidget):
         SLM_x_res (int): SLM X resolution.
         SLM_y_res (int): SLM Y resolution.
     """
+    # Labels of Render_pipeline.ENCODINGS
+    encodings = ["Scale gray levels", "Grating depth (first order amplitude)", "Double phase (checkerboard)"]
+
     def __init__(self, pattern_generator, settings_manager, hologram_manager):
         """Constructor for the FlatnessCorrectionTab class.
 
@@ -66,6 +70,7 @@ class AmplitudeMaskTab(QWidget):
         The tab contains:
         - A text field to enter the path to the flatness correction image.
         - A button to load the flatness correction image.
+        - A selector of the encoding of the amplitude (see Render_pipeline.ENCODINGS).
         - A checkbox to activate the flatness correction.
         - An image preview of the flatness correction image.
         """
@@ -82,6 +87,9 @@ class AmplitudeMaskTab(QWidget):
         self.loadimage = QPushButton("Load Amplitude Correction Image")
         self.loadimage.clicked.connect(self.update_pattern)
 
+        self.encoding_selector = QComboBox()
+        self.encoding_selector.addItems(self.encodings)
+
         self.pattern_image = utils.ImageWidget()
         
         self.isactive = QCheckBox("Activate element : ")
@@ -90,6 +98,7 @@ class AmplitudeMaskTab(QWidget):
         self.image_loading_layout.addWidget(self.image_path)
         self.image_loading_layout.addWidget(self.selectfile)
         self.image_loading_layout.addWidget(self.loadimage)
+        self.image_loading_layout.addWidget(self.encoding_selector)
         self.layout.addLayout(self.image_loading_layout,0,0)
 
         self.image_preview_layout.addWidget(self.pattern_image)
@@ -175,6 +184,17 @@ class AmplitudeMaskTab(QWidget):
         """
         return self.isactive.isChecked()
     
+    def get_encoding(self):
+        """Returns the encoding of the amplitude mask.
+        "scaling" multiplies the gray levels by the mask (not a physical amplitude), "grating depth" scales the depth of the wrapped phase
+        so that the first diffraction order of a grating has the amplitude of the mask, "double phase" encodes the complex field
+        on a checkerboard of two phase-only fields.
+
+        Returns:
+            str: Encoding, one of Render_pipeline.ENCODINGS.
+        """
+        return Render_pipeline.ENCODINGS[self.encoding_selector.currentIndex()]
+
     def is_amplitude(self):
         """Checks if the flatness correction element is an amplitude correction.
 
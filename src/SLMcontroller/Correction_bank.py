@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""Correction_bank.py: Indexes the flatness correction images of a SLM by wavelength and serves the correction of any wavelength from memory-mapped caches."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+
+import numpy as np
+import numba as nb
+
+# Wavelength in the name of a correction image (e.g. CAL_LSH0802160_760nm.bmp)
+WAVELENGTH_PATTERN = re.compile(r"_(\d+)nm", re.IGNORECASE)
+
+IMAGE_EXTENSIONS = (".bmp", ".png", ".tif", ".tiff")
+
+# Folder of the converted corrections
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "SLMcontroller", "corrections")
+
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _interpolate_wrapped(low, high, weight, out):
+    """Interpolates two wrapped phase patterns (gray levels in [0,256)) along the shortest way around the circle.
+    A plain linear interpolation would average the two sides of each 2pi wrap (128 levels off).
+
+    Args:
+        low (np.array): uint8 correction at the lower wavelength.
+        high (np.array): uint8 correction at the higher wavelength.
+        weight (float): Weight of the higher wavelength, in [0,1].
+        out (np.array): float32 interpolated correction.
+    """
+    for i in nb.prange(out.shape[0]):
+        for j in range(out.shape[1]):
+            start = np.float32(low[i, j])
+            step = np.float32(high[i, j]) - start
+            if step >= 128:
+                step -= 256
+            elif step < -128:
+                step += 256
+            value = start + weight*step
+            if value < 0:
+                value += 256
+            elif value >= 256:
+                value -= 256
+            out[i, j] = value
+
+def read_image(path):
+    """Decodes an 8-bit correction image.
+
+    Args:
+        path (str): Path to the image.
+
+    Raises:
+        ValueError: If the image can't be read or isn't a single channel 8-bit image.
+
+    Returns:
+        np.array: uint8 image.
+    """
+    import cv2
+    img = cv2.imread(path, -1)
+    if img is None:
+        raise ValueError("Wrong path to image " + path)
+    if img.ndim != 2 or img.dtype != np.uint8:
+        raise ValueError("The image " + path + " does not use a 8 bits color scheme")
+    return img
+
+class CorrectionBank:
+    """Flatness corrections of a SLM at several wavelengths (e.g. the CAL_*_<wavelength>nm.bmp images given by the producer).
+    Each image is decoded once and stored as a .npy file in a cache folder, then memory-mapped: selecting the correction of a calibrated
+    wavelength returns a read-only view of the mapped file (no decoding, no copy), the correction of a wavelength in between two calibrated ones
+    is interpolated (see _interpolate_wrapped) in a reused buffer. Cached files are named after the size and modification time of the image,
+    so that an updated image is converted again.
+
+    Attributes:
+        folder (str): Folder containing the correction images.
+        cache_folder (str): Folder containing the converted corrections.
+        files (dict): Path of the correction image of each wavelength (nm).
+        wavelengths (np.array): Calibrated wavelengths (nm), sorted.
+    """
+
+    def __init__(self, folder, cache_folder = DEFAULT_CACHE_FOLDER, decoder = read_image):
+        """Constructor for the CorrectionBank class.
+
+        Args:
+            folder (str): Folder containing the correction images, the wavelength is parsed from the names (_<wavelength>nm).
+            cache_folder (str, optional): Folder of the converted corrections. Defaults to DEFAULT_CACHE_FOLDER.
+            decoder (function, optional): Function decoding an image file to a uint8 array. Defaults to read_image.
+
+        Raises:
+            ValueError: If the folder doesn't contain any correction image.
+        """
+        self.folder = folder
+        self.cache_folder = cache_folder
+        self.decoder = decoder
+        self.files = {}
+        for name in sorted(os.listdir(folder)):
+            match = WAVELENGTH_PATTERN.search(name)
+            if match is not None and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                self.files[int(match.group(1))] = os.path.join(folder, name)
+        if len(self.files) == 0:
+            raise ValueError("No correction image (*_<wavelength>nm.bmp) in " + folder)
+        self.wavelengths = np.array(sorted(self.files))
+        self._planes = {}
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    def cache_path(self, wavelength):
+        """Returns the path of the converted correction of a calibrated wavelength.
+
+        Args:
+            wavelength (int): Calibrated wavelength (nm).
+
+        Returns:
+            str: Path of the .npy file.
+        """
+        source = self.files[wavelength]
+        stat = os.stat(source)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.cache_folder, "%s_%d_%d.npy" % (stem, stat.st_size, int(stat.st_mtime)))
+
+    def plane(self, wavelength):
+        """Returns the correction of a calibrated wavelength, converting the image the first time.
+
+        Args:
+            wavelength (int): Calibrated wavelength (nm).
+
+        Returns:
+            np.array: Read-only uint8 correction (view of the memory-mapped cache).
+        """
+        with self._lock:
+            plane = self._planes.get(wavelength)
+            if plane is not None:
+                return plane
+            path = self.cache_path(wavelength)
+            if not os.path.exists(path):
+                os.makedirs(self.cache_folder, exist_ok = True)
+                # Written under a temporary name, a partially written cache is never mapped
+                temporary = path + ".tmp"
+                with open(temporary, "wb") as file:
+                    np.save(file, np.ascontiguousarray(self.decoder(self.files[wavelength]), dtype = np.uint8))
+                os.replace(temporary, path)
+                print("Flatness correction at %d nm cached in %s" % (wavelength, path))
+            plane = np.asarray(np.load(path, mmap_mode = "r"))
+            self._planes[wavelength] = plane
+            return plane
+
+    def convert_all(self):
+        """Converts all the correction images that are not cached yet (e.g. once after installing new corrections).
+        """
+        for wavelength in self.wavelengths:
+            self.plane(int(wavelength))
+
+    def neighbours(self, wavelength):
+        """Returns the calibrated wavelengths around a wavelength and the interpolation weight.
+        Wavelengths outside the calibrated range use the closest calibrated one.
+
+        Args:
+            wavelength (float): Wavelength (nm).
+
+        Returns:
+            tuple: (lower wavelength, higher wavelength, weight of the higher one).
+        """
+        index = np.searchsorted(self.wavelengths, wavelength)
+        if index < len(self.wavelengths) and self.wavelengths[index] == wavelength:
+            return int(wavelength), int(wavelength), 0.
+        if index == 0:
+            return int(self.wavelengths[0]), int(self.wavelengths[0]), 0.
+        if index == len(self.wavelengths):
+            return int(self.wavelengths[-1]), int(self.wavelengths[-1]), 0.
+        low, high = int(self.wavelengths[index - 1]), int(self.wavelengths[index])
+        return low, high, (wavelength - low)/(high - low)
+
+    def correction(self, wavelength):
+        """Returns the correction at a wavelength.
+
+        Args:
+            wavelength (float): Wavelength (nm).
+
+        Returns:
+            np.array: Read-only uint8 view of the cache for a calibrated (or out of range) wavelength,
+                otherwise a float32 interpolated correction (buffer overwritten by the next interpolation).
+        """
+        low, high, weight = self.neighbours(wavelength)
+        if weight == 0:
+            return self.plane(low)
+        low_plane, high_plane = self.plane(low), self.plane(high)
+        if low_plane.shape != high_plane.shape:
+            raise ValueError("The corrections at %d nm and %d nm have different sizes" % (low, high))
+        if self._buffer is None or self._buffer.shape != low_plane.shape:
+            self._buffer = np.empty(low_plane.shape, dtype = np.float32)
+        _interpolate_wrapped(low_plane, high_plane, np.float32(weight), self._buffer)
+        return self._buffer
+
+    def describe(self, wavelength):
+        """Describes the correction used at a wavelength.
+
+        Args:
+            wavelength (float): Wavelength (nm).
+
+        Returns:
+            str: Description (calibrated, interpolated or closest calibrated wavelength).
+        """
+        low, high, weight = self.neighbours(wavelength)
+        if low != high:
+            return "%g nm, interpolated between %d nm and %d nm" % (wavelength, low, high)
+        if low != wavelength:
+            return "%g nm out of the calibrated range, using %d nm" % (wavelength, low)
+        return "%d nm" % low
@@ -9,11 +9,12 @@ __maintainer__ = "Matteo Mazzanti"
 
 # -*- coding: utf-8 -*-
 
-from PyQt6.QtWidgets import QMessageBox, QLineEdit, QGridLayout, QCheckBox, QVBoxLayout, QHBoxLayout, QWidget, QPushButton
+from PyQt6.QtWidgets import QMessageBox, QLineEdit, QGridLayout, QCheckBox, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel
 from PyQt6.QtCore import Qt
 
 
 import SLMcontroller.utils as utils
+import SLMcontroller.Correction_bank as Correction_bank
 import cv2
 import os
 import numpy as np
@@ -31,6 +32,8 @@ class FlatnessCorrectionTab(QWidget):
         script_folder (str): Path to the folder containing the script.
         SLM_x_res (int): SLM X resolution.
         SLM_y_res (int): SLM Y resolution.
+        bank (:CorrectionBank:): Corrections of all the calibrated wavelengths, used when following the laser wavelength.
+        bank_wavelength (float): Wavelength of the correction taken from the bank.
     """
     def __init__(self, pattern_generator, settings_manager, hologram_manager):
         """Constructor for the FlatnessCorrectionTab class.
@@ -50,6 +53,8 @@ class FlatnessCorrectionTab(QWidget):
         self.script_folder = os.path.realpath(__file__)
         self.SLM_x_res = self.settings_manager.get_X_res()
         self.SLM_y_res = self.settings_manager.get_Y_res()
+        self.bank = None
+        self.bank_wavelength = None
         self.Init_GUI()
 
     def __del__(self):
@@ -66,6 +71,8 @@ class FlatnessCorrectionTab(QWidget):
         The tab contains:
         - A text field to enter the path to the flatness correction image.
         - A button to load the flatness correction image.
+        - A text field with the folder of the corrections at all the calibrated wavelengths, and a checkbox to follow the laser wavelength of the settings
+          (the correction is taken from that folder, interpolated between the two closest wavelengths if needed).
         - A checkbox to activate the flatness correction.
         - An image preview of the flatness correction image.
         """
@@ -79,6 +86,12 @@ class FlatnessCorrectionTab(QWidget):
         self.loadimage = QPushButton("Load Flatness Correction Image")
         self.loadimage.clicked.connect(self.update_pattern)
 
+        self.bank_folder = QLineEdit("deformation_correction_pattern")
+        self.followwavelength = QCheckBox("Follow laser wavelength : ")
+        self.followwavelength.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.followwavelength.stateChanged.connect(self.update_pattern)
+        self.bank_label = QLabel("")
+
         self.pattern_image = utils.ImageWidget()
         
         self.isactive = QCheckBox("Activate element : ")
@@ -86,6 +99,9 @@ class FlatnessCorrectionTab(QWidget):
 
         self.image_loading_layout.addWidget(self.image_path)
         self.image_loading_layout.addWidget(self.loadimage)
+        self.image_loading_layout.addWidget(self.bank_folder)
+        self.image_loading_layout.addWidget(self.followwavelength)
+        self.image_loading_layout.addWidget(self.bank_label)
         self.layout.addLayout(self.image_loading_layout,0,0)
 
         self.image_preview_layout.addWidget(self.pattern_image)
@@ -100,10 +116,13 @@ class FlatnessCorrectionTab(QWidget):
 
 
     def update_pattern(self):
-        """Updates the flatness correction image loading it from a file
+        """Updates the flatness correction image loading it from a file, or from the correction bank when following the laser wavelength
         """
         self.SLM_x_res = self.settings_manager.get_X_res()
         self.SLM_y_res = self.settings_manager.get_Y_res()
+        if self.followwavelength.isChecked():
+            self.update_from_bank()
+            return
         if self.loaded_file != self.image_path.text():
             img = cv2.imread(self.image_path.text(), -1)
             if img is None:
@@ -135,6 +154,41 @@ class FlatnessCorrectionTab(QWidget):
             self.loaded_file = self.image_path.text()
             self.pattern_image.setImage(self.pattern)
 
+    def update_from_bank(self):
+        """Takes the correction of the laser wavelength from the correction bank (re-indexed if the folder changed).
+        Calibrated wavelengths are read-only views of the memory-mapped cache, other wavelengths are interpolated.
+        """
+        wavelength = self.settings_manager.get_wavelength()
+        folder = self.bank_folder.text()
+        if self.bank is not None and self.bank.folder == folder and self.bank_wavelength == wavelength:
+            return
+        try:
+            if self.bank is None or self.bank.folder != folder:
+                self.bank = Correction_bank.CorrectionBank(folder)
+                self.bank_wavelength = None
+            pattern = self.bank.correction(wavelength)
+        except (OSError, ValueError) as error:
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText(str(error))
+            dlg.exec()
+            self.bank = None
+            self.followwavelength.setChecked(False)
+            return
+        if (pattern.shape[1] != self.SLM_x_res) or (pattern.shape[0] != self.SLM_y_res) :
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText("Image dimensions don't match with SLM size")
+            dlg.exec()
+        self.pattern = pattern
+        self.bank_wavelength = wavelength
+        # The single file is loaded again when the bank is left
+        self.loaded_file = "none"
+        self.bank_label.setText("Correction: " + self.bank.describe(wavelength))
+        self.pattern_image.setImage(self.pattern)
+
     def get_pattern(self):
         """Returns the flatness correction image.
 
@@ -14,6 +14,7 @@ from PyQt6.QtCore import Qt, QThread
 
 import os
 import SLMcontroller.utils as utils
+import SLMcontroller.Phase_pattern as Phase_pattern
 import gmsh
 import numpy as np
 import time
@@ -256,6 +257,7 @@ class OptimizerAlgorithmFourier(QThread):
         self.wait()
 
     def run(self):
+        Phase_pattern.apply_threads()
         self.initPattern()
         print("Done with init ...")
         self.SaveData()
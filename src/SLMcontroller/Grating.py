@@ -9,7 +9,7 @@ __maintainer__ = "Matteo Mazzanti"
 
 # -*- coding: utf-8 -*-
 
-from PyQt6.QtWidgets import QDoubleSpinBox, QGridLayout, QVBoxLayout, QWidget, QSlider, QCheckBox
+from PyQt6.QtWidgets import QDoubleSpinBox, QGridLayout, QVBoxLayout, QWidget, QSlider, QCheckBox, QLabel
 from PyQt6.QtCore import Qt
 
 import SLMcontroller.utils as utils
@@ -29,6 +29,7 @@ class GratingTab(QWidget):
         maxlmm (float): Maximum number of lines per mm that can be used to generate the grating.
         lmm (float): Number of lines per mm used to generate the grating.
         angle (float): Angle of the grating in radians.
+        snap_tolerance (float): Maximum phase error (gray levels across the SLM) allowed when snapping the grating to a periodic one (periodic gratings are generated by tiling).
         lastvals (list): List containing the last values of the angle, lmm, wavelength, pixel pitch, X resolution and Y resolution used to generate the last grating (used to avoid re-generating gratings). 
     """
     def __init__(self, pattern_generator, settings_manager, hologram_manager):
@@ -48,6 +49,7 @@ class GratingTab(QWidget):
         self.maxlmm = 1e-3/(2*self.settings_manager.get_pixel_pitch()*1e-6)
         self.lmm = 0.
         self.angle = 0.
+        self.snap_tolerance = 0.
         self.init_GUI()
     def __del__(self):
         """Destructor for the GratingTab class.
@@ -76,14 +78,16 @@ class GratingTab(QWidget):
 
         self.make_lmm_slider()
         self.make_angle_slider()
+        self.make_tiling_controls()
 
         self.make_image_preview()
 
         self.layout = QGridLayout()
         self.layout.addLayout(self.lmm_layout,0,0)
         self.layout.addLayout(self.angle_layout,1,0)
-        self.layout.addLayout(self.image_preview_layout,2,0)
-        self.layout.addLayout(self.general_controls_layout,3,0)
+        self.layout.addLayout(self.tiling_layout,2,0)
+        self.layout.addLayout(self.image_preview_layout,3,0)
+        self.layout.addLayout(self.general_controls_layout,4,0)
         #self.layout.addWidget(self.label,1,0)
 
         self.setLayout(self.layout)
@@ -94,7 +98,7 @@ class GratingTab(QWidget):
         Returns:
             bool: True if the grating needs to be re-generated, False otherwise.
         """
-        new_vals = [self.angle,self.lmm,self.settings_manager.get_wavelength(),self.settings_manager.get_pixel_pitch(),self.settings_manager.get_X_res(),self.settings_manager.get_Y_res()]
+        new_vals = [self.angle,self.lmm,self.snap_tolerance,self.settings_manager.get_wavelength(),self.settings_manager.get_pixel_pitch(),self.settings_manager.get_X_res(),self.settings_manager.get_Y_res()]
         for i in range(len(self.lastvals)):
             self.lastvals[i] != new_vals[i]
             return True
@@ -157,6 +161,32 @@ class GratingTab(QWidget):
         self.angle_layout.addWidget(self.spin_angle)
         self.angle_layout.addWidget(self.angle_slider)
 
+    def make_tiling_controls(self):
+        """Generates the spinbox used to control the period snapping tolerance and the label showing the period used to tile the grating.
+        """
+        self.tiling_layout = QVBoxLayout()
+
+        self.spin_snap = QDoubleSpinBox(text="Period snapping tolerance")
+        self.spin_snap.setPrefix('Period snapping: ')
+        self.spin_snap.setSuffix(' levels')
+        self.spin_snap.setKeyboardTracking(False)
+        self.spin_snap.setDecimals(2)
+        self.spin_snap.setMaximum(255)
+        self.spin_snap.setMinimum(0)
+        self.spin_snap.valueChanged.connect(self.update_snap_tolerance)
+        self.period_label = QLabel("Period: -")
+
+        self.tiling_layout.addWidget(self.spin_snap)
+        self.tiling_layout.addWidget(self.period_label)
+
+    def update_snap_tolerance(self):
+        """Updates the period snapping tolerance of the grating when the spinbox is changed.
+        """
+        self.snap_tolerance = self.sender().value()
+        if self.liveupdate.isChecked():
+            self.update_pattern()
+            self.hologram_manager.updateSLMWindow()
+
     def update_lmm_spin(self):
         """Updates the number of lines per mm of the grating when the spinbox is changed (usually called from the slider valueChanged signal)
         """
@@ -202,11 +232,27 @@ class GratingTab(QWidget):
 
 
     def update_pattern(self):
-        """Updates the grating pattern.
+        """Updates the grating pattern (the previous pattern buffer is reused).
         """
-        self.pattern = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.lmm, self.angle*np.pi, self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+        self.pattern, period = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.lmm, self.angle*np.pi, self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(), out = self.pattern, snap_tolerance = self.snap_tolerance, return_period = True)
+        if period is None:
+            self.period_label.setText("Period: - (direct generation)")
+        else:
+            self.period_label.setText("Period: %d x %d px (tiled)" % (period[0], period[1]))
         self.pattern_image.setImage(self.pattern)
-        self.lastvals = [self.angle,self.lmm,self.settings_manager.get_wavelength(),self.settings_manager.get_pixel_pitch(),self.settings_manager.get_X_res(),self.settings_manager.get_Y_res()]
+        self.lastvals = [self.angle,self.lmm,self.snap_tolerance,self.settings_manager.get_wavelength(),self.settings_manager.get_pixel_pitch(),self.settings_manager.get_X_res(),self.settings_manager.get_Y_res()]
+
+    def get_analytic_terms(self, terms):
+        """Adds the grating to a closed-form pattern description (used by the fused render mode).
+
+        Args:
+            terms (:AnalyticPattern:): Pattern description the grating is added to.
+
+        Returns:
+            bool: True, the grating is always described in closed form.
+        """
+        terms.add_grating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.lmm, self.angle*np.pi)
+        return True
 
     def get_pattern(self):
         """Returns the grating pattern.
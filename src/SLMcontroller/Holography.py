@@ -0,0 +1,1016 @@
+#!/usr/bin/env python
+
+"""Holography.py: Iterative computation of phase-only holograms (Gerchberg-Saxton family) for arrays of spots or target images in the Fourier plane."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import numba as nb
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy >= 2 can write the FFTs in preallocated buffers
+FFT_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+# Spot arrays with at most this many distinct frequencies along one axis are propagated with matrix products
+# instead of FFTs (cost proportional to the number of frequencies instead of the log of the SLM size)
+SEPARABLE_MAX_FREQUENCIES = 24
+
+# Threads used for the FFTs (created on first use, resized with the numba thread count)
+_fft_pool = None
+_fft_pool_lock = threading.Lock()
+
+def fft_axis(a, axis, out, inverse = False):
+    """FFT of a 2D array along one axis, written in out (can be a itself).
+    numpy FFTs run on a single thread but release the GIL, the array is split in blocks along the other axis
+    and transformed on as many threads as numba uses (see Phase_pattern.configure_threads).
+    Zero-padding is left to the caller (numpy pads with a temporary copy of the whole array).
+    The forward transform is divided by the length of the axis (norm = "forward"): with the default normalization numpy
+    runs the single precision transform through the double precision loop and copies the whole array.
+
+    Args:
+        a (np.array): 2D complex array.
+        axis (int): Axis of the transform (0 or 1).
+        out (np.array): Output array.
+        inverse (bool, optional): If True, inverse FFT (usual 1/n normalization). Defaults to False (forward FFT divided by n).
+
+    Returns:
+        np.array: out.
+    """
+    global _fft_pool
+    if inverse:
+        transform = np.fft.ifft
+    else:
+        def transform(a, axis, out = None):
+            return np.fft.fft(a, axis = axis, out = out, norm = "forward")
+    if not FFT_OUT:
+        out[...] = transform(a, axis = axis)
+        return out
+    threads = min(nb.get_num_threads(), a.shape[1 - axis])
+    if threads <= 1:
+        transform(a, axis = axis, out = out)
+        return out
+    with _fft_pool_lock:
+        if _fft_pool is None or _fft_pool._max_workers != threads:
+            if _fft_pool is not None:
+                _fft_pool.shutdown(wait = False)
+            _fft_pool = ThreadPoolExecutor(max_workers = threads, thread_name_prefix = "FFT")
+        pool = _fft_pool
+    bounds = np.linspace(0, a.shape[1 - axis], threads + 1).astype(np.int64)
+    def run(k):
+        block = slice(bounds[k], bounds[k + 1])
+        index = (slice(None), block) if axis == 0 else (block, slice(None))
+        transform(a[index], axis = axis, out = out[index])
+    list(pool.map(run, range(threads)))
+    return out
+
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _normalize_field(field):
+    """Phase-only constraint: sets the amplitude of every pixel of the field to 1, in place.
+
+    Args:
+        field (np.array): Complex field (SLM plane).
+    """
+    for i in nb.prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            amplitude = abs(field[i, j])
+            if amplitude > 0:
+                field[i, j] = field[i, j]/amplitude
+            else:
+                field[i, j] = 1
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _levels_to_field(pattern, field):
+    """Converts a phase pattern (gray levels, 256 = 2pi) to a unit amplitude complex field.
+
+    Args:
+        pattern (np.array): Phase pattern.
+        field (np.array): Complex output field.
+    """
+    scaling = 2*np.pi/256
+    for i in nb.prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            phase = pattern[i, j]*scaling
+            field[i, j] = np.cos(phase) + 1j*np.sin(phase)
+
+@nb.jit(nopython = True, cache = True, fastmath = True)
+def _phase_level(real, imag):
+    """Phase of a complex number in gray levels in [0,256). Branch-free polynomial arctan2 (error below 1e-5 rad, i.e. 5e-4 gray levels),
+    unlike np.arctan2 it is vectorized by the compiler, which makes the conversion of a whole field several times faster.
+
+    Args:
+        real (float): Real part.
+        imag (float): Imaginary part.
+
+    Returns:
+        float: Gray level.
+    """
+    ax, ay = abs(real), abs(imag)
+    big = max(ax, ay)
+    a = min(ax, ay)/big if big > 0 else 0.
+    s = a*a
+    # Minimax polynomial of arctan on [0, 1], in units of 256 levels per turn
+    t = a*(40.74274 + s*(-13.55230 + s*(7.88567 + s*(-4.74390 + s*(2.14529 - 0.47756*s)))))
+    t = 64 - t if ay > ax else t
+    t = 128 - t if real < 0 else t
+    return 256 - t if imag < 0 and t > 0 else t
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _field_to_levels(field, out):
+    """Converts the phase of a complex field to gray levels in [0,256).
+
+    Args:
+        field (np.array): Complex field.
+        out (np.array): Output phase pattern.
+    """
+    for i in nb.prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            out[i, j] = _phase_level(field[i, j].real, field[i, j].imag)
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _mraf_constraint(grid, target, signal, mixing, scaling):
+    """MRAF constraint in the Fourier plane, in place: the amplitude is set to the target in the signal region,
+    the field is kept (scaled) in the noise region.
+
+    Args:
+        grid (np.array): Complex field in the Fourier plane.
+        target (np.array): Target amplitude (normalized to a unit power).
+        signal (np.array): True in the signal region.
+        mixing (float): Fraction of the power assigned to the signal region.
+        scaling (float): Square root of the input power.
+    """
+    weight = mixing*scaling
+    for i in nb.prange(grid.shape[0]):
+        for j in range(grid.shape[1]):
+            if signal[i, j]:
+                amplitude = abs(grid[i, j])
+                if amplitude > 0:
+                    grid[i, j] = weight*target[i, j]*grid[i, j]/amplitude
+                else:
+                    grid[i, j] = weight*target[i, j]
+            else:
+                grid[i, j] = (1 - mixing)*grid[i, j]
+
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _superposition_update(field, rows, cols, coefficients, out):
+    """Adds a few separable terms to a field, field[i, j] += sum(coefficients[k]*rows[k, i]*cols[k, j]), in place,
+    and converts the phase of the result to gray levels in [0,256) in the same pass.
+
+    Args:
+        field (np.array): Complex field.
+        rows (np.array): (K, res_Y) Y factors of the terms.
+        cols (np.array): (K, res_X) X factors of the terms.
+        coefficients (np.array): Complex coefficient of each term.
+        out (np.array): Output phase pattern.
+    """
+    for i in nb.prange(field.shape[0]):
+        # One term at a time along the row (vectorized), the row is still in cache for the conversion
+        for k in range(len(coefficients)):
+            weight = coefficients[k]*rows[k, i]
+            for j in range(field.shape[1]):
+                field[i, j] += weight*cols[k, j]
+        for j in range(field.shape[1]):
+            out[i, j] = _phase_level(field[i, j].real, field[i, j].imag)
+
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _phase_to_field(phase, field):
+    """Converts a phase (radians) to a unit amplitude complex field.
+
+    Args:
+        phase (np.array): Phase.
+        field (np.array): Complex output field.
+    """
+    for i in nb.prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            field[i, j] = np.cos(phase[i, j]) + 1j*np.sin(phase[i, j])
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _phase_gradient(phase, back, scaling, grad):
+    """Gradient of a cost with respect to the SLM phase, from the back-propagated derivatives of the cost with respect to the spot fields:
+    grad = scaling*Im(exp(i*phase)*conj(back)).
+
+    Args:
+        phase (np.array): SLM phase (radians).
+        back (np.array): Back-propagated derivatives (complex).
+        scaling (float): Scaling of the gradient.
+        grad (np.array): Output gradient.
+    """
+    for i in nb.prange(phase.shape[0]):
+        for j in range(phase.shape[1]):
+            grad[i, j] = scaling*(np.sin(phase[i, j])*back[i, j].real - np.cos(phase[i, j])*back[i, j].imag)
+
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _add_scaled(y, a, x):
+    """y += a*x in place, without the temporary array of numpy.
+
+    Args:
+        y (np.array): Array updated in place.
+        a (float): Scaling.
+        x (np.array): Array added.
+    """
+    for i in nb.prange(y.shape[0]):
+        for j in range(y.shape[1]):
+            y[i, j] += a*x[i, j]
+
+
+class WorkspaceCache:
+    """LRU cache of the work arrays used by the iterative algorithms (complex fields, propagation matrices, ...).
+    Arrays are kept across computations, so that recomputing a hologram (e.g. while a parameter is being changed) doesn't reallocate them.
+    Arrays are identified by a key and are only valid till the next call to get with the same key.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cache, least recently used arrays are dropped beyond it.
+    """
+
+    def __init__(self, max_bytes = 1 << 30):
+        """Constructor for the WorkspaceCache class.
+
+        Args:
+            max_bytes (int, optional): Memory budget of the cache. Defaults to 1 GiB.
+        """
+        self.max_bytes = max_bytes
+        self._arrays = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, shape, dtype, init = None):
+        """Returns the array stored under key, allocating it if missing or if its shape/type changed.
+
+        Args:
+            key (tuple): Identifier of the array (must be hashable).
+            shape (tuple): Shape of the array.
+            dtype (np.dtype): Data type of the array.
+            init (function, optional): Called on a newly allocated array to fill it (for arrays depending only on the key). Defaults to None (uninitialized).
+
+        Returns:
+            np.array: Work array.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self._lock:
+            array = self._arrays.get(key)
+            if array is not None and array.shape == shape and array.dtype == dtype:
+                self._arrays.move_to_end(key)
+                return array
+            if array is not None:
+                del self._arrays[key]
+                self._bytes -= array.nbytes
+        array = np.empty(shape, dtype = dtype)
+        if init is not None:
+            init(array)
+        with self._lock:
+            self._arrays[key] = array
+            self._bytes += array.nbytes
+            self._evict()
+        return array
+
+    def clear(self):
+        """Drops all the cached arrays.
+        """
+        with self._lock:
+            self._arrays.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        """Drops the least recently used arrays till the cache fits in its memory budget (the last one is always kept).
+        """
+        while self._bytes > self.max_bytes and len(self._arrays) > 1:
+            _, array = self._arrays.popitem(last = False)
+            self._bytes -= array.nbytes
+
+
+class SpotArrayEngine:
+    """Computes phase-only holograms producing arrays of spots in the Fourier plane with the (weighted) Gerchberg-Saxton algorithm.
+    The field in the Fourier plane is only needed at the spots, two propagators are used:
+    - separable: when the spots use few distinct frequencies along one axis (e.g. regular arrays), the field at the spots and back
+      is computed with matrix products against the plane waves of each frequency. Exact spot positions, cost proportional to the number of frequencies.
+    - FFT: for arbitrary spot lists, the spots are rounded to the nearest bin of the (optionally zero-padded) FFT grid.
+    All the complex buffers are complex64 and kept in a WorkspaceCache between computations.
+
+    Attributes:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        uniformity (float): Uniformity of the spot intensities of the last hologram, 1 - (max - min)/(max + min).
+        efficiency (float): Fraction of the light in the spots of the last hologram (pixel envelope excluded).
+        iterations (int): Number of iterations done for the last hologram.
+        method (str): Propagator used for the last hologram ("separable" or "fft").
+    """
+
+    def __init__(self, workspace = None):
+        """Constructor for the SpotArrayEngine class.
+
+        Args:
+            workspace (:WorkspaceCache:, optional): Cache of the work arrays (can be shared with other engines). Defaults to None (new cache).
+        """
+        self.workspace = WorkspaceCache() if workspace is None else workspace
+        self.uniformity = 0.
+        self.efficiency = 0.
+        self.iterations = 0
+        self.method = None
+
+    def compute(self, freq_x, freq_y, res_X, res_Y, out, intensities = None, iterations = 30, uniformity = 0.99, weighted = True, fix_phase_after = 5, initial_phase = None, method = "auto", padding = 1, seed = 0):
+        """Computes a hologram producing spots at the given spatial frequencies.
+
+        Args:
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel, within +-0.5).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel, within +-0.5).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            out (np.array): (res_Y, res_X) output phase pattern (gray levels in [0,256)).
+            intensities (np.array, optional): Relative target intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of iterations. Defaults to 30.
+            uniformity (float, optional): The iterations stop once this uniformity is reached. Defaults to 0.99.
+            weighted (bool, optional): If True, weighted Gerchberg-Saxton (the spot targets are adapted to equalize the intensities), plain Gerchberg-Saxton otherwise. Defaults to True.
+            fix_phase_after (int, optional): In weighted mode, the phases of the spots are frozen after this many iterations and only the weights are updated
+                (avoids the stagnation of weighted Gerchberg-Saxton on regular arrays). Defaults to 5.
+            initial_phase (np.array, optional): Phase pattern (gray levels) to start from. Defaults to None (superposition of the spots with random phases).
+            method (str, optional): "separable", "fft" or "auto". Defaults to "auto".
+            padding (int, optional): Zero-padding factor of the FFT grid (finer spot positions). Defaults to 1.
+            seed (int, optional): Seed of the random phases of the initial superposition. Defaults to 0.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        freq_x = np.atleast_1d(np.asarray(freq_x, dtype = np.float64))
+        freq_y = np.atleast_1d(np.asarray(freq_y, dtype = np.float64))
+        if freq_x.shape != freq_y.shape or freq_x.ndim != 1 or len(freq_x) == 0:
+            raise ValueError("Spots must be given as two 1D arrays of the same length")
+        targets = np.ones(len(freq_x)) if intensities is None else np.sqrt(np.asarray(intensities, dtype = np.float64))
+        if targets.shape != freq_x.shape:
+            raise ValueError("One intensity per spot is needed")
+        propagator, self.method = _make_propagator(self.workspace, freq_x, freq_y, res_X, res_Y, method, padding)
+
+        field = propagator.slm_field()
+        if initial_phase is None:
+            phases = np.random.default_rng(seed).uniform(0, 2*np.pi, len(targets))
+            propagator.backward(targets*np.exp(1j*phases))
+            _normalize_field(field)
+        else:
+            _levels_to_field(initial_phase, field)
+
+        weights = targets.copy()
+        fixed_phases = None
+        n_pixels = res_X*res_Y
+        for iteration in range(iterations + 1):
+            spots = propagator.forward()
+            amplitudes = np.abs(spots)
+            ratios = amplitudes/targets
+            intensity = ratios**2
+            self.uniformity = 1 - (intensity.max() - intensity.min())/max(intensity.max() + intensity.min(), 1e-30)
+            self.efficiency = np.sum(amplitudes**2)/n_pixels**2
+            self.iterations = iteration
+            if self.uniformity >= uniformity or iteration == iterations:
+                break
+            phases = spots/np.maximum(amplitudes, 1e-30)
+            if weighted:
+                weights *= np.mean(ratios)/np.maximum(ratios, 1e-30)
+                if iteration >= fix_phase_after:
+                    if fixed_phases is None:
+                        fixed_phases = phases
+                    phases = fixed_phases
+            propagator.backward(weights*phases)
+            _normalize_field(field)
+        _field_to_levels(field, out)
+        return out
+
+
+def _make_propagator(workspace, freq_x, freq_y, res_X, res_Y, method = "auto", padding = 1):
+    """Returns the propagator between the SLM and a list of spots.
+
+    Args:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        freq_x (np.array): X spatial frequency of each spot (cycles per pixel).
+        freq_y (np.array): Y spatial frequency of each spot (cycles per pixel).
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+        method (str, optional): "separable", "fft" or "auto" (separable for few distinct frequencies along one axis). Defaults to "auto".
+        padding (int, optional): Zero-padding factor of the FFT grid. Defaults to 1.
+
+    Returns:
+        tuple: Propagator and name of the method used.
+    """
+    if method == "auto":
+        distinct = min(len(np.unique(freq_x)), len(np.unique(freq_y)))
+        method = "separable" if distinct <= SEPARABLE_MAX_FREQUENCIES else "fft"
+    if method == "separable":
+        return _SeparablePropagator(workspace, freq_x, freq_y, res_X, res_Y), method
+    if method == "fft":
+        return _FFTPropagator(workspace, freq_x, freq_y, res_X, res_Y, padding), method
+    raise ValueError("Unknown propagation method " + str(method))
+
+
+class _SeparablePropagator:
+    """Propagates between the SLM and the spots with matrix products against the plane waves of the distinct spot frequencies.
+    The SLM field is E[y, x], the field at spot m is sum(E[y, x]*exp(-2i*pi*(fy_m*y + fx_m*x))).
+
+    Attributes:
+        adjoint_scale (float): backward is the adjoint of forward divided by this factor.
+    """
+    adjoint_scale = 1.
+
+    def __init__(self, workspace, freq_x, freq_y, res_X, res_Y):
+        """Constructor for the _SeparablePropagator class.
+
+        Args:
+            workspace (:WorkspaceCache:): Cache of the work arrays.
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+        """
+        self.workspace = workspace
+        self.res_X, self.res_Y = res_X, res_Y
+        self.ux, self.ix = np.unique(freq_x, return_inverse = True)
+        self.uy, self.iy = np.unique(freq_y, return_inverse = True)
+        # Plane waves of each distinct frequency, they only depend on the frequencies
+        self.waves_x = self._waves(self.ux, res_X)
+        self.waves_y = self._waves(self.uy, res_Y)
+        # Contract first along the axis with fewer frequencies
+        self.x_first = len(self.ux) <= len(self.uy)
+        # Sums the spots sharing the same frequency along that axis
+        groups = self.ix if self.x_first else self.iy
+        self.grouping = np.zeros((len(groups), groups.max() + 1), dtype = np.complex64)
+        self.grouping[np.arange(len(groups)), groups] = 1
+
+    def _waves(self, frequencies, n):
+        """Returns the (n, K) matrix of the plane waves exp(-2i*pi*f*k) of K frequencies.
+        """
+        def init(array):
+            array[...] = np.exp(-2j*np.pi*np.arange(n)[:, None]*frequencies[None, :])
+        return self.workspace.get(("plane waves", n, frequencies.tobytes()), (n, len(frequencies)), np.complex64, init)
+
+    def slm_field(self):
+        """Returns the (res_Y, res_X) complex field on the SLM.
+        """
+        return self.workspace.get(("slm field",), (self.res_Y, self.res_X), np.complex64)
+
+    def forward(self):
+        """Field at the spots for the current SLM field.
+
+        Returns:
+            np.array: Complex field at each spot.
+        """
+        field = self.slm_field()
+        if self.x_first:
+            partial = field @ self.waves_x
+            return np.einsum('ij,ij->j', self.waves_y[:, self.iy], partial[:, self.ix])
+        partial = self.waves_y.T @ field
+        return np.einsum('ji,ij->j', partial[self.iy, :], self.waves_x[:, self.ix])
+
+    def backward(self, spots):
+        """Sets the SLM field to the superposition of the plane waves of the spots (inverse of forward, up to a constant).
+
+        Args:
+            spots (np.array): Complex field at each spot.
+        """
+        field = self.slm_field()
+        spots = spots.astype(np.complex64)
+        if self.x_first:
+            # Group the spots sharing the same X frequency, then one product over the X frequencies
+            grouped = (np.conj(self.waves_y[:, self.iy])*spots) @ self.grouping
+            np.matmul(grouped, np.conj(self.waves_x).T, out = field)
+        else:
+            grouped = self.grouping.T @ (np.conj(self.waves_x[:, self.ix])*spots).T
+            np.matmul(np.conj(self.waves_y), grouped, out = field)
+
+
+class _FFTPropagator:
+    """Propagates between the SLM and the Fourier plane with FFTs on a (zero-padded) grid. Spots are rounded to the nearest FFT bin.
+    Only the columns of the spectrum containing spots are needed: the FFT along X is done on all the SLM rows,
+    the one along Y only on those columns (and the zero-padding is never stored).
+
+    Attributes:
+        adjoint_scale (float): backward is the adjoint of forward divided by this factor (the size of the FFT grid).
+    """
+
+    def __init__(self, workspace, freq_x, freq_y, res_X, res_Y, padding = 1):
+        """Constructor for the _FFTPropagator class.
+
+        Args:
+            workspace (:WorkspaceCache:): Cache of the work arrays.
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            padding (int, optional): Zero-padding factor of the FFT grid. Defaults to 1.
+        """
+        self.workspace = workspace
+        self.res_X, self.res_Y = res_X, res_Y
+        self.shape = (int(padding*res_Y), int(padding*res_X))
+        self.adjoint_scale = float(self.shape[0])*self.shape[1]
+        bins_x = np.round(freq_x*self.shape[1]).astype(np.int64) % self.shape[1]
+        self.bins_y = np.round(freq_y*self.shape[0]).astype(np.int64) % self.shape[0]
+        if len(set(zip(self.bins_y, bins_x))) != len(freq_x):
+            raise ValueError("Some spots fall in the same FFT bin, increase the padding or move them apart")
+        self.columns, self.column_index = np.unique(bins_x, return_inverse = True)
+        # Spectrum of each SLM row, only the columns with spots are used
+        self.rows = workspace.get(("fft rows",), (res_Y, self.shape[1]), np.complex64)
+
+    def slm_field(self):
+        """Returns the (res_Y, res_X) complex field on the SLM.
+        """
+        return self.workspace.get(("slm field",), (self.res_Y, self.res_X), np.complex64)
+
+    def forward(self):
+        """Field at the spots for the current SLM field.
+
+        Returns:
+            np.array: Complex field at each spot.
+        """
+        self.rows[:, :self.res_X] = self.slm_field()
+        self.rows[:, self.res_X:] = 0
+        fft_axis(self.rows, 1, self.rows)
+        columns = np.fft.fft(self.rows[:, self.columns], n = self.shape[0], axis = 0)
+        # fft_axis divides the row transforms by their length
+        return columns[self.bins_y, self.column_index].astype(np.complex128)*self.shape[1]
+
+    def backward(self, spots):
+        """Sets the SLM field to the inverse FFT of a spectrum with only the spots (up to a constant).
+
+        Args:
+            spots (np.array): Complex field at each spot.
+        """
+        columns = np.zeros((self.shape[0], len(self.columns)), dtype = np.complex64)
+        columns[self.bins_y, self.column_index] = spots
+        self.rows.fill(0)
+        self.rows[:, self.columns] = np.fft.ifft(columns, axis = 0)[:self.res_Y]
+        # In place, along a single axis (ifft2 with out is not reliable on every numpy version)
+        fft_axis(self.rows, 1, self.rows, inverse = True)
+        self.slm_field()[...] = self.rows[:, :self.res_X]
+
+
+class MRAFEngine:
+    """Computes phase-only holograms reproducing a target intensity image in the Fourier plane with the MRAF algorithm
+    (mixed-region amplitude freedom, Pasienski and DeMarco 2008): the amplitude is constrained only in a signal region around the target,
+    the light in the rest of the plane (noise region) is left free, which removes most of the speckle of plain Gerchberg-Saxton.
+    The Fourier plane is sampled on a zero-padded grid (padding times the SLM resolution) for a finer far-field resolution.
+    The padded complex grids and the placed target are kept in a WorkspaceCache, recomputing the hologram (e.g. while a parameter is
+    being changed) doesn't reallocate them, and starts from the previous hologram when the grid didn't change.
+
+    Attributes:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        efficiency (float): Fraction of the light in the signal region of the last hologram.
+        error (float): RMS error of the intensity in the signal region of the last hologram, relative to the mean target intensity.
+        iterations (int): Number of iterations done for the last hologram.
+    """
+
+    def __init__(self, workspace = None):
+        """Constructor for the MRAFEngine class.
+
+        Args:
+            workspace (:WorkspaceCache:, optional): Cache of the work arrays (can be shared with other engines). Defaults to None (new cache).
+        """
+        self.workspace = WorkspaceCache() if workspace is None else workspace
+        self.efficiency = 0.
+        self.error = 0.
+        self.iterations = 0
+        self._last_field = None
+        self._last_grid_shape = None
+        self._target_key = None
+        self._target_arrays = None
+
+    def place_target(self, target, shape, center_x, center_y, scale):
+        """Returns the target amplitude and the signal region on the (unshifted) FFT grid.
+        The two grids are allocated once per grid shape and only re-filled when the target or its placement change.
+
+        Args:
+            target (np.array): Target intensity image.
+            shape (tuple): Shape of the FFT grid.
+            center_x (int): X position of the center of the image (FFT bins from the zero order).
+            center_y (int): Y position of the center of the image (FFT bins from the zero order).
+            scale (float): FFT bins per image pixel.
+
+        Returns:
+            tuple: Target amplitude (float32, normalized to a unit power) and signal region (bool) on the FFT grid.
+        """
+        target = np.ascontiguousarray(target)
+        height = max(1, int(round(target.shape[0]*scale)))
+        width = max(1, int(round(target.shape[1]*scale)))
+        if height > shape[0] or width > shape[1]:
+            raise ValueError("The target image doesn't fit in the Fourier plane, reduce its scale or increase the padding")
+        key = (hash(target.tobytes()), target.shape, target.dtype.str, shape, center_x, center_y, height, width)
+        # Nearest neighbour resampling, then the image is wrapped around the grid (zero order at [0, 0])
+        src_rows = np.minimum(((np.arange(height) + 0.5)/scale).astype(np.int64), target.shape[0] - 1)
+        src_cols = np.minimum(((np.arange(width) + 0.5)/scale).astype(np.int64), target.shape[1] - 1)
+        rows = (center_y - height//2 + np.arange(height)) % shape[0]
+        cols = (center_x - width//2 + np.arange(width)) % shape[1]
+        amplitude_grid = self.workspace.get(("mraf target",), shape, np.float32)
+        signal = self.workspace.get(("mraf signal",), shape, np.bool_)
+        # Same target on the same work arrays (they are reallocated if the workspace evicted them)
+        if self._target_key == key and self._target_arrays[0] is amplitude_grid and self._target_arrays[1] is signal:
+            return amplitude_grid, signal
+        amplitude = np.sqrt(np.maximum(target[np.ix_(src_rows, src_cols)].astype(np.float64), 0))
+        power = np.sum(amplitude**2)
+        if power == 0:
+            raise ValueError("The target image is empty")
+        amplitude_grid.fill(0)
+        amplitude_grid[np.ix_(rows, cols)] = amplitude/np.sqrt(power)
+        signal.fill(False)
+        signal[np.ix_(rows, cols)] = True
+        self._target_key, self._target_arrays = key, (amplitude_grid, signal)
+        return amplitude_grid, signal
+
+    def compute(self, target, res_X, res_Y, out, center_x = 0., center_y = 0., scale = 1., padding = 2, mixing = 0.5, iterations = 30, warm_start = True):
+        """Computes a hologram reproducing a target intensity image.
+
+        Args:
+            target (np.array): Target intensity image (any size, placed on the padded Fourier grid).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            out (np.array): (res_Y, res_X) output phase pattern (gray levels in [0,256)).
+            center_x (float, optional): X spatial frequency of the center of the image (cycles per pixel). Defaults to 0.
+            center_y (float, optional): Y spatial frequency of the center of the image (cycles per pixel). Defaults to 0.
+            scale (float, optional): Fourier plane bins (of the padded grid) per image pixel. Defaults to 1.
+            padding (int, optional): Zero-padding factor of the Fourier grid. Defaults to 2.
+            mixing (float, optional): Fraction of the power assigned to the signal region (the MRAF m parameter). Defaults to 0.5.
+            iterations (int, optional): Number of iterations. Defaults to 30.
+            warm_start (bool, optional): If True, start from the previous hologram when computed on the same grid. Defaults to True.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        shape = (int(padding*res_Y), int(padding*res_X))
+        bin_x = int(round(center_x*shape[1]))
+        bin_y = int(round(center_y*shape[0]))
+        amplitude, signal = self.place_target(target, shape, bin_x, bin_y, scale)
+        # Target power = input power (Parseval for a unit amplitude SLM, the forward FFTs are divided by the grid size)
+        power = float(res_X)*res_Y/(float(shape[0])*shape[1])
+
+        grid = self.workspace.get(("mraf grid",), shape, np.complex64)
+        field = self.workspace.get(("mraf slm field",), (res_Y, res_X), np.complex64)
+        if not (warm_start and field is self._last_field and self._last_grid_shape == shape):
+            self._initial_field(field, center_x, center_y, signal)
+        self._last_field, self._last_grid_shape = field, shape
+
+        for iteration in range(iterations):
+            self._forward(field, grid)
+            _mraf_constraint(grid, amplitude, signal, mixing, np.sqrt(power))
+            self._backward(grid, field)
+            _normalize_field(field)
+        self.iterations = iterations
+
+        self._forward(field, grid)
+        signal_field = grid[signal]
+        intensity = np.abs(signal_field)**2
+        self.efficiency = np.sum(intensity)/power
+        wanted = amplitude[signal].astype(np.float64)**2
+        intensity = intensity/np.sum(intensity)
+        wanted = wanted/np.sum(wanted)
+        self.error = np.sqrt(np.mean((intensity - wanted)**2))/np.mean(wanted)
+        _field_to_levels(field, out)
+        return out
+
+    def _initial_field(self, field, center_x, center_y, signal):
+        """Initial guess: a linear ramp to the center of the target plus a quadratic phase spreading the light over the signal region
+        (smooth guess, avoids the optical vortices left by random phases).
+
+        Args:
+            field (np.array): SLM field to be initialized.
+            center_x (float): X spatial frequency of the center of the target (cycles per pixel).
+            center_y (float): Y spatial frequency of the center of the target (cycles per pixel).
+            signal (np.array): Signal region on the FFT grid.
+        """
+        res_Y, res_X = field.shape
+        # Half width of the signal region in cycles per pixel
+        half_x = np.count_nonzero(signal.any(axis = 0))/signal.shape[1]/2
+        half_y = np.count_nonzero(signal.any(axis = 1))/signal.shape[0]/2
+        x = np.arange(res_X) - res_X/2
+        y = np.arange(res_Y) - res_Y/2
+        phase_x = 2*np.pi*(center_x*x + half_x*x**2/res_X)
+        phase_y = 2*np.pi*(center_y*y + half_y*y**2/res_Y)
+        np.multiply(np.exp(1j*phase_y)[:, None], np.exp(1j*phase_x)[None, :], out = field)
+
+    def _forward(self, field, grid):
+        """Zero-padded FFT of the SLM field, in place in grid: along X on the SLM rows only, then along Y on the whole grid.
+        """
+        res_Y, res_X = field.shape
+        grid[:res_Y, :res_X] = field
+        grid[:res_Y, res_X:] = 0
+        grid[res_Y:] = 0
+        fft_axis(grid[:res_Y], 1, grid[:res_Y])
+        fft_axis(grid, 0, grid)
+
+    def _backward(self, grid, field):
+        """Inverse FFT back to the SLM, in place in grid: along Y on the whole grid, then along X on the SLM rows only.
+        """
+        res_Y, res_X = field.shape
+        fft_axis(grid, 0, grid, inverse = True)
+        fft_axis(grid[:res_Y], 1, grid[:res_Y], inverse = True)
+        field[...] = grid[:res_Y, :res_X]
+
+
+class SuperpositionEngine:
+    """Computes phase-only holograms of moving spots (e.g. optical tweezers) by direct superposition: the SLM phase is the phase of the sum of
+    the fields that would send the light to each spot alone (a tilt for its position in the Fourier plane and a lens for its axial shift),
+    with a fixed complex coefficient per spot (random phases, or phases optimized with the weighted Gerchberg-Saxton algorithm on the spots).
+    Tilt and lens are separable, exp(i*(2*pi*fx*x + c*x**2))*exp(i*(2*pi*fy*y + c*y**2)), so the field is a product of a (res_Y, N) and a (N, res_X) matrix.
+    When only a few spots change, their old terms are subtracted from the kept field and the new ones added (rank-2 update fused with the
+    conversion to gray levels), the cost doesn't grow with the number of spots. The field is rebuilt from scratch every resync_updates incremental
+    updates to keep the single precision rounding errors from piling up.
+
+    Attributes:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        resync_updates (int): Number of incremental updates after which the field is rebuilt.
+        uniformity (float): Uniformity of the spots after the last phase optimization, 1 - (max - min)/(max + min) of their intensities.
+        efficiency (float): Fraction of the light in the spots after the last phase optimization (spots in the Fourier plane only).
+        incremental (bool): True if the last hologram was computed with an incremental update.
+    """
+
+    def __init__(self, workspace = None, resync_updates = 256):
+        """Constructor for the SuperpositionEngine class.
+
+        Args:
+            workspace (:WorkspaceCache:, optional): Cache of the work arrays (can be shared with other engines). Defaults to None (new cache).
+            resync_updates (int, optional): Number of incremental updates after which the field is rebuilt. Defaults to 256.
+        """
+        self.workspace = WorkspaceCache() if workspace is None else workspace
+        self.resync_updates = resync_updates
+        self.uniformity = 0.
+        self.efficiency = 0.
+        self.incremental = False
+        self._field = None
+        self._spots = None
+        self._coefficients = None
+        self._rows = None
+        self._cols = None
+        self._updates = 0
+
+    def compute(self, freq_x, freq_y, curvature, res_X, res_Y, out, amplitudes = None, seed = 0):
+        """Computes the hologram of a set of spots. The spots are compared with the ones of the previous call:
+        if only a few of them changed (same number of spots and SLM resolution), the hologram is updated incrementally.
+        Unchanged spots keep their phase, new spots get a random one.
+
+        Args:
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel).
+            curvature (np.array): Lens term of each spot, in radians per squared pixel (0 for spots in the Fourier plane).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            out (np.array): (res_Y, res_X) output phase pattern (gray levels in [0,256)).
+            amplitudes (np.array, optional): Relative amplitude of each spot. Defaults to None (equal amplitudes).
+            seed (int, optional): Seed of the random phases. Defaults to 0.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        freq_x = np.asarray(freq_x, dtype = np.float64).ravel()
+        n = len(freq_x)
+        freq_y = np.broadcast_to(np.asarray(freq_y, dtype = np.float64), (n,))
+        curvature = np.broadcast_to(np.asarray(curvature, dtype = np.float64), (n,))
+        amplitudes = np.ones(n) if amplitudes is None else np.broadcast_to(np.asarray(amplitudes, dtype = np.float64), (n,))
+        spots = np.stack((freq_x, freq_y, curvature, amplitudes), axis = 1)
+        field = self.workspace.get(("superposition field",), (res_Y, res_X), np.complex64)
+
+        changed = None
+        if field is self._field and self._spots is not None and self._spots.shape == spots.shape and self._updates < self.resync_updates:
+            changed = np.flatnonzero(np.any(spots != self._spots, axis = 1))
+        # The incremental update costs two terms per moved spot, the rebuild one matrix product
+        self.incremental = changed is not None and 2*len(changed) <= max(n//2, 2)
+        if not self.incremental:
+            # New spots (or all of them, the first time) get random phases, the others keep their coefficient
+            coefficients = amplitudes*np.exp(1j*np.random.default_rng(seed).uniform(0, 2*np.pi, n))
+            kept = 0 if self._spots is None else min(n, len(self._spots))
+            if kept > 0:
+                coefficients[:kept] = self._coefficients[:kept]*(amplitudes[:kept]/np.maximum(self._spots[:kept, 3], 1e-30))
+            self._coefficients = coefficients.astype(np.complex64)
+            self._rows = self._factors(freq_y, curvature, res_Y)
+            self._cols = self._factors(freq_x, curvature, res_X)
+            self._spots, self._field, self._updates = spots, field, 0
+            self.rebuild(out)
+            return out
+
+        if len(changed) == 0:
+            _field_to_levels(field, out)
+            return out
+        rows = self._factors(freq_y[changed], curvature[changed], res_Y)
+        cols = self._factors(freq_x[changed], curvature[changed], res_X)
+        old = self._coefficients[changed]
+        new = (old*(amplitudes[changed]/np.maximum(self._spots[changed, 3], 1e-30))).astype(np.complex64)
+        _superposition_update(field, np.concatenate((self._rows[changed], rows)), np.concatenate((self._cols[changed], cols)),
+                              np.concatenate((-old, new)), out)
+        self._rows[changed], self._cols[changed], self._coefficients[changed] = rows, cols, new
+        self._spots = spots
+        self._updates += 1
+        return out
+
+    def optimize(self, out, iterations = 10):
+        """Optimizes the phases (and weights) of the current spots with the weighted Gerchberg-Saxton algorithm, then rebuilds the hologram.
+        The field at each spot is computed from the phase-only SLM field with the same separable factors (two matrix products).
+
+        Args:
+            out (np.array): Output phase pattern.
+            iterations (int, optional): Number of iterations. Defaults to 10.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        if self._spots is None or len(self._spots) == 0:
+            return out
+        field = self._field
+        targets = self._spots[:, 3]
+        weights = np.abs(self._coefficients).astype(np.float64)
+        for iteration in range(iterations + 1):
+            _normalize_field(field)
+            # Field at each spot: sum over the pixels of the SLM field times the conjugate of the spot term
+            spots = np.einsum('ki,ik->k', np.conj(self._rows), field @ np.conj(self._cols).T)/field.size
+            amplitudes = np.abs(spots)
+            intensity = (amplitudes/np.maximum(targets, 1e-30))**2
+            self.uniformity = 1 - (intensity.max() - intensity.min())/max(intensity.max() + intensity.min(), 1e-30)
+            self.efficiency = np.sum(amplitudes**2)
+            if iteration == iterations:
+                break
+            ratios = amplitudes/np.maximum(targets, 1e-30)
+            weights *= np.mean(ratios)/np.maximum(ratios, 1e-30)
+            self._coefficients = (weights*spots/np.maximum(amplitudes, 1e-30)).astype(np.complex64)
+            self._build_field(field)
+        return self.rebuild(out)
+
+    def rebuild(self, out):
+        """Rebuilds the field from scratch from the current spots and converts it to gray levels.
+
+        Args:
+            out (np.array): Output phase pattern.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        self._build_field(self._field)
+        self._updates = 0
+        _field_to_levels(self._field, out)
+        return out
+
+    def _build_field(self, field):
+        """Writes the superposition of the spot terms in field (one matrix product).
+        """
+        np.matmul(self._rows.T*self._coefficients, self._cols, out = field)
+
+    @staticmethod
+    def _factors(frequencies, curvature, n):
+        """Returns the (K, n) matrix of the terms exp(i*(2*pi*f*k + c*k**2)) of K spots, with k centered on the SLM.
+        """
+        k = np.arange(n) - (n - 1)/2
+        return np.exp(1j*(2*np.pi*np.outer(frequencies, k) + np.outer(curvature, k**2))).astype(np.complex64)
+
+
+class GradientSpotEngine:
+    """Computes phase-only holograms of spot arrays by minimizing a cost mixing efficiency and uniformity with L-BFGS, the pixel phases being the variables.
+    The cost is C = -efficiency + uniformity_weight*U, U being the mean squared relative error of the spot intensity fractions.
+    Its gradient is computed analytically with one propagation to the spots and one back (the same propagators as SpotArrayEngine), C depends on the
+    SLM phase only through the spot fields F_m, so dC/dphase = -2*Im(exp(i*phase)*conj(sum(dC/dI_m*F_m*w_m)))/N**2, w_m being the wave of spot m.
+    Gerchberg-Saxton plateaus in uniformity, starting from its result (or from the current pattern, for small edits of the targets) this engine
+    goes on improving it. The phases, gradients and the L-BFGS history are float32 arrays kept in the WorkspaceCache.
+
+    Attributes:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        history (int): Number of (step, gradient change) pairs kept by L-BFGS.
+        uniformity (float): Uniformity of the spot intensities of the last hologram, 1 - (max - min)/(max + min).
+        efficiency (float): Fraction of the light in the spots of the last hologram (pixel envelope excluded).
+        cost (float): Final value of the cost.
+        iterations (int): Number of L-BFGS iterations done for the last hologram.
+        method (str): Propagator used for the last hologram ("separable" or "fft").
+    """
+
+    def __init__(self, workspace = None, history = 5):
+        """Constructor for the GradientSpotEngine class.
+
+        Args:
+            workspace (:WorkspaceCache:, optional): Cache of the work arrays (can be shared with other engines). Defaults to None (new cache).
+            history (int, optional): Number of pairs kept by L-BFGS. Defaults to 5.
+        """
+        self.workspace = WorkspaceCache() if workspace is None else workspace
+        self.history = history
+        self.uniformity = 0.
+        self.efficiency = 0.
+        self.cost = 0.
+        self.iterations = 0
+        self.method = None
+
+    def compute(self, freq_x, freq_y, res_X, res_Y, out, initial_phase, intensities = None, iterations = 50, uniformity_weight = 100., tolerance = 1e-7, method = "auto", padding = 1):
+        """Optimizes a hologram producing spots at the given spatial frequencies.
+
+        Args:
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel, within +-0.5).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel, within +-0.5).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            out (np.array): (res_Y, res_X) output phase pattern (gray levels in [0,256)).
+            initial_phase (np.array): Phase pattern (gray levels) to start from, e.g. a Gerchberg-Saxton result or the current pattern. Can be out itself.
+            intensities (np.array, optional): Relative target intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of iterations. Defaults to 50.
+            uniformity_weight (float, optional): Weight of the non-uniformity in the cost. Defaults to 100.
+            tolerance (float, optional): The iterations stop once the cost changes by less than this. Defaults to 1e-7.
+            method (str, optional): "separable", "fft" or "auto". Defaults to "auto".
+            padding (int, optional): Zero-padding factor of the FFT grid. Defaults to 1.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        freq_x = np.atleast_1d(np.asarray(freq_x, dtype = np.float64))
+        freq_y = np.atleast_1d(np.asarray(freq_y, dtype = np.float64))
+        if freq_x.shape != freq_y.shape or freq_x.ndim != 1 or len(freq_x) == 0:
+            raise ValueError("Spots must be given as two 1D arrays of the same length")
+        targets = np.ones(len(freq_x)) if intensities is None else np.asarray(intensities, dtype = np.float64)
+        if targets.shape != freq_x.shape:
+            raise ValueError("One intensity per spot is needed")
+        targets = targets/np.sum(targets)
+        propagator, self.method = _make_propagator(self.workspace, freq_x, freq_y, res_X, res_Y, method, padding)
+
+        shape = (res_Y, res_X)
+        phase = self.workspace.get(("lbfgs phase",), shape, np.float32)
+        trial = self.workspace.get(("lbfgs trial",), shape, np.float32)
+        grad = self.workspace.get(("lbfgs gradient",), shape, np.float32)
+        trial_grad = self.workspace.get(("lbfgs trial gradient",), shape, np.float32)
+        direction = self.workspace.get(("lbfgs direction",), shape, np.float32)
+        steps = self.workspace.get(("lbfgs steps",), (self.history,) + shape, np.float32)
+        changes = self.workspace.get(("lbfgs changes",), (self.history,) + shape, np.float32)
+        np.multiply(initial_phase, 2*np.pi/256, out = phase)
+
+        def evaluate(phase, grad):
+            # Cost and gradient at phase (intensities normalized to the power on the SLM)
+            field = propagator.slm_field()
+            _phase_to_field(phase, field)
+            spots = propagator.forward()
+            n_pixels = float(res_X*res_Y)
+            intensity = np.abs(spots)**2/n_pixels**2
+            efficiency = np.sum(intensity)
+            fractions = intensity/efficiency
+            error = fractions - targets
+            norm = np.sum(targets**2)
+            cost = -efficiency + uniformity_weight*np.sum(error**2)/norm
+            # dC/dI_m, then back-propagation of dC/dI_m*F_m (backward is the adjoint up to adjoint_scale)
+            derivative = -1 + uniformity_weight*2/(efficiency*norm)*(error - np.sum(error*fractions))
+            propagator.backward(derivative*spots)
+            _phase_gradient(phase, field, -2*propagator.adjoint_scale/n_pixels**2, grad)
+            return cost, efficiency, intensity
+
+        cost, _, _ = evaluate(phase, grad)
+        rho = []
+        self.iterations = 0
+        for iteration in range(iterations):
+            # L-BFGS two-loop recursion, the newest pair last
+            np.negative(grad, out = direction)
+            alphas = []
+            for k in reversed(range(len(rho))):
+                slot = (iteration - len(rho) + k) % self.history
+                alpha = rho[k]*np.vdot(steps[slot], direction)
+                _add_scaled(direction, -alpha, changes[slot])
+                alphas.append(alpha)
+            if len(rho) > 0:
+                slot = (iteration - 1) % self.history
+                direction *= 1/(rho[-1]*np.vdot(changes[slot], changes[slot]))
+            else:
+                # First step: at most 0.1 rad on any pixel
+                direction *= 0.1/max(grad.max(), -grad.min(), 1e-30)
+            for k in range(len(rho)):
+                slot = (iteration - len(rho) + k) % self.history
+                beta = rho[k]*np.vdot(changes[slot], direction)
+                _add_scaled(direction, alphas[len(rho) - 1 - k] - beta, steps[slot])
+            slope = np.vdot(grad, direction)
+            if slope >= 0:
+                # Not a descent direction, restart from the gradient
+                rho = []
+                np.multiply(grad, -0.1/max(grad.max(), -grad.min(), 1e-30), out = direction)
+                slope = np.vdot(grad, direction)
+            # Backtracking line search (Armijo condition)
+            step = 1.
+            for attempt in range(20):
+                np.multiply(direction, step, out = trial)
+                trial += phase
+                trial_cost, _, _ = evaluate(trial, trial_grad)
+                if trial_cost <= cost + 1e-4*step*slope:
+                    break
+                step *= 0.5
+            else:
+                break
+            slot = iteration % self.history
+            np.subtract(trial, phase, out = steps[slot])
+            np.subtract(trial_grad, grad, out = changes[slot])
+            curvature = np.vdot(steps[slot], changes[slot])
+            phase[...] = trial
+            grad[...] = trial_grad
+            self.iterations = iteration + 1
+            improvement = cost - trial_cost
+            cost = trial_cost
+            if curvature > 0:
+                rho.append(1/curvature)
+                rho = rho[-self.history:]
+            else:
+                rho = []
+            if improvement < tolerance:
+                break
+
+        self.cost, self.efficiency, intensity = evaluate(phase, grad)
+        ratios = intensity/targets
+        self.uniformity = 1 - (ratios.max() - ratios.min())/max(ratios.max() + ratios.min(), 1e-30)
+        np.multiply(phase, 256/(2*np.pi), out = out)
+        np.mod(out, 256, out = out)
+        return out
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""Kernel_warmup.py: Compiles the numba kernels in the background while the GUI starts.
+Run it as a script (python -m SLMcontroller.Kernel_warmup) after installing or updating the package
+to fill the numba cache, so that even the first session doesn't compile anything."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import numpy as np
+
+import SLMcontroller.Correction_bank as Correction_bank
+import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Render_pipeline as Render_pipeline
+
+# Size of the SLM used to run the kernels, only the compilation matters
+WARMUP_RES_X = 16
+WARMUP_RES_Y = 12
+
+def warm_up(dtypes = (np.float32, np.float64)):
+    """Compiles (or loads from the numba cache) the kernels used to render holograms and to run the optimizer.
+    The kernels are run through the same functions used by the GUI on a tiny SLM, so that exactly the
+    specializations used later (data types, read-only coordinates, ...) are compiled.
+
+    Args:
+        dtypes (tuple, optional): Pattern data types to compile the kernels for. Defaults to (np.float32, np.float64).
+    """
+    start = time.perf_counter()
+    Phase_pattern.apply_threads()
+    res_X, res_Y = WARMUP_RES_X, WARMUP_RES_Y
+    coefficients = np.full(15, 1e-3)
+    aperture = Phase_pattern.Aperture(res_X/2, res_Y/2, res_Y/3)
+    # Interpolation of the flatness corrections between calibrated wavelengths
+    correction = np.zeros((res_Y, res_X), dtype = np.uint8)
+    Correction_bank._interpolate_wrapped(correction, correction, np.float32(0.5), np.empty((res_Y, res_X), dtype = np.float32))
+    for dtype in dtypes:
+        generator = Phase_pattern.Patter_generator(dtype)
+        lens = generator.GenerateLens(100, 800, 8, res_X, res_Y)
+        grating = generator.GenerateGrating(800, 8, 3.3, 0.1, res_X, res_Y)
+        generator.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+        generator.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2, aperture)
+        analytic = Phase_pattern.AnalyticPattern(res_X, res_Y)
+        analytic.add_grating(800, 8, 3.3, 0.1)
+        analytic.add_lens(100, 800, 8)
+        analytic.add_zernike(coefficients, res_X//2, res_Y//2, aperture)
+        pattern = generator.GenerateAnalytic(analytic)
+        generator.GenerateAnalytic(analytic, out = pattern, accumulate = True)
+        mask = np.ones((res_Y, res_X))
+        for masks in ((), (mask,), (mask, mask)):
+            Render_pipeline.render_frame(pattern, 255, masks)
+        Render_pipeline.render_tiled(generator, analytic, [], 255)
+        Render_pipeline.render_tiled(generator, analytic, [lens], 255, [mask])
+        for quantizer in Render_pipeline.QUANTIZERS[1:]:
+            Render_pipeline.render_frame(pattern, 255, (mask,), quantizer = quantizer)
+            Render_pipeline.render_tiled(generator, analytic, [lens], 255, [mask], quantizer = quantizer)
+        crosstalk = Render_pipeline.CrosstalkCompensator(0.5)
+        for quantizer in Render_pipeline.QUANTIZERS:
+            Render_pipeline.render_frame(pattern, 255, (mask,), quantizer = quantizer, crosstalk = crosstalk)
+        for encoding in Render_pipeline.ENCODINGS[1:]:
+            for quantizer in Render_pipeline.QUANTIZERS:
+                Render_pipeline.render_frame(pattern, 255, (mask,), quantizer = quantizer, encoding = encoding)
+            Render_pipeline.render_frame(pattern, 255, (mask,), crosstalk = crosstalk, encoding = encoding)
+            Render_pipeline.render_tiled(generator, analytic, [lens], 255, [mask], encoding = encoding)
+        for tables in (np.arange(256), np.tile(np.arange(256), (2, 2, 1))):
+            Render_pipeline.render_frame(pattern, 255, lut = Render_pipeline.LookupTable(tables, 4))
+        generator.GenerateSpotArray([1., 2.], [0., 1.], 8, res_X, res_Y, iterations = 1)
+        generator.GenerateSpotArrayOptimized([1., 2.], [0., 1.], 8, res_X, res_Y, iterations = 1, gs_iterations = 1)
+        generator.GenerateSpotArray3D([1., 2.], [0., 1.], [0., 1.], 800, 8, 100, res_X, res_Y, iterations = 1)
+        generator.GenerateDefocus(1., 100, 800, 8, res_X, res_Y)
+        import SLMcontroller.Propagation as Propagation
+        Propagation.propagate(np.ones((res_Y, res_X), dtype = np.complex64), 800, 8, 1.)
+        generator.GenerateTargetImage(np.ones((4, 4)), 8, res_X, res_Y, iterations = 1)
+        generator.GenerateTraps([1., 2.], [0., 1.], [0., 10.], 800, 8, res_X, res_Y)
+        generator.GenerateTraps([1., 3.], [0., 1.], [0., 10.], 800, 8, res_X, res_Y, optimize = 1)
+        warm_up_optimizer(grating, lens)
+    print("Numba kernels ready (%.1f s)" % (time.perf_counter() - start))
+
+def warm_up_optimizer(grating, interf_grating):
+    """Compiles the kernels of the wavefront optimizer.
+
+    Args:
+        grating (np.array): Offset grating pattern.
+        interf_grating (np.array): Interference grating pattern.
+    """
+    # Imported here as the optimizer module needs the GUI libraries
+    import SLMcontroller.WavefrontOptim as WavefrontOptim
+    res_Y, res_X = grating.shape
+    mesh = np.zeros((res_Y, res_X))
+    mesh[:, res_X//2:] = 1
+    pattern = WavefrontOptim.load_pattern(mesh, grating, interf_grating, 0., res_X, res_Y, 0, 1)
+    WavefrontOptim.next_step_fast(res_X, res_Y, mesh, interf_grating, 1, pattern, 0.)
+
+def start():
+    """Starts the warm-up in a background thread.
+
+    Returns:
+        threading.Thread: Warm-up thread.
+    """
+    thread = threading.Thread(target = warm_up, name = "Kernel warm-up", daemon = True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    warm_up()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""LUT.py: Generates a tab used to load a gray-level lookup table (LUT) correcting the nonlinear phase response of the SLM, global or spatially varying."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+from PyQt6.QtWidgets import QMessageBox, QLineEdit, QGridLayout, QCheckBox, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QFileDialog, QLabel, QSpinBox
+from PyQt6.QtCore import Qt
+
+import SLMcontroller.utils as utils
+import SLMcontroller.Render_pipeline as Render_pipeline
+import numpy as np
+
+class LUTTab(QWidget):
+    """Generates a tab used to load a gray-level lookup table. Unlike the other elements the LUT doesn't add a phase pattern:
+    it is applied to the gray levels of the frame, after the phase correction and the amplitude masks (see Render_pipeline.LookupTable).
+    A LUT mapping the full 0..255 range to a 2pi phase shift is meant to be used with a phase correction of 255.
+
+    Attributes:
+        lut (:LookupTable:): Loaded lookup table (None if no file is loaded).
+        settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution.
+        hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        loaded_file (str): Path to the loaded LUT file.
+        loaded_block (int): Block size used to interpolate the loaded LUT.
+    """
+    def __init__(self, pattern_generator, settings_manager, hologram_manager):
+        """Constructor for the LUTTab class.
+
+        Args:
+            pattern_generator (:Pattern_generator:): Pattern generator object. Added for consistency with other classes (not used here)
+            settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution.
+            hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        """
+        super().__init__()
+        self.pattern_generator = pattern_generator
+        self.settings_manager = settings_manager
+        self.hologram_manager = hologram_manager
+        self.lut = None
+        self.loaded_file = ""
+        self.loaded_block = None
+        self.Init_GUI()
+
+    def Init_GUI(self):
+        """Generates the GUI elements of the tab.
+
+        The tab contains:
+        - A text field to enter the path to the LUT file, a button to select it and one to load it.
+        - A spinbox for the size of the blocks of pixels sharing the same interpolated table (spatially varying LUTs).
+        - A label describing the loaded LUT and a preview of its tables (output level vs input level).
+        - A checkbox to activate the LUT.
+        """
+        self.layout = QGridLayout()
+
+        self.lut_loading_layout = QVBoxLayout()
+        self.lut_preview_layout = QVBoxLayout()
+        self.general_controls = QHBoxLayout()
+
+        self.lut_path = QLineEdit("")
+        self.selectfile = QPushButton("Open LUT file")
+        self.selectfile.clicked.connect(self.loadLUTFromFile)
+        self.loadlut = QPushButton("Load LUT file")
+        self.loadlut.clicked.connect(self.update_lut)
+        self.spin_block = QSpinBox()
+        self.spin_block.setPrefix("Interpolation block: ")
+        self.spin_block.setSuffix(" px")
+        self.spin_block.setMinimum(1)
+        self.spin_block.setMaximum(512)
+        self.spin_block.setValue(Render_pipeline.LUT_BLOCK)
+        self.spin_block.setKeyboardTracking(False)
+        self.spin_block.valueChanged.connect(self.update_lut)
+        self.info_label = QLabel("No LUT loaded")
+
+        self.lut_image = utils.ImageWidget()
+
+        self.isactive = QCheckBox("Activate element : ")
+        self.isactive.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+
+        self.lut_loading_layout.addWidget(self.lut_path)
+        self.lut_loading_layout.addWidget(self.selectfile)
+        self.lut_loading_layout.addWidget(self.loadlut)
+        self.lut_loading_layout.addWidget(self.spin_block)
+        self.lut_loading_layout.addWidget(self.info_label)
+        self.layout.addLayout(self.lut_loading_layout,0,0)
+
+        self.lut_preview_layout.addWidget(self.lut_image)
+        self.layout.addLayout(self.lut_preview_layout,1,0)
+
+        self.general_controls.addWidget(self.isactive)
+        self.layout.addLayout(self.general_controls,2,0)
+
+        self.setLayout(self.layout)
+
+    def loadLUTFromFile(self):
+        """Opens a prompt to select the LUT file and loads it.
+        """
+        name = QFileDialog.getOpenFileName(self,"Open File","${HOME}","LUT files (*.lut *.blt *.txt *.csv *.npy);;",)
+        self.lut_path.setText(name[0])
+        self.update_lut()
+
+    def update_lut(self):
+        """Loads the LUT file (connected to the load button and to the block size) and updates the SLM window if the LUT is active.
+        """
+        if self.load_lut() and self.is_active():
+            self.hologram_manager.updateSLMWindow()
+
+    def load_lut(self):
+        """Loads the LUT file, if the path or the block size changed.
+
+        Returns:
+            bool: True if a LUT is loaded, False otherwise.
+        """
+        if self.loaded_file == self.lut_path.text() and self.loaded_block == self.spin_block.value() and self.lut is not None:
+            return True
+        try:
+            self.lut = Render_pipeline.load_lut(self.lut_path.text(), self.spin_block.value())
+        except (OSError, ValueError) as error:
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText("There was an error loading the LUT file: " + str(error))
+            dlg.exec()
+            self.lut = None
+            self.loaded_file = ""
+            self.info_label.setText("No LUT loaded")
+            return False
+        self.loaded_file = self.lut_path.text()
+        self.loaded_block = self.spin_block.value()
+        self.lut.prepare(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+        if self.lut.is_global():
+            self.info_label.setText("Global LUT")
+        else:
+            grid_Y, grid_X = self.lut.tables.shape[:2]
+            self.info_label.setText("%dx%d grid of LUTs, interpolated over blocks of %d px" % (grid_X, grid_Y, self.lut.block))
+        self.lut_image.setImage(self.preview())
+        return True
+
+    def preview(self):
+        """Draws the tables of the LUT (output level vs input level, one curve per region of the grid).
+
+        Returns:
+            np.array: 256x256 image.
+        """
+        image = np.zeros((256, 256), dtype = np.uint8)
+        levels = np.arange(256)
+        for table in self.lut.tables.reshape(-1, 256):
+            image[255 - np.rint(table).astype(int), levels] = 255
+        return image
+
+    def get_lut(self):
+        """Returns the lookup table.
+
+        Returns:
+            :LookupTable: Loaded lookup table, None if no file is loaded.
+        """
+        if self.lut_path.text() != "" and not self.load_lut():
+            return None
+        return self.lut
+
+    def is_active(self):
+        """Checks if the LUT element is active.
+
+        Returns:
+            bool: True if the LUT element is active, False otherwise.
+        """
+        return self.isactive.isChecked()
@@ -145,6 +145,18 @@ class LensTab(QWidget):
         self.lastvals = [self.focus,self.settings_manager.get_wavelength(),self.settings_manager.get_pixel_pitch(),self.settings_manager.get_X_res(),self.settings_manager.get_Y_res()]
         
     
+    def get_analytic_terms(self, terms):
+        """Adds the lens to a closed-form pattern description (used by the fused render mode).
+
+        Args:
+            terms (:AnalyticPattern:): Pattern description the lens is added to.
+
+        Returns:
+            bool: True, the lens is always described in closed form.
+        """
+        terms.add_lens(self.focus, self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch())
+        return True
+
     def needs_updates(self):
         """Checks if the lens needs to be updated.
 
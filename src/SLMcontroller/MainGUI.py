@@ -17,24 +17,19 @@ from PyQt6.QtGui import QPixmap, QImage, QAction, QScreen
 
 import numpy as np
 import SLMcontroller.settings as settings
-import SLMcontroller.CameraFunctions as CameraFunctions
 import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Render_pipeline as Render_pipeline
 import SLMcontroller.OpticalElement as opticalElement
 import SLMcontroller.Lens as Lens
 import SLMcontroller.Grating as Grating
-import SLMcontroller.FourierWavefrontOptim as FourierWavefrontOptim
-import SLMcontroller.WavefrontOptim as WavefrontOptim
-import SLMcontroller.FlatnessCorrection as FlatnessCorrection
-import SLMcontroller.AmplitudeMask as AmplitudeMask
-import SLMcontroller.Meshing_process as Meshing_process
-import SLMcontroller.Zernike as Zernike
-import SLMcontroller.Remote_control as Remote_control
+import SLMcontroller.Startup_timing as Startup_timing
 import SLMcontroller.utils as utils
 
+# The other tabs, the camera and the meshing process (cv2, gmsh, flask, PIL, tkinter, ...) are imported when first used
+
 from multiprocessing import RLock, Event, Queue, Process, Condition, freeze_support
 import threading
 
-from PIL import Image
 from io import BytesIO
 
 
@@ -124,6 +119,8 @@ class HologramsManager():
             pattern_generator (:Pattern_generator:): Pattern generator class used to generate the phase patterns.
             tabwidget (QTabWidget): QTabWidget parent object. Used to locate the parent object in the screen and open warnings/errors on top of that.
             pattern (np.array): Phase pattern currently being rendered on the SLM.
+            frame (np.array): uint8 frame currently displayed on the SLM (reused from one render to the next).
+            crosstalk (:CrosstalkCompensator:): Crosstalk precompensation of the SLM pixels (None if disabled in the settings).
         """
         self.optical_elements = {}
         self.SLMWindow = SLMwindow
@@ -131,6 +128,8 @@ class HologramsManager():
         self.pattern_generator = pattern_generator
         self.tabwidget = tabwidget
         self.pattern = None
+        self.frame = None
+        self.crosstalk = None
 
     def addElementToList(self, id, elem):
         """Adds an optical element to the list of active optical elements
@@ -201,9 +200,11 @@ class HologramsManager():
             others (bool): If True, the other active optical elements will be rendered on the SLM as well
         """
         print("rendering")
-        if self.pattern is None:
-            self.pattern = self.pattern_generator.empty_pattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
-        self.pattern = np.copy(pattern)
+        if self.settings_manager.get_render_mode() == 2:
+            self.renderTiledPattern([pattern], others)
+            return
+        self.pattern = self.pattern_generator.output_buffer(self.pattern, pattern.shape[1], pattern.shape[0])
+        np.copyto(self.pattern, pattern)
         if others == True:
             self.getPatterns()
         self.renderPattern()
@@ -212,9 +213,10 @@ class HologramsManager():
         """Returns the phase pattern currently being rendered on the SLM in PNG image format for remote clients.
             Calls the NetworkManager.send_image which sends the contents of a file to the client.
         """
-        if self.pattern is None:
+        if self.frame is None:
             return 404
-        img = Image.fromarray(self.pattern.astype('uint8'))
+        from PIL import Image
+        img = Image.fromarray(self.frame)
         file_object = BytesIO()
         img.save(file_object, 'PNG')
         file_object.seek(0)
@@ -229,13 +231,26 @@ class HologramsManager():
         For each wavelenght the maximum uint8 phase value is usually given by the company but can also be measured
         e.g. at 760nm 255(2pi) ---> 226(new 2pi value)
         So we need to renormalize the hologram such that value%226
+        The user amplitude scalings are applied in the same pass, the result is written in the reused uint8 frame.
+        The phase is quantized with the quantizer chosen in the settings (truncation, rounding or dithering),
+        after the precompensation of the pixel crosstalk if enabled.
         """
-        self.pattern = (np.mod(self.pattern,256)*(self.settings_manager.get_phase_correction())/255).astype(np.uint8)
+        self.frame = Render_pipeline.render_frame(self.pattern, self.settings_manager.get_phase_correction(), self.getAmplitudeScalings(), self.frame,
+                                                  quantizer = self.settings_manager.get_quantizer(), crosstalk = self.getCrosstalkCompensator(), lut = self.getLookupTable(),
+                                                  encoding = self.getAmplitudeEncoding())
 
-        ## Renormalize pattern by the user amplitude scalings
-        amplitudesScalings = self.getAmplitudeScalings()
-        for pattern in amplitudesScalings:
-            self.pattern = np.mod(np.multiply(self.pattern,pattern),256).astype(np.uint8)
+    def getCrosstalkCompensator(self):
+        """Returns the crosstalk precompensation matching the settings (kept from one render to the next to reuse its buffers).
+
+        Returns:
+            :CrosstalkCompensator: Crosstalk precompensation, None if disabled.
+        """
+        width = self.settings_manager.get_crosstalk_width()
+        if width <= 0:
+            self.crosstalk = None
+        elif self.crosstalk is None or self.crosstalk.width != width:
+            self.crosstalk = Render_pipeline.CrosstalkCompensator(width)
+        return self.crosstalk
 
     def getAmplitudeScalings(self):
         """Returns the amplitude scalings of the active optical elements
@@ -250,14 +265,55 @@ class HologramsManager():
                     if type(self.optical_elements[el]).__name__ == "AmplitudeMaskTab":
                         amplitudesScaling.append(self.optical_elements[el].get_pattern())
         return amplitudesScaling
+
+    def getAmplitudeEncoding(self):
+        """Returns the encoding of the amplitude masks (set in the first active amplitude mask element).
+
+        Returns:
+            str: Encoding, one of Render_pipeline.ENCODINGS.
+        """
+        for el in self.optical_elements:
+            if el is not None:
+                if self.optical_elements[el].is_active():
+                    if type(self.optical_elements[el]).__name__ == "AmplitudeMaskTab":
+                        return self.optical_elements[el].get_encoding()
+        return "scaling"
+
+    def getLookupTable(self):
+        """Returns the lookup table of the first active LUT element.
+
+        Returns:
+            :LookupTable: Lookup table, None if no LUT element is active.
+        """
+        for el in self.optical_elements:
+            if el is not None:
+                if self.optical_elements[el].is_active() and hasattr(self.optical_elements[el], "get_lut"):
+                    lut = self.optical_elements[el].get_lut()
+                    if lut is not None:
+                        return lut
+        return None
         
-    def getPatterns(self):
-        """This function gets all the patterns from the active elements and combines them
+    def collectPatterns(self, analytic = None):
+        """Collects the patterns of the active elements.
+
+        Args:
+            analytic (:AnalyticPattern:, optional): If given, the elements that can describe their phase in closed form (get_analytic_terms) are added to it instead. Defaults to None.
+
+        Returns:
+            list: Patterns of the (other) active elements, None if one of them doesn't match the SLM resolution.
         """
-        amplitudesScaling = []
+        patterns = []
         for el in self.optical_elements:
             if el is not None:
                 if self.optical_elements[el].is_active():
+                    # LUT elements act on the gray levels of the frame, amplitude masks are applied when quantizing the phase
+                    if hasattr(self.optical_elements[el], "get_lut"):
+                        continue
+                    if hasattr(self.optical_elements[el], "is_amplitude") and self.optical_elements[el].is_amplitude():
+                        continue
+                    if analytic is not None and hasattr(self.optical_elements[el], "get_analytic_terms"):
+                        if self.optical_elements[el].get_analytic_terms(analytic):
+                            continue
                     pattern_from_el = self.optical_elements[el].get_pattern()
                     if (pattern_from_el.shape[1] != self.settings_manager.get_X_res()) or (pattern_from_el.shape[0] != self.settings_manager.get_Y_res()) :
                         dlg = QMessageBox(self.tabwidget)
@@ -266,23 +322,70 @@ class HologramsManager():
                         dlg.setText("One of the optical elements don't match with the SLM resolution. Please check the settings.")
                         button = dlg.exec()
                         if button == QMessageBox.StandardButton.Ok:
-                            return	4444
-                    self.pattern += pattern_from_el
+                            return None
+                    patterns.append(pattern_from_el)
+        return patterns
+
+    def getPatterns(self):
+        """This function gets all the patterns from the active elements and combines them.
+        In the fused analytic render mode, the elements that can describe their phase in closed form (get_analytic_terms) 
+        are evaluated together in a single pass, the others are added one by one.
+        """
+        analytic = None
+        if self.settings_manager.get_render_mode() == 1:
+            analytic = Phase_pattern.AnalyticPattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+        patterns = self.collectPatterns(analytic)
+        if patterns is None:
+            return	4444
+        for pattern_from_el in patterns:
+            self.pattern += pattern_from_el
+        if analytic is not None and not analytic.is_empty():
+            self.pattern_generator.GenerateAnalytic(analytic, out = self.pattern, accumulate = True)
+
+    def renderTiledPattern(self, patterns, others = True):
+        """Renders the hologram tile by tile (tiled render mode): the full phase pattern is never built, 
+        each tile is generated, combined and quantized while it is in cache.
+        With the crosstalk precompensation enabled the whole frame is needed, the hologram is then rendered in one piece.
+
+        Args:
+            patterns (list): Phase patterns to be rendered (e.g. from an algorithm).
+            others (bool, optional): If True, the active optical elements are rendered as well. Defaults to True.
+        """
+        analytic = Phase_pattern.AnalyticPattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+        if others:
+            collected = self.collectPatterns(analytic)
+            if collected is None:
+                return	4444
+            patterns = patterns + collected
+        self.frame = Render_pipeline.render_tiled(self.pattern_generator, analytic, patterns, self.settings_manager.get_phase_correction(), self.getAmplitudeScalings(), self.frame,
+                                                  quantizer = self.settings_manager.get_quantizer(), lut = self.getLookupTable(), encoding = self.getAmplitudeEncoding(),
+                                                  crosstalk = self.getCrosstalkCompensator())
+        self.showFrame()
 
     def renderPattern(self):
         """This function does the actual render of the phase pattern. Updates the QPixmap used on the SLM window
         """   
         self.RenormalizePattern()
-        q_img = QImage(self.pattern, self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(), self.settings_manager.get_X_res(), QImage.Format.Format_Grayscale8)
+        self.showFrame()
+
+    def showFrame(self):
+        """Shows the current frame on the SLM window.
+        """
+        q_img = QImage(self.frame, self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(), self.settings_manager.get_X_res(), QImage.Format.Format_Grayscale8)
 #        label = QLabel(self)
         pixmap = QPixmap(q_img)
         self.SLMWindow.ResizeWindow(self.settings_manager.get_X_win_size(),self.settings_manager.get_Y_win_size())
         self.SLMWindow.UpdatePattern(pixmap)
+        Startup_timing.mark("first hologram")
 
     def updateSLMWindow(self):
-        """This function updates the SLM window when a new pattern is generated
+        """This function updates the SLM window when a new pattern is generated (the pattern buffer is reused)
         """
-        self.pattern = self.pattern_generator.empty_pattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())     
+        if self.settings_manager.get_render_mode() == 2:
+            self.renderTiledPattern([])
+            return
+        self.pattern = self.pattern_generator.output_buffer(self.pattern, self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+        self.pattern.fill(0)
         self.getPatterns()
         self.renderPattern()
         
@@ -301,13 +404,17 @@ class First(QtWidgets.QMainWindow):
         possible_optical_elements (list): List of possible optical elements that can be added to the GUI.
         tabs_constructors (list): List of functions used to generate the optical elements tabs.
         SLMWindow (QWidget): QWidget used to render the complete hologram on the SLM.
-        mesh_process (Process): Process used to handle the meshing of the optical elements.
+        mesh_process (Process): Process used to handle the meshing of the optical elements (None till it is first needed, see get_mesh_process).
     """
     def __init__(self, mesh_process, flaskApp, queue, eventsDict, conditionsDict, parent=None):
         """Initializes the main window of the GUI
 
         Args:
-            mesh_process (Process): Process used to handle the meshing of the optical elements.
+            mesh_process (Process): Process used to handle the meshing of the optical elements. If None, it is started the first time it is needed.
+            flaskApp (:NetworkManager:): Remote control server (Flask is imported when the server thread starts).
+            queue (Queue): Queue used to communicate with the meshing process.
+            eventsDict (dict): Events used to synchronize the meshing process with the GUI.
+            conditionsDict (dict): Conditions used to synchronize the meshing process with the GUI.
             parent (_type_, optional): Parent class. Defaults to None.
         """
         super(First, self).__init__(parent)
@@ -315,7 +422,7 @@ class First(QtWidgets.QMainWindow):
         #centerPoint = QGuiApplication.primaryScreen().availableGeometry()
         self.setWindowTitle("SLM hologram control")
         self.settings_manager = settings.SettingsManager()
-        self.pattern_generator = Phase_pattern.Patter_generator()
+        self.pattern_generator = Phase_pattern.Patter_generator(self.settings_manager.get_pattern_dtype())
         self.pattern = None
         #self.tabwidget = 
         self.tabwidget = QTabWidget()
@@ -329,8 +436,8 @@ class First(QtWidgets.QMainWindow):
         self.SLMWindow = SLMWindow(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(),self.settings_manager.get_SLM_window())
         self.holograms_manager = HologramsManager(self.SLMWindow, self.settings_manager, self.pattern_generator,self.tabwidget)
 
-        self.possible_optical_elements = ["Lens", "Grating", "Flatness correction", "Zernike", "LUT", "Amplitude Mask", "Spot optimization", "Spot optimization (ext)"]
-        self.tabs_constructors = [self.lens_tab, self.grating_tab, self.flatness_correction_tab, self.zernike_tab, self.LUT_tab, self.amplitude_mask_tab, self.Spot_optim, self.Spot_optim_ext]
+        self.possible_optical_elements = ["Lens", "Grating", "Flatness correction", "Zernike", "LUT", "Amplitude Mask", "Spot optimization", "Spot optimization (ext)", "Spot array", "Target image", "Traps"]
+        self.tabs_constructors = [self.lens_tab, self.grating_tab, self.flatness_correction_tab, self.zernike_tab, self.LUT_tab, self.amplitude_mask_tab, self.Spot_optim, self.Spot_optim_ext, self.spot_array_tab, self.target_image_tab, self.traps_tab]
 
         wid = QtWidgets.QWidget(self)
         self.setCentralWidget(wid)
@@ -354,7 +461,7 @@ class First(QtWidgets.QMainWindow):
         self.addToolBar(toolbar)
         self.InitLayout(grid,buttons)
 
-        flask_thread = threading.Thread(target=lambda: self.flaskApp.run(host=self.settings_manager.get_IPclient(), port=self.settings_manager.get_Portclient(), debug=True, use_reloader=False))
+        flask_thread = threading.Thread(target=self.run_server)
         flask_thread.daemon = True
         flask_thread.start()
         self.flaskApp.add_endpoint('/phasePattern', 'phasePattern', self.holograms_manager.getPhasePatternIMG, methods=['GET'])
@@ -362,6 +469,28 @@ class First(QtWidgets.QMainWindow):
 
         wid.setLayout(grid)
         self.show()
+        # Runs once the event loop has started, i.e. when the window is actually up
+        QtCore.QTimer.singleShot(0, self.startup_done)
+
+    def startup_done(self):
+        """Reports the time to the first window. In startup benchmark mode also renders a first (empty) hologram and quits.
+        """
+        Startup_timing.mark("first window")
+        if Startup_timing.benchmark():
+            self.on_pushButton_clicked()
+            QApplication.instance().quit()
+
+    def get_mesh_process(self):
+        """Returns the meshing process, starting it the first time (gmsh and tkinter are only loaded then).
+
+        Returns:
+            Process: Process used to handle the meshing of the optical elements.
+        """
+        if self.mesh_process is None:
+            import SLMcontroller.Meshing_process as Meshing_process
+            self.mesh_process = Meshing_process.MeshingHandler(self.eventsDict, self.conditionsDict, self.queue, 0, 0, 0 , "")
+            self.mesh_process.start()
+        return self.mesh_process
 
     def closeTab(self,index):
         """Closes the selected tab
@@ -392,6 +521,7 @@ class First(QtWidgets.QMainWindow):
     def flatness_correction_tab(self):
         """Creates a new Flatness Correction tab and adds it to the tabwidget
         """
+        import SLMcontroller.FlatnessCorrection as FlatnessCorrection
         tab = FlatnessCorrection.FlatnessCorrectionTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
         self.tabwidget.addTab(tab,"Flatness Correction")
         self.holograms_manager.addElementToList(id(tab), tab)
@@ -399,6 +529,7 @@ class First(QtWidgets.QMainWindow):
     def amplitude_mask_tab(self):
         """Creates a new Amplitude mask tab and adds it to the tabwidget
         """
+        import SLMcontroller.AmplitudeMask as AmplitudeMask
         tab = AmplitudeMask.AmplitudeMaskTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
         self.tabwidget.addTab(tab,"Amplitude Mask")
         self.holograms_manager.addElementToList(id(tab), tab)
@@ -408,17 +539,43 @@ class First(QtWidgets.QMainWindow):
             Todo: 
                 Implement Zernike tab
         """
+        import SLMcontroller.Zernike as Zernike
         tab = Zernike.ZernikeTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
         self.tabwidget.addTab(tab,"Zernike polynomials")
         self.holograms_manager.addElementToList(id(tab), tab)
         self.add_endpoint_connections_zernike(tab)
 
+    def spot_array_tab(self):
+        """Creates a new Spot array tab (Gerchberg-Saxton hologram of an array of spots) and adds it to the tabwidget
+        """
+        import SLMcontroller.SpotArray as SpotArray
+        tab = SpotArray.SpotArrayTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
+        self.tabwidget.addTab(tab,"Spot array")
+        self.holograms_manager.addElementToList(id(tab), tab)
+
+    def target_image_tab(self):
+        """Creates a new Target image tab (MRAF hologram of a target intensity image) and adds it to the tabwidget
+        """
+        import SLMcontroller.TargetImage as TargetImage
+        tab = TargetImage.TargetImageTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
+        self.tabwidget.addTab(tab,"Target image")
+        self.holograms_manager.addElementToList(id(tab), tab)
+
+    def traps_tab(self):
+        """Creates a new Traps tab (moving spots, direct superposition hologram) and adds it to the tabwidget
+        """
+        import SLMcontroller.Traps as Traps
+        tab = Traps.TrapsTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
+        self.tabwidget.addTab(tab,"Traps")
+        self.holograms_manager.addElementToList(id(tab), tab)
+
     def LUT_tab(self):
-        """Creates a new LUT tab and adds it to the tabwidget.
-            Todo:
-                Implement LUT tab
+        """Creates a new LUT tab (gray-level lookup table, global or spatially varying) and adds it to the tabwidget
         """
-        pass
+        import SLMcontroller.LUT as LUT
+        tab = LUT.LUTTab(self.pattern_generator, self.settings_manager, self.holograms_manager)
+        self.tabwidget.addTab(tab,"LUT")
+        self.holograms_manager.addElementToList(id(tab), tab)
     def Spot_optim(self):
         """Creates a new SpotOptimTab tab and adds it to the tabwidget.
         The spot optimization algorithm used in the SpotOptimTab is based on https://www.frontiersin.org/articles/10.3389/fnano.2022.998656/full
@@ -432,6 +589,7 @@ class First(QtWidgets.QMainWindow):
             button = dlg.exec()
             if button == QMessageBox.StandardButton.Ok:
                 return
+        import SLMcontroller.FourierWavefrontOptim as FourierWavefrontOptim
         tab = FourierWavefrontOptim.SpotOptimTab(self.pattern_generator, self.settings_manager, self.holograms_manager,self.cameraWindow)
         self.tabwidget.addTab(tab,"Optimizer (camera)")
         self.holograms_manager.addElementToList(id(tab), tab)
@@ -453,7 +611,8 @@ class First(QtWidgets.QMainWindow):
         - /optimiser/IDsList : returns the list of IDs of the active optical elements
         - /optimiser/phasePattern : returns the current phase pattern
         """
-        tab = WavefrontOptim.SpotOptimTab_ext(self.pattern_generator, self.settings_manager, self.holograms_manager, self.mesh_process)
+        import SLMcontroller.WavefrontOptim as WavefrontOptim
+        tab = WavefrontOptim.SpotOptimTab_ext(self.pattern_generator, self.settings_manager, self.holograms_manager, self.get_mesh_process())
         tab.setEventsHandlers(self.eventsDict, self.conditionsDict, self.queue)
         self.tabwidget.addTab(tab,"Optimizer (ext)")
         self.holograms_manager.addElementToList(id(tab), tab)
@@ -477,10 +636,20 @@ class First(QtWidgets.QMainWindow):
         dlg.exec()
         # Update where the SLM window is (TODO: IS IT GOOD TO DO THIS HERE ??)
         self.SLMWindow.Change_window(self.settings_manager.get_SLM_window())
+        self.pattern_generator.set_dtype(self.settings_manager.get_pattern_dtype())
+        Phase_pattern.configure_threads(self.settings_manager.get_numba_threads(), self.settings_manager.get_numba_threading_layer())
     
+    def run_server(self):
+        """Runs the remote control server (blocking, called from the server thread).
+        Each request is served by a new thread, which first applies the number of threads of the numba kernels.
+        """
+        self.flaskApp.get_app().before_request(Phase_pattern.apply_threads)
+        self.flaskApp.run(host=self.settings_manager.get_IPclient(), port=self.settings_manager.get_Portclient(), debug=True, use_reloader=False)
+
     def start_camera(self):
         """Starts the camera feed
         """
+        import SLMcontroller.CameraFunctions as CameraFunctions
         self.cameraWindow = CameraFunctions.CameraWindow()
         self.flaskApp.add_endpoint('/camera/getImage', 'camera/getImage', self.cameraWindow.getCameraIMG, methods=['GET'])
 
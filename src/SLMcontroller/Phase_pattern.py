@@ -12,50 +12,182 @@ __maintainer__ = "Matteo Mazzanti"
 import numpy as np
 import numba as nb
 import math as math
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
 
 
+# Number of threads of the kernels set by configure_threads (None: the whole numba thread pool)
+_num_threads = None
+
+def configure_threads(num_threads = 0, threading_layer = "default"):
+    """Sets the number of threads used by the numba kernels (e.g. to leave cores free for the camera acquisition).
+    The environment variables SLMCONTROLLER_NUMBA_THREADS and SLMCONTROLLER_NUMBA_LAYER take precedence over the arguments.
+    numba sizes its thread pool when it is imported (the package sets NUMBA_NUM_THREADS and NUMBA_THREADING_LAYER from the settings
+    before importing it), afterwards the number of threads can only be lowered and the threading layer can't be changed.
+    numba keeps the number of threads separately for each thread: this sets the calling thread, the other threads running kernels call apply_threads.
+
+    Args:
+        num_threads (int, optional): Number of threads, 0 for all the cores. Defaults to 0.
+        threading_layer (str, optional): Numba threading layer ("default", "tbb", "omp" or "workqueue"). Defaults to "default".
+
+    Returns:
+        int: Number of threads used by the kernels.
+    """
+    global _num_threads
+    num_threads = int(os.environ.get("SLMCONTROLLER_NUMBA_THREADS", num_threads))
+    threading_layer = os.environ.get("SLMCONTROLLER_NUMBA_LAYER", threading_layer)
+    try:
+        active_layer = nb.threading_layer()
+    except ValueError:
+        # Thread pool not started yet, its layer can still be chosen
+        active_layer = None
+        nb.config.THREADING_LAYER = threading_layer
+    if active_layer is not None and threading_layer not in ("default", active_layer):
+        print("Numba threading layer already set to " + active_layer + ", restart to use " + threading_layer)
+    if num_threads > nb.config.NUMBA_NUM_THREADS:
+        print("Numba thread pool started with %d threads, restart to use %d" % (nb.config.NUMBA_NUM_THREADS, num_threads))
+    if num_threads <= 0 or num_threads > nb.config.NUMBA_NUM_THREADS:
+        num_threads = nb.config.NUMBA_NUM_THREADS
+    _num_threads = num_threads
+    nb.set_num_threads(num_threads)
+    return num_threads
+
+def apply_threads():
+    """Applies the number of threads set by configure_threads to the calling thread.
+    A new thread runs the kernels on the whole numba thread pool, so every thread running kernels
+    (optimizers, remote control requests, kernel warm-up) calls this before its first kernel.
+    """
+    if _num_threads is not None:
+        nb.set_num_threads(_num_threads)
+
 @nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
-def _generateGrating(X,Y,pxl,theta):
-    """Generates a grating pattern.
+def _generateGrating(X,Y,pxl,theta,out):
+    """Generates a grating pattern, wrapped in [0,256).
+    The grating is the sum of a row and a column ramp, it is evaluated directly from the coordinates vectors without temporaries.
 
     Args:
-        X (int): X resolution of the pattern (SLM).
-        Y (int): Y resolution of the pattern (SLM).
+        X (np.array): (1, res_X) X coordinates of the SLM pixels.
+        Y (np.array): (res_Y, 1) Y coordinates of the SLM pixels.
         pxl (float): pixel size
         theta (float): angle of the grating
-
-    Returns:
-        np.array: Grating pattern.
+        out (np.array): (res_Y, res_X) output grating pattern.
     """
-    precomp_sin = np.sin(theta)
-    precomp_cos = np.cos(theta)
     precomp_scaling = 255/pxl
-    grating = precomp_scaling*(Y*precomp_sin+X*precomp_cos)
-    return grating
+    precomp_sin = precomp_scaling*np.sin(theta)
+    precomp_cos = precomp_scaling*np.cos(theta)
+    for i in nb.prange(Y.shape[0]):
+        row = Y[i, 0]*precomp_sin
+        for j in range(X.shape[1]):
+            out[i, j] = np.mod(row + X[0, j]*precomp_cos, 256)
 
 @nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
-def _generateLens(X, Y, x_offset, y_offset, wl, focus, pixel_pitch):
-    """Generates a lens pattern.
+def _generateLens(x, y, rows, starts, stops, x_offset, y_offset, wl, focus, pixel_pitch, out):
+    """Generates a lens pattern. Only the pixels inside the given row spans are evaluated.
 
     Args:
-        X (int): X resolution of the pattern (SLM).
-        Y (int): Y resolution of the pattern (SLM).
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        rows (np.array): Rows of the spans to evaluate.
+        starts (np.array): First column of each span.
+        stops (np.array): Last column (excluded) of each span.
         x_offset (int): Lens offset from the center of the SLM on the X axis.
         y_offset (int): Lens offset from the center of the SLM on the Y axis.
         wl (float): Wavelength of the laser.
         focus (float): Focus of the lens.
         pixel_pitch (float): Pixel pitch of the SLM.
-
-    Returns:
-        np.array: Lens pattern.
+        out (np.array): Output lens pattern, pixels outside the spans are left untouched.
     """
     rN = wl*focus/(2*pixel_pitch)
-    r = np.sqrt((X - x_offset)**2 + (Y - y_offset)**2)
-    mask = r < np.abs(rN/pixel_pitch)
+    rmax = np.abs(rN/pixel_pitch)
     gamma = np.pi/(wl*focus)
-    phi = gamma*(((X - x_offset)*pixel_pitch)**2+((Y - y_offset)*pixel_pitch)**2)/(2*np.pi)
-    lens = (mask*phi*255)#%256
-    return lens
+    for s in nb.prange(len(rows)):
+        i = rows[s]
+        dy = y[i] - y_offset
+        for j in range(starts[s], stops[s]):
+            dx = x[j] - x_offset
+            if np.sqrt(dx**2 + dy**2) < rmax:
+                out[i, j] = gamma*((dx*pixel_pitch)**2 + (dy*pixel_pitch)**2)/(2*np.pi)*255
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _generateGratingBatch(x, y, ramps_x, ramps_y, wrap, out):
+    """Generates a stack of gratings. The work is spread over the (pattern, row) pairs.
+
+    Args:
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        ramps_x (np.array): Phase (gray levels) per unit of X coordinate of each grating.
+        ramps_y (np.array): Phase (gray levels) per unit of Y coordinate of each grating.
+        wrap (bool): If True the phase is wrapped in [0,256) and truncated to integer gray levels.
+        out (np.array): (N, res_Y, res_X) output stack.
+    """
+    n, res_Y, res_X = out.shape
+    for t in nb.prange(n*res_Y):
+        k = t//res_Y
+        i = t % res_Y
+        row = y[i]*ramps_y[k]
+        for j in range(res_X):
+            phase = row + x[j]*ramps_x[k]
+            if wrap:
+                out[k, i, j] = int(np.mod(phase, 256)) & 255
+            else:
+                out[k, i, j] = phase
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _generateLensBatch(x2, y2, curvatures, rmax, wrap, out):
+    """Generates a stack of centered lenses. The squared coordinates are shared by the whole stack, the work is spread over the (pattern, row) pairs.
+
+    Args:
+        x2 (np.array): Squared X coordinates of the SLM columns.
+        y2 (np.array): Squared Y coordinates of the SLM rows.
+        curvatures (np.array): Phase (gray levels) per squared unit of distance from the center of each lens.
+        rmax (np.array): Useful radius of each lens, pixels farther from the center are set to 0.
+        wrap (bool): If True the phase is wrapped in [0,256) and truncated to integer gray levels.
+        out (np.array): (N, res_Y, res_X) output stack.
+    """
+    n, res_Y, res_X = out.shape
+    for t in nb.prange(n*res_Y):
+        k = t//res_Y
+        i = t % res_Y
+        for j in range(res_X):
+            d2 = x2[j] + y2[i]
+            phase = 0.
+            if np.sqrt(d2) < rmax[k]:
+                phase = curvatures[k]*d2
+            if wrap:
+                out[k, i, j] = int(np.mod(phase, 256)) & 255
+            else:
+                out[k, i, j] = phase
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _wrap_levels(values, out):
+    """Wraps phase values in [0,256) and truncates them to integer gray levels.
+
+    Args:
+        values (np.array): 2D array of phase values.
+        out (np.array): 2D uint8 output array.
+    """
+    for i in nb.prange(values.shape[0]):
+        for j in range(values.shape[1]):
+            out[i, j] = int(np.mod(values[i, j], 256)) & 255
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _scatter_spans(values, rows, starts, stops, offsets, out):
+    """Copies values packed span after span back to their pixels.
+
+    Args:
+        values (np.array): Packed values (one after the other for each span).
+        rows (np.array): Rows of the spans.
+        starts (np.array): First column of each span.
+        stops (np.array): Last column (excluded) of each span.
+        offsets (np.array): Position of the first value of each span in the packed values.
+        out (np.array): Output pattern.
+    """
+    for s in nb.prange(len(rows)):
+        i = rows[s]
+        for j in range(starts[s], stops[s]):
+            out[i, j] = values[offsets[s] + j - starts[s]]
 
 LOOKUP_TABLE = np.array([
     1, 1, 2, 6, 24, 120, 720, 5040, 40320,
@@ -73,6 +205,7 @@ def _fast_factorial(n):
 
 ## Zernike polynomials generation
 # This function determines the radial Zernike polynomials
+# Reference implementation, the factorial table limits it to n <= 20 (see _radial_polynomials)
 @nb.jit(nopython = True, cache = True, fastmath = True)
 def _radialfunc(n, m1, rho):
     if( m1 < 0  ):
@@ -108,22 +241,823 @@ def _ZernikePolynomial(n, m, x, y):
         z_all = radial* np.sin( m * theta) * np.sqrt(2*n+2)
     return (z_all) #renormalization?
 
+# Recurrence-based evaluation of the radial polynomials. Each radial polynomial is obtained from lower orders 
+# (Prata recurrence) R_n^m = rho*(R_{n-1}^{|m-1|} + R_{n-1}^{m+1}) - R_{n-2}^m, starting from R_n^n = rho^n.
+# Unlike _radialfunc this has no factorials (no limit on n) and all the orders up to n_max are obtained in one pass over rho.
+@nb.jit(nopython = True, cache = True, fastmath = True)
+def _radial_table(r, table):
+    """Fills the table of radial Zernike polynomials R_n^m (m >= 0) for a single radial coordinate.
+
+    Args:
+        r (float): Radial coordinate.
+        table (np.array): (n_max+1, n_max+1) table, table[n, m] is filled with R_n^m(r) for n-m even.
+    """
+    n_max = table.shape[0] - 1
+    table[0, 0] = 1.0
+    for n in range(1, n_max + 1):
+        table[n, n] = table[n - 1, n - 1]*r
+        for m in range(n - 2, -1, -2):
+            table[n, m] = r*(table[n - 1, abs(m - 1)] + table[n - 1, m + 1]) - table[n - 2, m]
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _radial_polynomials(n_list, m_list, rho, out):
+    """Evaluates several radial Zernike polynomials at once.
+
+    Args:
+        n_list (np.array): Radial orders of the polynomials.
+        m_list (np.array): Azimuthal frequencies of the polynomials.
+        rho (np.array): 2D array of radial coordinates.
+        out (np.array): (len(n_list), rho.shape[0], rho.shape[1]) output array.
+    """
+    n_max = np.max(n_list)
+    for i in nb.prange(rho.shape[0]):
+        table = np.zeros((n_max + 1, n_max + 1))
+        for j in range(rho.shape[1]):
+            _radial_table(rho[i, j], table)
+            for k in range(len(n_list)):
+                out[k, i, j] = table[n_list[k], abs(m_list[k])]
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _zernike_polynomials(n_list, m_list, x, y, rows, starts, stops, offsets, out):
+    """Evaluates several Zernike polynomials at once, sharing the radial recurrence and the polar coordinates.
+    Matches _ZernikePolynomial for each (n, m) pair. Only the pixels inside the given row spans are evaluated.
+
+    Args:
+        n_list (np.array): Radial orders of the polynomials.
+        m_list (np.array): Azimuthal frequencies of the polynomials.
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        rows (np.array): Rows of the spans to evaluate.
+        starts (np.array): First column of each span.
+        stops (np.array): Last column (excluded) of each span.
+        offsets (np.array): Position of the first pixel of each span in the packed output.
+        out (np.array): (len(n_list), number of pixels) packed output array.
+    """
+    n_max = np.max(n_list)
+    for s in nb.prange(len(rows)):
+        table = np.zeros((n_max + 1, n_max + 1))
+        yi = y[rows[s]]
+        for j in range(starts[s], stops[s]):
+            p = offsets[s] + j - starts[s]
+            rho = np.sqrt(x[j]**2 + yi**2)
+            theta = np.arctan2(x[j], yi)
+            _radial_table(rho, table)
+            for k in range(len(n_list)):
+                n = n_list[k]
+                m = m_list[k]
+                radial = table[n, abs(m)]
+                if m > 0:
+                    out[k, p] = radial*np.cos(m*theta)*np.sqrt(2*n + 2)
+                elif m == 0:
+                    out[k, p] = radial*np.sqrt(n + 1)
+                else:
+                    out[k, p] = radial*np.sin(m*theta)*np.sqrt(2*n + 2)
+
+@nb.jit(nopython = True, cache = True, fastmath = True)
+def _compose_row(i, x, y, ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials, accumulate, out_row):
+    """Evaluates the sum of a linear ramp, lenses and Zernike expansions along one row of the SLM (see _composeAnalytic).
+
+    Args:
+        i (int): Row of the SLM.
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        ramp_x (float): Phase (gray levels) per unit of X coordinate (sum of the gratings).
+        ramp_y (float): Phase (gray levels) per unit of Y coordinate (sum of the gratings).
+        lenses (np.array): (L, 4) array with center X, center Y, curvature and useful radius of each lens.
+        zernike_shifts (np.array): (G, 2) array with the coordinates shift along X and Y of each Zernike expansion.
+        zernike_columns (np.array): (G, res_Y, 2) array with the first and last (excluded) column where each Zernike expansion is evaluated, for each row.
+        zernike_monomials (np.array): (G, D+1, D+1) array, zernike_monomials[g, a, b] is the coefficient of x^a y^b in the expansion g.
+        accumulate (bool): If True the phase is added to out_row, otherwise out_row is overwritten.
+        out_row (np.array): Output row.
+    """
+    n_groups = zernike_shifts.shape[0]
+    degree = zernike_monomials.shape[1] - 1
+    # Coefficients of the polynomials in X along this row
+    row_coefficients = np.zeros((n_groups, degree + 1))
+    for g in range(n_groups):
+        ys = y[i] + zernike_shifts[g, 1]
+        for a in range(degree + 1):
+            c = 0.
+            for b in range(degree - a, -1, -1):
+                c = c*ys + zernike_monomials[g, a, b]
+            row_coefficients[g, a] = c
+    row = ramp_y*y[i]
+    for j in range(out_row.shape[0]):
+        phase = row + ramp_x*x[j]
+        for l in range(lenses.shape[0]):
+            dx = x[j] - lenses[l, 0]
+            dy = y[i] - lenses[l, 1]
+            d2 = dx*dx + dy*dy
+            if np.sqrt(d2) < lenses[l, 3]:
+                phase += lenses[l, 2]*d2
+        for g in range(n_groups):
+            if j < zernike_columns[g, i, 0] or j >= zernike_columns[g, i, 1]:
+                continue
+            xs = x[j] + zernike_shifts[g, 0]
+            z = 0.
+            for a in range(degree, -1, -1):
+                z = z*xs + row_coefficients[g, a]
+            phase += z
+        if accumulate:
+            out_row[j] += phase
+        else:
+            out_row[j] = phase
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _composeAnalytic(x, y, ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials, accumulate, out):
+    """Evaluates the sum of a linear ramp, lenses and Zernike expansions in a single pass over the SLM.
+    Each pixel is read (if accumulating) and written once, whatever the number of elements.
+    Each Zernike expansion is a polynomial in the pixel coordinates, it is reduced to a polynomial in X once per row and then evaluated with Horner's scheme.
+
+    Args:
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        ramp_x (float): Phase (gray levels) per unit of X coordinate (sum of the gratings).
+        ramp_y (float): Phase (gray levels) per unit of Y coordinate (sum of the gratings).
+        lenses (np.array): (L, 4) array with center X, center Y, curvature and useful radius of each lens.
+        zernike_shifts (np.array): (G, 2) array with the coordinates shift along X and Y of each Zernike expansion.
+        zernike_columns (np.array): (G, res_Y, 2) array with the first and last (excluded) column where each Zernike expansion is evaluated, for each row.
+        zernike_monomials (np.array): (G, D+1, D+1) array, zernike_monomials[g, a, b] is the coefficient of x^a y^b in the expansion g.
+        accumulate (bool): If True the phase is added to out, otherwise out is overwritten.
+        out (np.array): Output pattern.
+    """
+    for i in nb.prange(out.shape[0]):
+        _compose_row(i, x, y, ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials, accumulate, out[i])
+
+def _make_spans(rows, starts, stops):
+    """Builds a row spans tuple, adding the position of each span in a packed array.
+
+    Args:
+        rows (np.array): Rows of the spans.
+        starts (np.array): First column of each span.
+        stops (np.array): Last column (excluded) of each span.
+
+    Returns:
+        tuple: (rows, starts, stops, offsets) arrays.
+    """
+    rows, starts, stops = (np.ascontiguousarray(v, dtype = np.int64) for v in (rows, starts, stops))
+    offsets = np.zeros(len(rows), dtype = np.int64)
+    np.cumsum((stops - starts)[:-1], out = offsets[1:])
+    return rows, starts, stops, offsets
+
+def _full_spans(res_X, res_Y):
+    """Row spans covering the whole SLM.
+
+    Args:
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+
+    Returns:
+        tuple: (rows, starts, stops, offsets) arrays.
+    """
+    return _make_spans(np.arange(res_Y), np.zeros(res_Y), np.full(res_Y, res_X))
+
+def _intersect_spans(spans_a, spans_b):
+    """Intersection of two sets of row spans.
+
+    Args:
+        spans_a (tuple): First (rows, starts, stops, offsets) spans.
+        spans_b (tuple): Second (rows, starts, stops, offsets) spans.
+
+    Returns:
+        tuple: (rows, starts, stops, offsets) arrays.
+    """
+    rows, ia, ib = np.intersect1d(spans_a[0], spans_b[0], assume_unique = True, return_indices = True)
+    starts = np.maximum(spans_a[1][ia], spans_b[1][ib])
+    stops = np.minimum(spans_a[2][ia], spans_b[2][ib])
+    keep = stops > starts
+    return _make_spans(rows[keep], starts[keep], stops[keep])
+
+class Aperture:
+    """Circular or elliptical aperture (pupil) on the SLM, in pixel coordinates.
+    Generators restricted to an aperture only evaluate the pixels inside it.
+    The aperture is described by one span of columns for each of its rows, computed once per SLM resolution.
+
+    Attributes:
+        center_x (float): Column of the aperture center.
+        center_y (float): Row of the aperture center.
+        radius_x (float): Radius of the aperture along X (pixels).
+        radius_y (float): Radius of the aperture along Y (pixels).
+    """
+
+    def __init__(self, center_x, center_y, radius_x, radius_y = None):
+        """Constructor for the Aperture class.
+
+        Args:
+            center_x (float): Column of the aperture center.
+            center_y (float): Row of the aperture center.
+            radius_x (float): Radius of the aperture along X (pixels).
+            radius_y (float, optional): Radius of the aperture along Y (pixels). Defaults to radius_x (circular aperture).
+        """
+        self.center_x = float(center_x)
+        self.center_y = float(center_y)
+        self.radius_x = float(radius_x)
+        self.radius_y = float(radius_x if radius_y is None else radius_y)
+        self._spans = {}
+
+    def key(self):
+        """Returns a hashable description of the aperture (used as cache key).
+
+        Returns:
+            tuple: Center and radii of the aperture.
+        """
+        return (self.center_x, self.center_y, self.radius_x, self.radius_y)
+
+    def row_spans(self, res_X, res_Y):
+        """Returns the row spans of the aperture on a SLM of the given resolution.
+
+        Args:
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+
+        Returns:
+            tuple: (rows, starts, stops, offsets) arrays.
+        """
+        if (res_X, res_Y) not in self._spans:
+            first = max(0, int(np.ceil(self.center_y - self.radius_y)))
+            last = min(res_Y - 1, int(np.floor(self.center_y + self.radius_y)))
+            rows = np.arange(first, last + 1)
+            half = self.radius_x*np.sqrt(np.clip(1 - ((rows - self.center_y)/self.radius_y)**2, 0, 1))
+            starts = np.clip(np.ceil(self.center_x - half), 0, res_X)
+            stops = np.clip(np.floor(self.center_x + half) + 1, 0, res_X)
+            keep = stops > starts
+            self._spans[(res_X, res_Y)] = _make_spans(rows[keep], starts[keep], stops[keep])
+        return self._spans[(res_X, res_Y)]
+
+def _osa_to_nm(j):
+    """Converts an OSA/ANSI Zernike index to the corresponding (n,m) pair.
+
+    Args:
+        j (int): OSA/ANSI index of the polynomial.
+
+    Returns:
+        tuple: Radial order n and azimuthal frequency m.
+    """
+    n = int(np.ceil((-3 + np.sqrt(9 + 8*j))/2))
+    m = 2*j - n*(n + 2)
+    return n, m
+
+def _zernike_monomials(n, m):
+    """Expands a Zernike polynomial (as evaluated by _ZernikePolynomial) in monomials of the cartesian coordinates.
+    With theta = arctan2(x, y), rho^|m| cos(m theta) and rho^|m| sin(|m| theta) are the real and imaginary parts of (y + ix)^|m|,
+    and R_n^m(rho)/rho^|m| is a polynomial in x^2 + y^2.
+
+    Args:
+        n (int): Radial order of the polynomial.
+        m (int): Azimuthal frequency of the polynomial.
+
+    Returns:
+        np.array: (n+1, n+1) array, the element [a, b] is the coefficient of x^a y^b.
+    """
+    am = abs(m)
+    # Angular part
+    angular = np.zeros((am + 1, am + 1))
+    for t in range(am + 1):
+        if (m >= 0 and t % 2 == 0) or (m < 0 and t % 2 == 1):
+            sign = (-1)**(t//2)
+            angular[t, am - t] = math.comb(am, t)*sign*(1 if m >= 0 else -1)
+    # Radial part divided by rho^|m|
+    p_max = (n - am)//2
+    radial = np.zeros((n - am + 1, n - am + 1))
+    for k in range(p_max + 1):
+        c = (-1)**k*math.factorial(n - k)/(math.factorial(k)*math.factorial((n + am)//2 - k)*math.factorial((n - am)//2 - k))
+        p = p_max - k
+        for t in range(p + 1):
+            radial[2*t, 2*(p - t)] += c*math.comb(p, t)
+    monomials = np.zeros((n + 1, n + 1))
+    for a, b in zip(*np.nonzero(angular)):
+        monomials[a:a + radial.shape[0], b:b + radial.shape[1]] += angular[a, b]*radial
+    return monomials*(np.sqrt(n + 1) if m == 0 else np.sqrt(2*n + 2))
+
+def _max_zernike_order(rho_max, n_max):
+    """Finds the highest radial order (up to n_max) whose Zernike polynomials stay finite in double precision up to the radius rho_max.
+    Running the recurrence of _radial_table with the subtraction replaced by an addition bounds |R_n^m| and every intermediate value of the kernels.
+
+    Args:
+        rho_max (float): Largest radial coordinate (in pixels) where the polynomials are evaluated.
+        n_max (int): Highest radial order of interest.
+
+    Returns:
+        int: Highest usable radial order, at most n_max.
+    """
+    r = max(rho_max, 1.)
+    limit = np.finfo(np.float64).max/16
+    previous, current = np.zeros(1), np.ones(1)
+    for n in range(1, n_max + 1):
+        bound = np.zeros(n + 1)
+        bound[n] = current[n - 1]*r
+        with np.errstate(over = 'ignore'):
+            for m in range(n - 2, -1, -2):
+                bound[m] = r*(current[abs(m - 1)] + current[m + 1]) + previous[m]
+        if np.max(bound) > limit/np.sqrt(2*n + 2):
+            return n - 1
+        previous, current = current, bound
+    return n_max
+
+def _check_zernike_orders(n_terms, x, y):
+    """Checks that the first n_terms Zernike polynomials can be evaluated in double precision on the given coordinates.
+    The polynomials are evaluated at pixel radii, so the highest usable order depends on the SLM size and on the Zernike center
+    (about n = 90, i.e. ~4000 terms, for a centered 1920x1152 SLM).
+
+    Args:
+        n_terms (int): Number of polynomials (OSA/ANSI ordering).
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+
+    Raises:
+        ValueError: If the highest order overflows on the farthest pixel.
+    """
+    n_max = _osa_to_nm(n_terms - 1)[0]
+    rho_max = np.sqrt(np.max(np.abs(x))**2 + np.max(np.abs(y))**2)
+    usable = _max_zernike_order(rho_max, n_max)
+    if usable < n_max:
+        raise ValueError("Zernike polynomials of order " + str(n_max) + " overflow " + str(int(rho_max)) + " pixels away from the center, at most " + str((usable + 1)*(usable + 2)//2) + " terms can be used")
+
+class ZernikeBasisCache:
+    """Cache of evaluated Zernike polynomials.
+    The polynomials are stored as one contiguous (terms, Y, X) stack, so that a Zernike pattern is obtained
+    with a single weighted sum (tensordot) instead of re-evaluating every polynomial each time a coefficient changes.
+    Stacks are kept per resolution and center offset. A stack evaluated for N terms also serves any request with fewer terms.
+    The polynomials are always stored and contracted in double precision: at pixel radii R_n^m grows as rho^n and exceeds the
+    float32 range from n = 13 on a typical SLM (see _check_zernike_orders for the float64 limit).
+    The least recently used stacks are dropped once the cache exceeds its memory budget. A stack that alone exceeds the budget
+    (e.g. many terms on a 4K SLM) is never cached: contract then evaluates the polynomials on blocks of rows.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cache in bytes.
+        use_symmetry (bool): If True, the polynomials of a basis centered on the SLM are computed on one quadrant and mirrored (see _mirror_modes).
+    """
+
+    def __init__(self, max_bytes = 1 << 30):
+        """Constructor for the ZernikeBasisCache class.
+
+        Args:
+            max_bytes (int, optional): Memory budget of the cache in bytes. Defaults to 1 GiB.
+        """
+        self.max_bytes = max_bytes
+        self.use_symmetry = True
+        self._stacks = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get_basis(self, n_terms, X, Y, x_offset, y_offset, aperture = None):
+        """Returns the first n_terms Zernike polynomials evaluated on the SLM, computing them if needed.
+
+        Args:
+            n_terms (int): Number of polynomials (OSA/ANSI ordering).
+            X (np.array): (1, res_X) X coordinates of the SLM pixels.
+            Y (np.array): (res_Y, 1) Y coordinates of the SLM pixels.
+            x_offset (int): Zernike center on the X axis.
+            y_offset (int): Zernike center on the Y axis.
+            aperture (:Aperture:, optional): Pupil outside of which the polynomials are not evaluated. Defaults to None (whole SLM).
+
+        Returns:
+            tuple: (n_terms, number of pixels) stack of Zernike polynomials and the row spans of the evaluated pixels.
+        """
+        res_X, res_Y = X.shape[1], Y.shape[0]
+        key = (res_X, res_Y, x_offset, y_offset, None if aperture is None else aperture.key())
+        spans = _full_spans(res_X, res_Y) if aperture is None else aperture.row_spans(res_X, res_Y)
+        with self._lock:
+            stack = self._stacks.get(key)
+            if stack is not None and len(stack) >= n_terms:
+                self._stacks.move_to_end(key)
+                return stack[:n_terms], spans
+            x, y = _zernike_coordinates(X, Y, x_offset, y_offset)
+            _check_zernike_orders(n_terms, x, y)
+            new_stack = np.empty((n_terms, np.sum(spans[2] - spans[1])))
+            first = 0
+            if stack is not None:
+                # Keep the polynomials already evaluated, compute only the missing ones
+                first = len(stack)
+                new_stack[:first] = stack
+                self._nbytes -= stack.nbytes
+            orders = np.array([_osa_to_nm(j) for j in range(first, n_terms)], dtype = np.int64).reshape(-1, 2)
+            # The polynomials of a centered basis are even or odd along both axes, compute one quadrant and mirror it
+            if self.use_symmetry and aperture is None and _is_antisymmetric(x) and _is_antisymmetric(y):
+                quadrant = _quadrant_spans(res_X, res_Y)
+                modes = np.empty((len(orders), np.sum(quadrant[2] - quadrant[1])))
+                _zernike_polynomials(orders[:, 0], orders[:, 1], x, y, *quadrant, modes)
+                _mirror_modes(modes, *_zernike_parities(orders[:, 1]), res_X, res_Y, new_stack[first:])
+            else:
+                _zernike_polynomials(orders[:, 0], orders[:, 1], x, y, *spans, new_stack[first:])
+            if new_stack.nbytes <= self.max_bytes:
+                self._stacks[key] = new_stack
+                self._nbytes += new_stack.nbytes
+                self._evict()
+            return new_stack, spans
+
+    def contract(self, weights, X, Y, x_offset, y_offset, aperture = None):
+        """Returns weighted sums of the Zernike polynomials (weights @ basis).
+        If the stack of polynomials fits in the memory budget it is taken from the cache (see get_basis), otherwise
+        the polynomials are evaluated on blocks of rows and contracted block by block, so the stack is never allocated.
+
+        Args:
+            weights (np.array): (K,) or (N, K) weights of the first K polynomials (OSA/ANSI ordering).
+            X (np.array): (1, res_X) X coordinates of the SLM pixels.
+            Y (np.array): (res_Y, 1) Y coordinates of the SLM pixels.
+            x_offset (int): Zernike center on the X axis.
+            y_offset (int): Zernike center on the Y axis.
+            aperture (:Aperture:, optional): Pupil outside of which the polynomials are not evaluated. Defaults to None (whole SLM).
+
+        Returns:
+            tuple: (..., number of pixels) weighted sums (float64) and the row spans of the evaluated pixels.
+        """
+        n_terms = weights.shape[-1]
+        res_X, res_Y = X.shape[1], Y.shape[0]
+        spans = _full_spans(res_X, res_Y) if aperture is None else aperture.row_spans(res_X, res_Y)
+        n_pixels = np.sum(spans[2] - spans[1])
+        weights = np.asarray(weights, dtype = np.float64)
+        if n_terms*n_pixels*8 <= self.max_bytes:
+            basis, spans = self.get_basis(n_terms, X, Y, x_offset, y_offset, aperture)
+            return weights @ basis, spans
+        values = np.empty(weights.shape[:-1] + (n_pixels,))
+        x, y = _zernike_coordinates(X, Y, x_offset, y_offset)
+        _check_zernike_orders(n_terms, x, y)
+        orders = np.array([_osa_to_nm(j) for j in range(n_terms)], dtype = np.int64).reshape(-1, 2)
+        block_rows = max(1, (64 << 20)//(n_terms*res_X*8))
+        buffer = np.empty(n_terms*min(n_pixels, block_rows*res_X))
+        for first in range(0, len(spans[0]), block_rows):
+            rows, starts, stops, offsets = (v[first:first + block_rows] for v in spans)
+            size = np.sum(stops - starts)
+            block = buffer[:n_terms*size].reshape(n_terms, size)
+            _zernike_polynomials(orders[:, 0], orders[:, 1], x, y, rows, starts, stops, offsets - offsets[0], block)
+            values[..., offsets[0]:offsets[0] + size] = weights @ block
+        return values, spans
+
+    def clear(self):
+        """Empties the cache.
+        """
+        with self._lock:
+            self._stacks.clear()
+            self._nbytes = 0
+
+    def _evict(self):
+        """Drops the least recently used stacks until the cache fits in its memory budget.
+        """
+        while self._nbytes > self.max_bytes and len(self._stacks) > 1:
+            _, stack = self._stacks.popitem(last = False)
+            self._nbytes -= stack.nbytes
+
+def _zernike_coordinates(X, Y, x_offset, y_offset):
+    """Coordinates of the SLM columns and rows relative to the center of a Zernike expansion.
+    The shift is added in a single step, so that the coordinates of an expansion centered on the SLM stay exactly antisymmetric (see _is_antisymmetric).
+
+    Args:
+        X (np.array): (1, res_X) X coordinates of the SLM pixels.
+        Y (np.array): (res_Y, 1) Y coordinates of the SLM pixels.
+        x_offset (int): Zernike center on the X axis.
+        y_offset (int): Zernike center on the Y axis.
+
+    Returns:
+        tuple: X coordinates of the columns and Y coordinates of the rows.
+    """
+    res_X, res_Y = X.shape[1], Y.shape[0]
+    return X[0] + (int(res_X/2) - x_offset), Y[:, 0] + (y_offset - int(res_Y/2))
+
+def _tile_pattern(tile, out):
+    """Fills a pattern repeating a tile, starting from the top left corner.
+    The filled area is doubled at each step, so the whole pattern is written with a few large copies.
+
+    Args:
+        tile (np.array): Tile to be repeated.
+        out (np.array): Output pattern.
+    """
+    res_Y, res_X = out.shape
+    period_Y, period_X = min(tile.shape[0], res_Y), min(tile.shape[1], res_X)
+    out[:period_Y, :period_X] = tile[:period_Y, :period_X]
+    filled = period_X
+    while filled < res_X:
+        n = min(filled, res_X - filled)
+        out[:period_Y, filled:filled + n] = out[:period_Y, :n]
+        filled += n
+    filled = period_Y
+    while filled < res_Y:
+        n = min(filled, res_Y - filled)
+        out[filled:filled + n] = out[:n]
+        filled += n
+
+def _quadrant_spans(res_X, res_Y):
+    """Row spans covering the top left quadrant of the SLM (central row and column included).
+
+    Args:
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+
+    Returns:
+        tuple: (rows, starts, stops, offsets) arrays.
+    """
+    rows = np.arange((res_Y + 1)//2)
+    return _make_spans(rows, np.zeros(len(rows)), np.full(len(rows), (res_X + 1)//2))
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _mirror_quadrant(out):
+    """Completes a pattern with four-fold mirror symmetry from its top left quadrant (central row and column included).
+
+    Args:
+        out (np.array): Pattern whose top left quadrant is already filled.
+    """
+    res_Y, res_X = out.shape
+    half_Y = (res_Y + 1)//2
+    half_X = (res_X + 1)//2
+    for i in nb.prange(res_Y):
+        source = i
+        if i >= half_Y:
+            source = res_Y - 1 - i
+            for j in range(half_X):
+                out[i, j] = out[source, j]
+        for j in range(half_X, res_X):
+            out[i, j] = out[source, res_X - 1 - j]
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _mirror_modes(modes, sign_x, sign_y, res_X, res_Y, out):
+    """Completes polynomials evaluated on the top left quadrant of the SLM (see _quadrant_spans), 
+    each mirrored with its own sign along X and Y.
+
+    Args:
+        modes (np.array): (K, number of quadrant pixels) values of the polynomials on the quadrant.
+        sign_x (np.array): Sign of each polynomial under x -> -x.
+        sign_y (np.array): Sign of each polynomial under y -> -y.
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+        out (np.array): (K, res_Y*res_X) output stack.
+    """
+    half_Y = (res_Y + 1)//2
+    half_X = (res_X + 1)//2
+    for i in nb.prange(res_Y):
+        source = i if i < half_Y else res_Y - 1 - i
+        for k in range(modes.shape[0]):
+            sign = sign_y[k] if i >= half_Y else 1
+            row = modes[k, source*half_X:(source + 1)*half_X]
+            for j in range(half_X):
+                out[k, i*res_X + j] = sign*row[j]
+            sign = sign*sign_x[k]
+            for j in range(half_X, res_X):
+                out[k, i*res_X + j] = sign*row[res_X - 1 - j]
+
+def _zernike_parities(m):
+    """Signs of the Zernike polynomials under x -> -x and y -> -y (polar angle arctan2(x, y), see _ZernikePolynomial).
+    cos(m theta) is even along X and sin(m theta) odd, along Y they pick a factor (-1)^m and sin(m theta) changes sign.
+
+    Args:
+        m (np.array): Azimuthal frequencies of the polynomials.
+
+    Returns:
+        tuple: Signs along X and along Y.
+    """
+    sign_x = np.where(m < 0, -1, 1)
+    return sign_x, sign_x*(1 - 2*(np.abs(m) % 2))
+
+def _is_antisymmetric(v):
+    """Checks if a coordinates vector is exactly antisymmetric (v[-1-i] == -v[i]).
+
+    Args:
+        v (np.array): Coordinates vector.
+
+    Returns:
+        bool: True if the vector is antisymmetric.
+    """
+    return np.array_equal(v, -v[::-1])
+
+class CoordinateGrid:
+    """Read-only cache of the SLM pixel coordinates, one entry per resolution.
+    Coordinates are handed out as a sparse meshgrid: a (1, res_X) row of X coordinates and a (res_Y, 1) column of Y coordinates
+    that broadcast against each other. The arrays are never modified once built, so they can be shared between the GUI thread,
+    the remote control thread and the optimizer threads.
+    """
+
+    def __init__(self):
+        """Constructor for the CoordinateGrid class.
+        """
+        self._grids = {}
+        self._lock = threading.Lock()
+
+    def get(self, res_X, res_Y):
+        """Returns the coordinates of the SLM pixels, building them the first time a resolution is requested.
+
+        Args:
+            res_X (int): X resolution of the pattern (SLM).
+            res_Y (int): Y resolution of the pattern (SLM).
+
+        Returns:
+            tuple: (1, res_X) X coordinates and (res_Y, 1) Y coordinates (read-only).
+        """
+        grid = self._grids.get((res_X, res_Y))
+        if grid is None:
+            with self._lock:
+                grid = self._grids.get((res_X, res_Y))
+                if grid is None:
+                    x_list = np.linspace(-int(res_X/2),int(res_X/2),res_X)
+                    y_list = np.linspace(-int(res_Y/2),int(res_Y/2),res_Y)
+                    # Make the coordinates exactly antisymmetric (linspace can be off by 1 ulp), so that symmetric patterns can be mirrored
+                    x_list = (x_list - x_list[::-1])/2
+                    y_list = (y_list - y_list[::-1])/2
+                    grid = np.meshgrid(x_list, y_list, sparse = True)
+                    for coordinates in grid:
+                        coordinates.flags.writeable = False
+                    grid = tuple(grid)
+                    self._grids[(res_X, res_Y)] = grid
+        return grid
+
+class AnalyticPattern:
+    """Closed-form description of the phase of several optical elements (gratings, lenses, Zernike expansions).
+    Elements are added with the same parameters used by the Patter_generator Generate functions, and the whole pattern is then
+    evaluated in a single pass by Patter_generator.GenerateAnalytic, without one full SLM array per element.
+
+    Attributes:
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+        ramp_x (float): Phase (gray levels) per unit of X coordinate of all the gratings.
+        ramp_y (float): Phase (gray levels) per unit of Y coordinate of all the gratings.
+        lenses (list): Center X, center Y, curvature and useful radius of each lens.
+        zernike (list): Coordinates shift, evaluated columns of each row and monomial coefficients of each Zernike expansion.
+    """
+
+    def __init__(self, res_X, res_Y):
+        """Constructor for the AnalyticPattern class.
+
+        Args:
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+        """
+        self.res_X = res_X
+        self.res_Y = res_Y
+        self.ramp_x = 0.
+        self.ramp_y = 0.
+        self.lenses = []
+        self.zernike = []
+
+    def add_grating(self, wl, pixel_pitch, lmm, theta):
+        """Adds a grating (see Patter_generator.GenerateGrating).
+
+        Args:
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            lmm (float): Lines per mm of the grating.
+            theta (float): Angle of the grating.
+        """
+        if lmm == 0:
+            return
+        scaling = 255/(1e-3/lmm/(pixel_pitch*1e-6))
+        self.ramp_x += scaling*np.cos(theta)
+        self.ramp_y += scaling*np.sin(theta)
+
+    def add_lens(self, focus, wl, pixel_pitch):
+        """Adds a lens centered on the SLM (see Patter_generator.GenerateLens).
+
+        Args:
+            focus (float): Focus of the lens.
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+        """
+        if focus == 0 :
+            focus = 1
+        focus = focus * 1e-3
+        wl = wl * 1e-9
+        pixel_pitch = pixel_pitch*1e-6
+        curvature = 255*pixel_pitch**2/(2*wl*focus)
+        rmax = np.abs(wl*focus/(2*pixel_pitch)/pixel_pitch)
+        self.lenses.append((0., 0., curvature, rmax))
+
+    def add_zernike(self, coefficients, x_offset, y_offset, aperture = None):
+        """Adds a Zernike expansion (see Patter_generator.GenerateZernike, the pattern is 0 outside the aperture).
+
+        Args:
+            coefficients (list): List of coefficients for the Zernike polynomial.
+            x_offset (int): Zernike center on the X axis.
+            y_offset (int): Zernike center on the Y axis.
+            aperture (:Aperture:, optional): Pupil outside of which the polynomials are not evaluated. Defaults to None (whole SLM).
+        """
+        monomials = None
+        for j, c in enumerate(coefficients):
+            if c == 0:
+                continue
+            n, m = _osa_to_nm(j)
+            if monomials is None or monomials.shape[0] <= n:
+                grown = np.zeros((n + 1, n + 1))
+                if monomials is not None:
+                    grown[:monomials.shape[0], :monomials.shape[1]] = monomials
+                monomials = grown
+            monomials[:n + 1, :n + 1] += c*255*_zernike_monomials(n, m)
+        if monomials is None:
+            return
+        columns = np.zeros((self.res_Y, 2), dtype = np.int64)
+        if aperture is None:
+            columns[:, 1] = self.res_X
+        else:
+            rows, starts, stops, _ = aperture.row_spans(self.res_X, self.res_Y)
+            columns[rows, 0] = starts
+            columns[rows, 1] = stops
+        shift = (int(self.res_X/2) - x_offset, y_offset - int(self.res_Y/2))
+        self.zernike.append((shift, columns, monomials))
+
+    def is_empty(self):
+        """Checks if no element has been added.
+
+        Returns:
+            bool: True if the pattern is identically 0.
+        """
+        return self.ramp_x == 0 and self.ramp_y == 0 and len(self.lenses) == 0 and len(self.zernike) == 0
+
+    def kernel_arguments(self):
+        """Packs the elements in the arrays used by the composition kernel.
+
+        Returns:
+            tuple: ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns and zernike_monomials.
+        """
+        lenses = np.array(self.lenses, dtype = np.float64).reshape(-1, 4)
+        shifts = np.array([shift for shift, _, _ in self.zernike], dtype = np.float64).reshape(-1, 2)
+        columns = np.array([columns for _, columns, _ in self.zernike], dtype = np.int64).reshape(-1, self.res_Y, 2)
+        size = max([monomials.shape[0] for _, _, monomials in self.zernike], default = 1)
+        monomials = np.zeros((len(self.zernike), size, size))
+        for g, (_, _, group_monomials) in enumerate(self.zernike):
+            monomials[g, :group_monomials.shape[0], :group_monomials.shape[1]] = group_monomials
+        return self.ramp_x, self.ramp_y, lenses, shifts, columns, monomials
+
 class Patter_generator:
     """Class for generating phases patterns.
+    The hologram engines are created on first use, so that Holography and Propagation (and their kernels) are only loaded
+    when a spot array, target image, trap or defocus pattern is computed.
 
     Attributes:
-        X (int): X resolution of the pattern (SLM).
-        Y (int): Y resolution of the pattern (SLM).
+        coordinates (:CoordinateGrid:): Cache of the SLM pixel coordinates.
+        zernike_cache (:ZernikeBasisCache:): Cache of the evaluated Zernike polynomials.
+        spot_engine (:SpotArrayEngine:): Gerchberg-Saxton engine used for spot arrays (keeps its work arrays between computations).
+        target_engine (:MRAFEngine:): MRAF engine used for target images (shares the work arrays cache of spot_engine).
+        gradient_engine (:GradientSpotEngine:): L-BFGS engine used to refine spot arrays (shares the work arrays cache of spot_engine).
+        multiplane_engine (:MultiPlaneSpotEngine:): Gerchberg-Saxton engine used for spots in several planes (shares the work arrays cache of spot_engine).
+        trap_engine (:SuperpositionEngine:): Direct superposition engine used for moving spots (keeps the field of the last hologram for incremental updates).
+        use_symmetry (bool): If True, centered lenses are computed on one quadrant and mirrored (see ZernikeBasisCache.use_symmetry for the Zernike polynomials).
+        dtype (np.dtype): Data type of the generated patterns. Patterns are always computed in double precision, only the stored values are rounded.
     """
 
-    def __init__(self):
+    def __init__(self, dtype = np.float32):
         """Constructor for the Pattern_generator class.
+
+        Args:
+            dtype (np.dtype, optional): Data type of the generated patterns. Defaults to np.float32 (enough for an 8-bit SLM, half the memory traffic of np.float64).
         """
-        self.X = None
-        self.Y = None
+        self.coordinates = CoordinateGrid()
+        self.zernike_cache = ZernikeBasisCache()
+        self._engines = None
+        self._engines_lock = threading.Lock()
+        self.use_symmetry = True
+        self.set_dtype(dtype)
+
+    def _engine(self, name):
+        """Returns one of the hologram engines, importing Holography and Propagation and creating the engines on first use.
+
+        Args:
+            name (str): "spot", "target", "gradient", "multiplane" or "trap".
 
-    def GenerateLens(self,focus, wl, pixel_pitch, res_X, res_Y):
+        Returns:
+            The requested engine.
+        """
+        with self._engines_lock:
+            if self._engines is None:
+                import SLMcontroller.Holography as Holography
+                import SLMcontroller.Propagation as Propagation
+                spot_engine = Holography.SpotArrayEngine()
+                self._engines = {"spot": spot_engine,
+                                 "target": Holography.MRAFEngine(spot_engine.workspace),
+                                 "gradient": Holography.GradientSpotEngine(spot_engine.workspace),
+                                 "multiplane": Propagation.MultiPlaneSpotEngine(spot_engine.workspace),
+                                 "trap": Holography.SuperpositionEngine(spot_engine.workspace)}
+            return self._engines[name]
+
+    @property
+    def spot_engine(self):
+        return self._engine("spot")
+
+    @property
+    def target_engine(self):
+        return self._engine("target")
+
+    @property
+    def gradient_engine(self):
+        return self._engine("gradient")
+
+    @property
+    def multiplane_engine(self):
+        return self._engine("multiplane")
+
+    @property
+    def trap_engine(self):
+        return self._engine("trap")
+
+    def set_dtype(self, dtype):
+        """Sets the data type of the generated patterns.
+
+        Args:
+            dtype (np.dtype): np.float32 or np.float64.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("Patterns can only be generated as float32 or float64, not " + str(dtype))
+        self.dtype = dtype
+
+    def GenerateLens(self,focus, wl, pixel_pitch, res_X, res_Y, aperture = None):
         """Generates a lens pattern.
+        Only the pixels inside the lens useful radius (and inside the aperture, if any) are evaluated, the others are set to 0.
 
         Args:
             focus (float): Focus of the lens.
@@ -131,6 +1065,7 @@ class Patter_generator:
             pixel_pitch (float): Pixel pitch of the SLM.
             res_X (int): SLM X resolution.
             res_Y (int): SLM Y resolution.
+            aperture (:Aperture:, optional): Pupil outside of which the lens is not evaluated. Defaults to None (whole SLM).
 
         Returns:
             np.array: Lens pattern.
@@ -144,38 +1079,62 @@ class Patter_generator:
         wl = wl * 1e-9
         pixel_pitch = pixel_pitch*1e-6
         # Generate meshgrid if needed
-        self.generate_mesh(res_X, res_Y)
+        X, Y = self.generate_mesh(res_X, res_Y)
+        x, y = X[0], Y[:, 0]
 
-        return _generateLens(self.X, self.Y, x_offset, y_offset, wl, focus, pixel_pitch)
+        # Pixels farther than rmax from the lens center are masked, skip them with (slightly larger) row spans
+        rmax = np.abs(wl*focus/(2*pixel_pitch)/pixel_pitch)
+        step_x = x[1] - x[0] if res_X > 1 else 1.
+        step_y = y[1] - y[0] if res_Y > 1 else 1.
+        lens_area = Aperture((res_X - 1)/2 + x_offset/step_x, (res_Y - 1)/2 + y_offset/step_y, min(rmax/step_x + 1, 2*res_X), min(rmax/step_y + 1, 2*res_Y))
+        spans = lens_area.row_spans(res_X, res_Y)
+        if aperture is not None:
+            spans = _intersect_spans(spans, aperture.row_spans(res_X, res_Y))
+
+        lens = np.zeros((res_Y, res_X), dtype = self.dtype)
+        # A centered lens has four-fold mirror symmetry, compute one quadrant and mirror it
+        symmetric = self.use_symmetry and aperture is None and x_offset == 0 and y_offset == 0 and _is_antisymmetric(x) and _is_antisymmetric(y)
+        if symmetric:
+            spans = _intersect_spans(spans, _quadrant_spans(res_X, res_Y))
+        _generateLens(x, y, spans[0], spans[1], spans[2], x_offset, y_offset, wl, focus, pixel_pitch, lens)
+        if symmetric:
+            _mirror_quadrant(lens)
+        return lens
     
-    def GenerateZernike(self, coefficients, res_X, res_Y, x_offset, y_offset):
+    def GenerateZernike(self, coefficients, res_X, res_Y, x_offset, y_offset, aperture = None, fill = 0.):
         """Generates a Zernike pattern.
 
         Args:
             coefficients (list): List of coefficients for the Zernike polynomial.
             res_X (int): SLM X resolution.
             res_Y (int): SLM Y resolution.
+            x_offset (int): Zernike center on the X axis.
+            y_offset (int): Zernike center on the Y axis.
+            aperture (:Aperture:, optional): Pupil outside of which the polynomials are not evaluated. Defaults to None (whole SLM).
+            fill (float, optional): Value of the pattern outside the aperture. Defaults to 0.
 
         Returns:
             np.array: Zernike pattern.
+
+        Raises:
+            ValueError: If the highest order overflows in double precision on the SLM (see _check_zernike_orders).
         """
 
-        self.generate_mesh(res_X, res_Y)
-        Zernike = np.zeros((res_Y, res_X))
-        n = 0
-        m = -n
-        for order in range(len(coefficients)):
-            while (n*(n+2)+m)/2 <= order:
-                Zernike +=  coefficients[order] * _ZernikePolynomial(n, m, -x_offset + self.X + int(res_X/2), self.Y - int(res_Y/2) + y_offset )
-                m += 2
-                if m > n:
-                    n += 1
-                    m = -n 
-        # As the Zernike pattern is a sum of various patterns it needs renormalization
-        return (Zernike*255)#%256
+        X, Y = self.generate_mesh(res_X, res_Y)
+        coefficients = np.asarray(coefficients, dtype = np.float64)
+        # Single contraction over the cached polynomials (BLAS), the 255 scaling is folded in the coefficients.
+        # The contraction is done in double precision, only the pattern is stored in the generator dtype
+        values, spans = self.zernike_cache.contract(coefficients*255, X, Y, x_offset, y_offset, aperture)
+        if aperture is None:
+            return values.reshape(res_Y, res_X).astype(self.dtype, copy = False) #%256
+        Zernike = np.full((res_Y, res_X), fill, dtype = self.dtype)
+        _scatter_spans(values, *spans, Zernike)
+        return Zernike #%256
 
-    def GenerateGrating(self, wl, pixel_pitch, lmm, theta, res_X, res_Y):
-        """Generates a grating pattern.
+    def GenerateGrating(self, wl, pixel_pitch, lmm, theta, res_X, res_Y, out = None, snap_tolerance = 0., return_period = False):
+        """Generates a grating pattern, wrapped in [0,256).
+        If the grating repeats itself after a small number of pixels (see grating_period) only one period is computed 
+        and then copied over the SLM, otherwise every pixel is evaluated.
 
         Args:
             wl (float): Wavelength of the laser.
@@ -184,17 +1143,370 @@ class Patter_generator:
             theta (float): Angle of the grating.
             res_X (int): SLM X resolution.
             res_Y (int): SLM Y resolution.
+            out (np.array, optional): Buffer where the grating is written (e.g. the previous grating). 
+                A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+            snap_tolerance (float, optional): Maximum phase error (in gray levels, across the whole SLM) allowed when snapping the grating to the nearest periodic one. Defaults to 0 (no snapping).
+            return_period (bool, optional): If True the period used is returned with the pattern. Defaults to False.
+
+        Returns:
+            np.array: Grating pattern. If return_period is True, a tuple with the pattern and the period (see grating_period, None if the pattern was evaluated directly).
+        """
+        out = self.output_buffer(out, res_X, res_Y)
+        period = self.grating_period(wl, pixel_pitch, lmm, theta, res_X, res_Y, snap_tolerance)
+        if (lmm == 0 ):
+            out.fill(0)
+        elif period is not None:
+            X, Y = self.generate_mesh(res_X, res_Y)
+            period_X, period_Y, step_X, step_Y = period
+            # Phase of the first pixel, then the tile is a linear ramp wrapped in [0,256)
+            start = self._grating_scaling(pixel_pitch, lmm)*(Y[0, 0]*np.sin(theta) + X[0, 0]*np.cos(theta))
+            tile = np.mod(start + np.arange(period_Y)[:, None]*step_Y + np.arange(period_X)[None, :]*step_X, 256)
+            _tile_pattern(tile, out)
+        else:
+            X, Y = self.generate_mesh(res_X, res_Y)
+            # Number of pixel per line
+            pixel_pitch = pixel_pitch*1e-6
+            pxl = 1e-3/lmm/pixel_pitch
+            _generateGrating(X,Y,pxl,theta,out)
+        if return_period:
+            return out, period
+        return out
+
+    def GenerateAnalytic(self, terms, out = None, accumulate = False):
+        """Generates the pattern described by an AnalyticPattern in a single pass over the SLM.
+
+        Args:
+            terms (:AnalyticPattern:): Elements to be combined.
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+            accumulate (bool, optional): If True the pattern is added to the contents of out. Defaults to False.
+
+        Returns:
+            np.array: Combined pattern.
+        """
+        if accumulate and (out is None or out.shape != (terms.res_Y, terms.res_X)):
+            raise ValueError("Cannot accumulate on a buffer not matching the SLM resolution")
+        if not accumulate:
+            out = self.output_buffer(out, terms.res_X, terms.res_Y)
+        X, Y = self.generate_mesh(terms.res_X, terms.res_Y)
+        _composeAnalytic(X[0], Y[:, 0], *terms.kernel_arguments(), accumulate, out)
+        return out
+
+    def GenerateSpotArray(self, lmm_x, lmm_y, pixel_pitch, res_X, res_Y, intensities = None, iterations = 30, uniformity = 0.99, weighted = True, out = None):
+        """Generates a hologram producing an array of spots in the Fourier plane with the (weighted) Gerchberg-Saxton algorithm.
+        A spot at (lmm_x, lmm_y) is deflected like the first order of a grating with lmm_x lines per mm along X and lmm_y along Y.
+        Statistics of the result (uniformity, efficiency, iterations) are kept in spot_engine.
+
+        Args:
+            lmm_x (np.array): Position of each spot along X (lines per mm).
+            lmm_y (np.array): Position of each spot along Y (lines per mm).
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            intensities (np.array, optional): Relative intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of iterations. Defaults to 30.
+            uniformity (float, optional): The iterations stop once the spots reach this uniformity, 1 - (max - min)/(max + min). Defaults to 0.99.
+            weighted (bool, optional): If True weighted Gerchberg-Saxton, plain Gerchberg-Saxton otherwise. Defaults to True.
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+
+        Returns:
+            np.array: Phase pattern (wrapped in [0,256)).
+        """
+        # Spatial frequencies in cycles per pixel
+        scaling = pixel_pitch*1e-6/1e-3
+        freq_x = np.asarray(lmm_x, dtype = np.float64)*scaling
+        freq_y = np.asarray(lmm_y, dtype = np.float64)*scaling
+        if np.any(np.abs(freq_x) > 0.5) or np.any(np.abs(freq_y) > 0.5):
+            raise ValueError("Spots beyond " + str(0.5/scaling) + " l/mm cannot be reached with this pixel pitch")
+        out = self.output_buffer(out, res_X, res_Y)
+        return self.spot_engine.compute(freq_x, freq_y, res_X, res_Y, out, intensities, iterations, uniformity, weighted)
+
+    def GenerateSpotArray3D(self, lmm_x, lmm_y, depth, wl, pixel_pitch, focal_length, res_X, res_Y, intensities = None, iterations = 30, uniformity = 0.99, method = "angular", out = None):
+        """Generates a hologram producing spots in several planes around the focal plane of the Fourier lens with the weighted Gerchberg-Saxton algorithm.
+        The defocus kernel of each plane is cached (see Propagation.KernelCache), recomputing a hologram with the same planes doesn't evaluate them again.
+        Statistics of the result (uniformity, efficiency, iterations) are kept in multiplane_engine.
+
+        Args:
+            lmm_x (np.array): Position of each spot along X (lines per mm).
+            lmm_y (np.array): Position of each spot along Y (lines per mm).
+            depth (np.array): Distance of each spot from the focal plane (mm, positive away from the lens).
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            focal_length (float): Focal length of the Fourier lens (mm).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            intensities (np.array, optional): Relative intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of iterations. Defaults to 30.
+            uniformity (float, optional): The iterations stop once the spots reach this uniformity. Defaults to 0.99.
+            method (str, optional): Defocus kernels, "angular" (angular spectrum) or "fresnel". Defaults to "angular".
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+
+        Returns:
+            np.array: Phase pattern (wrapped in [0,256)).
+        """
+        scaling = pixel_pitch*1e-6/1e-3
+        freq_x = np.asarray(lmm_x, dtype = np.float64)*scaling
+        freq_y = np.asarray(lmm_y, dtype = np.float64)*scaling
+        if np.any(np.abs(freq_x) > 0.5) or np.any(np.abs(freq_y) > 0.5):
+            raise ValueError("Spots beyond " + str(0.5/scaling) + " l/mm cannot be reached with this pixel pitch")
+        if focal_length <= 0:
+            raise ValueError("The focal length of the Fourier lens must be positive")
+        out = self.output_buffer(out, res_X, res_Y)
+        return self.multiplane_engine.compute(freq_x, freq_y, depth, wl, pixel_pitch, focal_length, res_X, res_Y, out, intensities, iterations, uniformity, method = method)
+
+    def GenerateDefocus(self, distance, focal_length, wl, pixel_pitch, res_X, res_Y, method = "angular", out = None):
+        """Generates the phase pattern moving the focal plane of the Fourier lens by a distance (from the cached defocus kernel, see Propagation.defocus_kernel).
+
+        Args:
+            distance (float): Displacement of the focal plane (mm, positive away from the lens).
+            focal_length (float): Focal length of the Fourier lens (mm).
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            method (str, optional): "angular" (angular spectrum) or "fresnel" (lens). Defaults to "angular".
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+
+        Returns:
+            np.array: Phase pattern (wrapped in [0,256)).
+        """
+        import SLMcontroller.Holography as Holography
+        import SLMcontroller.Propagation as Propagation
+        kernel = Propagation.defocus_kernel(wl, pixel_pitch, distance, focal_length, (res_Y, res_X), method)
+        out = self.output_buffer(out, res_X, res_Y)
+        Holography._field_to_levels(kernel, out)
+        return out
+
+    def GenerateSpotArrayOptimized(self, lmm_x, lmm_y, pixel_pitch, res_X, res_Y, intensities = None, iterations = 50, uniformity_weight = 100., initial = None, gs_iterations = 30, out = None):
+        """Generates a hologram producing an array of spots in the Fourier plane, optimized with L-BFGS for efficiency and uniformity (see GradientSpotEngine).
+        The optimization starts from a weighted Gerchberg-Saxton hologram, or from a given pattern (e.g. the current one, after a small edit of the spots).
+        Statistics of the result (uniformity, efficiency, iterations) are kept in gradient_engine.
+
+        Args:
+            lmm_x (np.array): Position of each spot along X (lines per mm).
+            lmm_y (np.array): Position of each spot along Y (lines per mm).
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            intensities (np.array, optional): Relative intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of L-BFGS iterations. Defaults to 50.
+            uniformity_weight (float, optional): Weight of the non-uniformity in the cost (the rest being the efficiency). Defaults to 100.
+            initial (np.array, optional): Phase pattern to start from. Defaults to None (weighted Gerchberg-Saxton).
+            gs_iterations (int, optional): Maximum number of Gerchberg-Saxton iterations of the starting hologram. Defaults to 30.
+            out (np.array, optional): Buffer where the pattern is written (can be initial). A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+
+        Returns:
+            np.array: Phase pattern (wrapped in [0,256)).
+        """
+        scaling = pixel_pitch*1e-6/1e-3
+        freq_x = np.asarray(lmm_x, dtype = np.float64)*scaling
+        freq_y = np.asarray(lmm_y, dtype = np.float64)*scaling
+        if np.any(np.abs(freq_x) > 0.5) or np.any(np.abs(freq_y) > 0.5):
+            raise ValueError("Spots beyond " + str(0.5/scaling) + " l/mm cannot be reached with this pixel pitch")
+        out = self.output_buffer(out, res_X, res_Y)
+        if initial is None or initial.shape != out.shape:
+            initial = self.spot_engine.compute(freq_x, freq_y, res_X, res_Y, out, intensities, gs_iterations)
+        return self.gradient_engine.compute(freq_x, freq_y, res_X, res_Y, out, initial, intensities, iterations, uniformity_weight)
+
+    def GenerateTargetImage(self, target, pixel_pitch, res_X, res_Y, lmm_x = 0., lmm_y = 0., scale = 1., padding = 2, mixing = 0.5, iterations = 30, out = None):
+        """Generates a hologram reproducing a target intensity image in the Fourier plane with the MRAF algorithm.
+        The center of the image is deflected like the first order of a grating with lmm_x lines per mm along X and lmm_y along Y.
+        Statistics of the result (efficiency, error) are kept in target_engine.
+
+        Args:
+            target (np.array): Target intensity image.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            lmm_x (float, optional): Position of the center of the image along X (lines per mm). Defaults to 0.
+            lmm_y (float, optional): Position of the center of the image along Y (lines per mm). Defaults to 0.
+            scale (float, optional): Fourier plane bins (of the padded grid) per image pixel. Defaults to 1.
+            padding (int, optional): Zero-padding factor of the Fourier plane. Defaults to 2.
+            mixing (float, optional): Fraction of the power assigned to the signal region. Defaults to 0.5.
+            iterations (int, optional): Number of iterations. Defaults to 30.
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
+
+        Returns:
+            np.array: Phase pattern (wrapped in [0,256)).
+        """
+        scaling = pixel_pitch*1e-6/1e-3
+        freq_x, freq_y = lmm_x*scaling, lmm_y*scaling
+        if abs(freq_x) > 0.5 or abs(freq_y) > 0.5:
+            raise ValueError("Positions beyond " + str(0.5/scaling) + " l/mm cannot be reached with this pixel pitch")
+        out = self.output_buffer(out, res_X, res_Y)
+        return self.target_engine.compute(target, res_X, res_Y, out, freq_x, freq_y, scale, padding, mixing, iterations)
+
+    def GenerateTraps(self, lmm_x, lmm_y, lens_power, wl, pixel_pitch, res_X, res_Y, amplitudes = None, optimize = 0, out = None):
+        """Generates a hologram of (moving) spots by direct superposition of a tilt and a lens per spot.
+        A spot at (lmm_x, lmm_y) is deflected like the first order of a grating with lmm_x lines per mm along X and lmm_y along Y,
+        its lens moves it along the optical axis. Consecutive calls where only a few spots changed are updated incrementally (see SuperpositionEngine),
+        fast enough to move spots at the display rate.
+
+        Args:
+            lmm_x (np.array): Position of each spot along X (lines per mm).
+            lmm_y (np.array): Position of each spot along Y (lines per mm).
+            lens_power (np.array): Optical power of the lens of each spot (1/m, 0 for spots in the Fourier plane).
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            amplitudes (np.array, optional): Relative amplitude of each spot. Defaults to None (equal amplitudes).
+            optimize (int, optional): Iterations of weighted Gerchberg-Saxton on the phases of the spots (0 keeps the current phases, random for new spots). Defaults to 0.
+            out (np.array, optional): Buffer where the pattern is written. A new array is allocated if None or if it doesn't match the SLM resolution. Defaults to None.
 
         Returns:
-            np.array: Grating pattern.
+            np.array: Phase pattern (wrapped in [0,256)).
         """
-        if (lmm == 0 ): return np.zeros((res_Y, res_X))
+        scaling = pixel_pitch*1e-6/1e-3
+        freq_x = np.asarray(lmm_x, dtype = np.float64)*scaling
+        freq_y = np.asarray(lmm_y, dtype = np.float64)*scaling
+        if np.any(np.abs(freq_x) > 0.5) or np.any(np.abs(freq_y) > 0.5):
+            raise ValueError("Spots beyond " + str(0.5/scaling) + " l/mm cannot be reached with this pixel pitch")
+        # Lens phase pi*r**2/(wl*f), in radians per squared pixel
+        curvature = np.pi*(pixel_pitch*1e-6)**2*np.asarray(lens_power, dtype = np.float64)/(wl*1e-9)
+        out = self.output_buffer(out, res_X, res_Y)
+        self.trap_engine.compute(freq_x, freq_y, curvature, res_X, res_Y, out, amplitudes)
+        if optimize > 0:
+            self.trap_engine.optimize(out, optimize)
+        return out
+
+    def GenerateLensBatch(self, focus, wl, pixel_pitch, res_X, res_Y, dtype = None):
+        """Generates a stack of lenses (e.g. for a focus scan) in a single call.
+
+        Args:
+            focus (np.array): Focus of each lens.
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            dtype (np.dtype, optional): Data type of the stack, np.uint8 gives gray levels wrapped in [0,256). Defaults to None (dtype of the generator).
 
-        # Number of pixel per line
+        Returns:
+            np.array: (N, res_Y, res_X) stack of lens patterns.
+        """
+        focus = np.atleast_1d(np.asarray(focus, dtype = np.float64))
+        # Same conventions as GenerateLens
+        focus = np.where(focus == 0, 1, focus)*1e-3
+        wl = wl * 1e-9
         pixel_pitch = pixel_pitch*1e-6
-        pxl = 1e-3/lmm/pixel_pitch
-        self.generate_mesh(res_X, res_Y)
-        return _generateGrating(self.X,self.Y,pxl,theta)
+        curvatures = 255*pixel_pitch**2/(2*wl*focus)
+        rmax = np.abs(wl*focus/(2*pixel_pitch)/pixel_pitch)
+        X, Y = self.generate_mesh(res_X, res_Y)
+        out, wrap = self._batch_buffer(len(focus), res_X, res_Y, dtype)
+        _generateLensBatch(X[0]**2, Y[:, 0]**2, curvatures, rmax, wrap, out)
+        return out
+
+    def GenerateGratingBatch(self, wl, pixel_pitch, lmm, theta, res_X, res_Y, dtype = None):
+        """Generates a stack of gratings (e.g. for an angle or line density scan) in a single call.
+        lmm and theta are broadcast against each other.
+
+        Args:
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            lmm (np.array): Lines per mm of each grating.
+            theta (np.array): Angle of each grating.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            dtype (np.dtype, optional): Data type of the stack, np.uint8 gives gray levels wrapped in [0,256). Defaults to None (dtype of the generator).
+
+        Returns:
+            np.array: (N, res_Y, res_X) stack of grating patterns.
+        """
+        lmm, theta = np.broadcast_arrays(np.atleast_1d(np.asarray(lmm, dtype = np.float64)), np.atleast_1d(np.asarray(theta, dtype = np.float64)))
+        # Same scaling as _grating_scaling, written so that lmm = 0 gives a flat pattern
+        scaling = 255*lmm*pixel_pitch*1e-6/1e-3
+        X, Y = self.generate_mesh(res_X, res_Y)
+        out, wrap = self._batch_buffer(len(lmm), res_X, res_Y, dtype)
+        _generateGratingBatch(X[0], Y[:, 0], scaling*np.cos(theta), scaling*np.sin(theta), wrap, out)
+        return out
+
+    def GenerateZernikeBatch(self, coefficients, res_X, res_Y, x_offset, y_offset, aperture = None, fill = 0., dtype = None):
+        """Generates a stack of Zernike patterns (e.g. for a coefficient scan) in a single call.
+        All the patterns are obtained with one matrix product against the cached polynomials (see ZernikeBasisCache.contract).
+
+        Args:
+            coefficients (np.array): (N, K) array with the coefficients of each pattern.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            x_offset (int): Zernike center on the X axis.
+            y_offset (int): Zernike center on the Y axis.
+            aperture (:Aperture:, optional): Pupil outside of which the polynomials are not evaluated. Defaults to None (whole SLM).
+            fill (float, optional): Value of the patterns outside the aperture. Defaults to 0.
+            dtype (np.dtype, optional): Data type of the stack, np.uint8 gives gray levels wrapped in [0,256). Defaults to None (dtype of the generator).
+
+        Returns:
+            np.array: (N, res_Y, res_X) stack of Zernike patterns.
+        """
+        coefficients = np.atleast_2d(np.asarray(coefficients, dtype = np.float64))
+        X, Y = self.generate_mesh(res_X, res_Y)
+        weights = coefficients*255
+        out, wrap = self._batch_buffer(len(coefficients), res_X, res_Y, dtype)
+        if aperture is not None:
+            out[...] = (int(np.mod(fill, 256)) & 255) if wrap else fill
+        # Patterns are computed in chunks, so that gray levels never need a full float stack
+        chunk = max(1, (64 << 20)//(res_X*res_Y*weights.itemsize)) if wrap else len(weights)
+        for first in range(0, len(weights), chunk):
+            values, spans = self.zernike_cache.contract(weights[first:first + chunk], X, Y, x_offset, y_offset, aperture)
+            if aperture is None:
+                if wrap:
+                    _wrap_levels(values, out[first:first + chunk].reshape(len(values), -1))
+                else:
+                    out[first:first + chunk] = values.reshape(-1, res_Y, res_X)
+            else:
+                if wrap:
+                    levels = np.empty(values.shape, dtype = np.uint8)
+                    _wrap_levels(values, levels)
+                    values = levels
+                for k in range(len(values)):
+                    _scatter_spans(values[k], *spans, out[first + k])
+        return out
+
+    def grating_period(self, wl, pixel_pitch, lmm, theta, res_X, res_Y, snap_tolerance = 0.):
+        """Finds the period (in pixels) of a grating along the SLM axes.
+        The grating advances by a constant phase from one pixel to the next, it repeats itself when these increments add up to a multiple of 256.
+        A period is used only if it fits at least twice in the SLM and the repeated tile is small compared to the SLM.
+
+        Args:
+            wl (float): Wavelength of the laser.
+            pixel_pitch (float): Pixel pitch of the SLM.
+            lmm (float): Lines per mm of the grating.
+            theta (float): Angle of the grating.
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            snap_tolerance (float, optional): Maximum phase error (in gray levels, across the whole SLM) allowed when snapping the grating to the nearest periodic one. Defaults to 0 (exact periods only).
+
+        Returns:
+            tuple: Period along X, period along Y and phase increments (gray levels) per column and per row. None if the grating has no usable period.
+        """
+        if lmm == 0:
+            return None
+        X, Y = self.generate_mesh(res_X, res_Y)
+        scaling = self._grating_scaling(pixel_pitch, lmm)
+        step_X = scaling*np.cos(theta)*(X[0, 1] - X[0, 0] if res_X > 1 else 1.)
+        step_Y = scaling*np.sin(theta)*(Y[1, 0] - Y[0, 0] if res_Y > 1 else 1.)
+        # Tolerance on the accumulated error over the SLM, floating point errors are always accepted
+        tolerance = max(snap_tolerance, 1e-6)
+        periods = []
+        for step, res in ((step_X, res_X), (step_Y, res_Y)):
+            cycles = Fraction(step/256).limit_denominator(max(res//2, 1))
+            if abs(step - 256*float(cycles))*res > tolerance:
+                return None
+            periods.append((cycles.denominator, 256*float(cycles)))
+        (period_X, step_X), (period_Y, step_Y) = periods
+        if period_X*period_Y > res_X*res_Y/4:
+            return None
+        return period_X, period_Y, step_X, step_Y
+
+    def _grating_scaling(self, pixel_pitch, lmm):
+        """Phase (in gray levels) of a grating per unit of SLM coordinates.
+
+        Args:
+            pixel_pitch (float): Pixel pitch of the SLM.
+            lmm (float): Lines per mm of the grating.
+
+        Returns:
+            float: Phase scaling.
+        """
+        return 255/(1e-3/lmm/(pixel_pitch*1e-6))
 
     def empty_pattern(self,res_X, res_Y):
         """Generates an empty pattern.
@@ -206,22 +1518,49 @@ class Patter_generator:
         Returns:
             np.array: Empty pattern.
         """
-        return np.zeros((res_Y, res_X))
+        return np.zeros((res_Y, res_X), dtype = self.dtype)
 
-    def generate_mesh(self, res_X, res_Y):
-        """Generates a meshgrid for the pattern.
-        Used to speed up the pattern generation.
+    def output_buffer(self, out, res_X, res_Y):
+        """Returns out if it can hold a pattern of the given resolution, otherwise a new array.
 
         Args:
+            out (np.array): Candidate output buffer (can be None).
             res_X (int): X resolution of the pattern (SLM).
             res_Y (int): Y resolution of the pattern (SLM).
+
+        Returns:
+            np.array: Output buffer.
         """
-        if self.X is None or self.Y is None:
-            x_list = np.linspace(-int(res_X/2),int(res_X/2),res_X)
-            y_list = np.linspace(-int(res_Y/2),int(res_Y/2),res_Y)
-            self.X, self.Y = np.meshgrid(x_list,y_list)
-        elif len(self.X) != res_X or len(self.Y) != res_Y:
-            x_list = np.linspace(-int(res_X/2),int(res_X/2),res_X)
-            y_list = np.linspace(-int(res_Y/2),int(res_Y/2),res_Y)
-            self.X, self.Y = np.meshgrid(x_list,y_list)
+        if out is not None and out.shape == (res_Y, res_X) and out.dtype == self.dtype and out.flags.writeable:
+            return out
+        return np.empty((res_Y, res_X), dtype = self.dtype)
+
+    def _batch_buffer(self, n, res_X, res_Y, dtype):
+        """Allocates the output of a batched generation.
+
+        Args:
+            n (int): Number of patterns.
+            res_X (int): X resolution of the patterns (SLM).
+            res_Y (int): Y resolution of the patterns (SLM).
+            dtype (np.dtype): Requested data type (None for the dtype of the generator, np.uint8 for wrapped gray levels).
 
+        Returns:
+            tuple: (n, res_Y, res_X) array and True if the patterns have to be wrapped to gray levels.
+        """
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        if dtype not in (np.float32, np.float64, np.uint8):
+            raise ValueError("Patterns can only be generated as float32, float64 or uint8, not " + str(dtype))
+        return np.empty((n, res_Y, res_X), dtype = dtype), dtype == np.uint8
+
+    def generate_mesh(self, res_X, res_Y):
+        """Returns the coordinates of the SLM pixels as a sparse meshgrid.
+        Used to speed up the pattern generation. The coordinates are cached per resolution and must not be modified.
+
+        Args:
+            res_X (int): X resolution of the pattern (SLM).
+            res_Y (int): Y resolution of the pattern (SLM).
+
+        Returns:
+            tuple: (1, res_X) X coordinates and (res_Y, 1) Y coordinates.
+        """
+        return self.coordinates.get(res_X, res_Y)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+"""Propagation.py: Propagation of complex fields with the angular spectrum or Fresnel transfer functions (cached), and holograms of spots placed in several planes along the optical axis."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import numba as nb
+import threading
+from collections import OrderedDict
+
+import SLMcontroller.Holography as Holography
+
+# Transfer functions known by the module
+METHODS = ("angular", "fresnel")
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _transfer(freq_x, freq_y, wl, distance, angular, out):
+    """Evaluates a propagation transfer function (up to the constant phase 2*pi*distance/wl).
+    Angular spectrum: exp(2i*pi*distance/wl*(sqrt(1 - wl**2*(fx**2 + fy**2)) - 1)), 0 for the evanescent waves.
+    Fresnel: exp(-1i*pi*wl*distance*(fx**2 + fy**2)).
+
+    Args:
+        freq_x (np.array): X spatial frequencies (cycles per meter).
+        freq_y (np.array): Y spatial frequencies (cycles per meter).
+        wl (float): Wavelength (meters).
+        distance (float): Propagation distance (meters).
+        angular (bool): If True angular spectrum, Fresnel otherwise.
+        out (np.array): (len(freq_y), len(freq_x)) complex output.
+    """
+    for i in nb.prange(out.shape[0]):
+        for j in range(out.shape[1]):
+            rho2 = (freq_x[j]**2 + freq_y[i]**2)*wl**2
+            if angular:
+                if rho2 >= 1:
+                    out[i, j] = 0
+                    continue
+                # sqrt(1 - rho2) - 1 written to avoid the cancellation at small angles
+                phase = -2*np.pi*distance/wl*rho2/(1 + np.sqrt(1 - rho2))
+            else:
+                phase = -np.pi*distance/wl*rho2
+            out[i, j] = np.cos(phase) + 1j*np.sin(phase)
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _multiply_kernel(field, kernel, scaling, conjugate, out):
+    """out = scaling*field*kernel (or its conjugate), out can be field.
+
+    Args:
+        field (np.array): Complex field.
+        kernel (np.array): Complex kernel of the same shape.
+        scaling (float): Scaling of the result.
+        conjugate (bool): If True, the field is multiplied by the conjugate of the kernel.
+        out (np.array): Complex output.
+    """
+    for i in nb.prange(field.shape[0]):
+        for j in range(field.shape[1]):
+            k = kernel[i, j]
+            if conjugate:
+                k = np.conj(k)
+            out[i, j] = scaling*field[i, j]*k
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _accumulate_conjugate(total, field, kernel, scaling):
+    """total += scaling*field*conj(kernel), in place.
+
+    Args:
+        total (np.array): Complex accumulator.
+        field (np.array): Complex field.
+        kernel (np.array): Complex kernel of the same shape.
+        scaling (float): Scaling of the added field.
+    """
+    for i in nb.prange(total.shape[0]):
+        for j in range(total.shape[1]):
+            total[i, j] += scaling*field[i, j]*np.conj(kernel[i, j])
+
+
+class KernelCache:
+    """LRU cache of propagation kernels, keyed by their kind, method, wavelength, pixel pitch, distance (and focal length) and shape.
+    Kernels are read-only complex64 arrays shared by all their users: a stack of planes used again and again (e.g. a z-stack of 10-20 planes)
+    evaluates each kernel once. The least recently used kernels are dropped once the cache exceeds its memory budget.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cache in bytes.
+        hits (int): Number of requests served from the cache.
+        misses (int): Number of kernels evaluated.
+    """
+
+    def __init__(self, max_bytes = 512 << 20):
+        """Constructor for the KernelCache class.
+
+        Args:
+            max_bytes (int, optional): Memory budget of the cache in bytes. Defaults to 512 MiB (about 30 kernels of a 1920x1152 SLM).
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._kernels = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, shape, evaluate):
+        """Returns the kernel stored under key, evaluating it if missing.
+
+        Args:
+            key (tuple): Identifier of the kernel (must be hashable).
+            shape (tuple): Shape of the kernel.
+            evaluate (function): Called on a new complex64 array of the given shape to fill it.
+
+        Returns:
+            np.array: Kernel (read-only).
+        """
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None:
+                self._kernels.move_to_end(key)
+                self.hits += 1
+                return kernel
+        kernel = np.empty(shape, dtype = np.complex64)
+        evaluate(kernel)
+        kernel.flags.writeable = False
+        with self._lock:
+            if key not in self._kernels:
+                self._kernels[key] = kernel
+                self._nbytes += kernel.nbytes
+                self.misses += 1
+            # The least recently used kernels are dropped (the last one is always kept)
+            while self._nbytes > self.max_bytes and len(self._kernels) > 1:
+                _, dropped = self._kernels.popitem(last = False)
+                self._nbytes -= dropped.nbytes
+        return kernel
+
+    def clear(self):
+        """Drops all the cached kernels.
+        """
+        with self._lock:
+            self._kernels.clear()
+            self._nbytes = 0
+
+# Kernels shared by the whole program
+kernel_cache = KernelCache()
+
+def _check_method(method):
+    if method not in METHODS:
+        raise ValueError("Unknown propagation method " + str(method) + ", use one of " + ", ".join(METHODS))
+
+def transfer_function(wl, pixel_pitch, distance, shape, method = "angular", cache = None):
+    """Returns the transfer function propagating a field sampled with the given pixel pitch by a distance (FFT order, zero frequency at [0, 0]).
+
+    Args:
+        wl (float): Wavelength of the laser (nm).
+        pixel_pitch (float): Pixel pitch of the field (um).
+        distance (float): Propagation distance (mm).
+        shape (tuple): Shape of the field.
+        method (str, optional): "angular" (angular spectrum) or "fresnel". Defaults to "angular".
+        cache (:KernelCache:, optional): Cache of the kernels. Defaults to None (kernel_cache).
+
+    Returns:
+        np.array: Transfer function (read-only).
+    """
+    _check_method(method)
+    cache = kernel_cache if cache is None else cache
+    shape = (int(shape[0]), int(shape[1]))
+    def evaluate(kernel):
+        freq_x = np.fft.fftfreq(shape[1], pixel_pitch*1e-6)
+        freq_y = np.fft.fftfreq(shape[0], pixel_pitch*1e-6)
+        _transfer(freq_x, freq_y, wl*1e-9, distance*1e-3, method == "angular", kernel)
+    return cache.get(("transfer", method, float(wl), float(pixel_pitch), float(distance), shape), shape, evaluate)
+
+def defocus_kernel(wl, pixel_pitch, distance, focal_length, shape, method = "angular", cache = None):
+    """Returns the SLM plane kernel moving the focal plane of a Fourier lens by a distance along the optical axis.
+    The spectrum of the SLM field at the SLM position x is the focal plane field at the frequency x/(wl*focal_length), so propagating the focal plane
+    field is a multiplication of the SLM field by the transfer function evaluated there. Fresnel: the usual lens phase, -pi*distance*r**2/(wl*focal_length**2).
+
+    Args:
+        wl (float): Wavelength of the laser (nm).
+        pixel_pitch (float): Pixel pitch of the SLM (um).
+        distance (float): Displacement of the focal plane (mm, positive away from the lens).
+        focal_length (float): Focal length of the Fourier lens (mm).
+        shape (tuple): Shape of the SLM field.
+        method (str, optional): "angular" (angular spectrum) or "fresnel". Defaults to "angular".
+        cache (:KernelCache:, optional): Cache of the kernels. Defaults to None (kernel_cache).
+
+    Returns:
+        np.array: Kernel (read-only, centered on the SLM).
+    """
+    _check_method(method)
+    cache = kernel_cache if cache is None else cache
+    shape = (int(shape[0]), int(shape[1]))
+    def evaluate(kernel):
+        scaling = pixel_pitch*1e-6/(wl*1e-9*focal_length*1e-3)
+        freq_x = (np.arange(shape[1]) - (shape[1] - 1)/2)*scaling
+        freq_y = (np.arange(shape[0]) - (shape[0] - 1)/2)*scaling
+        _transfer(freq_x, freq_y, wl*1e-9, distance*1e-3, method == "angular", kernel)
+    return cache.get(("defocus", method, float(wl), float(pixel_pitch), float(distance), float(focal_length), shape), shape, evaluate)
+
+def propagate(field, wl, pixel_pitch, distance, method = "angular", out = None, cache = None):
+    """Propagates a complex field by a distance (FFT, multiplication by the cached transfer function, inverse FFT).
+    No zero-padding: the field is periodic, pad it beforehand if light leaves the window.
+
+    Args:
+        field (np.array): 2D complex field.
+        wl (float): Wavelength of the laser (nm).
+        pixel_pitch (float): Pixel pitch of the field (um).
+        distance (float): Propagation distance (mm).
+        method (str, optional): "angular" (angular spectrum) or "fresnel". Defaults to "angular".
+        out (np.array, optional): complex64 output, can be field. Defaults to None (new array).
+        cache (:KernelCache:, optional): Cache of the kernels. Defaults to None (kernel_cache).
+
+    Returns:
+        np.array: Propagated field.
+    """
+    kernel = transfer_function(wl, pixel_pitch, distance, field.shape, method, cache)
+    if out is None:
+        out = np.empty(field.shape, dtype = np.complex64)
+    if out is not field:
+        out[...] = field
+    Holography.fft_axis(out, 1, out)
+    Holography.fft_axis(out, 0, out)
+    # fft_axis divides the forward transforms by their length, the inverse ones by their length again
+    _multiply_kernel(out, kernel, float(out.size), False, out)
+    Holography.fft_axis(out, 0, out, inverse = True)
+    Holography.fft_axis(out, 1, out, inverse = True)
+    return out
+
+
+class MultiPlaneSpotEngine:
+    """Computes phase-only holograms of spots placed in several planes around the focal plane of a Fourier lens (3D spot arrays),
+    with the weighted Gerchberg-Saxton algorithm run on all the planes at once: the SLM field is multiplied by the defocus kernel of each plane,
+    propagated to the spots of that plane (same propagators as SpotArrayEngine), and the back-propagated fields of all the planes are summed.
+    Defocus kernels come from a KernelCache, a set of planes used again (e.g. a z-stack while the spots are edited) never evaluates them again.
+
+    Attributes:
+        workspace (:WorkspaceCache:): Cache of the work arrays.
+        kernels (:KernelCache:): Cache of the defocus kernels.
+        uniformity (float): Uniformity of the spot intensities of the last hologram, 1 - (max - min)/(max + min).
+        efficiency (float): Sum of the fractions of the light focused in each spot of the last hologram (pixel envelope excluded, spots aligned along the axis share part of their light, the sum can exceed 1).
+        iterations (int): Number of iterations done for the last hologram.
+        planes (int): Number of planes of the last hologram.
+    """
+
+    def __init__(self, workspace = None, kernels = None):
+        """Constructor for the MultiPlaneSpotEngine class.
+
+        Args:
+            workspace (:WorkspaceCache:, optional): Cache of the work arrays (can be shared with other engines). Defaults to None (new cache).
+            kernels (:KernelCache:, optional): Cache of the defocus kernels. Defaults to None (kernel_cache of the module).
+        """
+        self.workspace = Holography.WorkspaceCache() if workspace is None else workspace
+        self.kernels = kernel_cache if kernels is None else kernels
+        self.uniformity = 0.
+        self.efficiency = 0.
+        self.iterations = 0
+        self.planes = 0
+
+    def compute(self, freq_x, freq_y, depth, wl, pixel_pitch, focal_length, res_X, res_Y, out, intensities = None, iterations = 30, uniformity = 0.99,
+                fix_phase_after = 5, method = "angular", padding = 1, seed = 0):
+        """Computes a hologram producing spots at the given spatial frequencies and depths.
+
+        Args:
+            freq_x (np.array): X spatial frequency of each spot (cycles per pixel, within +-0.5).
+            freq_y (np.array): Y spatial frequency of each spot (cycles per pixel, within +-0.5).
+            depth (np.array): Distance of each spot from the focal plane (mm).
+            wl (float): Wavelength of the laser (nm).
+            pixel_pitch (float): Pixel pitch of the SLM (um).
+            focal_length (float): Focal length of the Fourier lens (mm).
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+            out (np.array): (res_Y, res_X) output phase pattern (gray levels in [0,256)).
+            intensities (np.array, optional): Relative target intensity of each spot. Defaults to None (equal intensities).
+            iterations (int, optional): Maximum number of iterations. Defaults to 30.
+            uniformity (float, optional): The iterations stop once this uniformity is reached. Defaults to 0.99.
+            fix_phase_after (int, optional): The phases of the spots are frozen after this many iterations and only the weights are updated. Defaults to 5.
+            method (str, optional): Defocus kernel, "angular" (angular spectrum) or "fresnel". Defaults to "angular".
+            padding (int, optional): Zero-padding factor of the FFT grid (planes with many distinct frequencies). Defaults to 1.
+            seed (int, optional): Seed of the random phases of the initial superposition. Defaults to 0.
+
+        Returns:
+            np.array: Phase pattern.
+        """
+        freq_x = np.atleast_1d(np.asarray(freq_x, dtype = np.float64))
+        freq_y = np.atleast_1d(np.asarray(freq_y, dtype = np.float64))
+        depth = np.broadcast_to(np.asarray(depth, dtype = np.float64), freq_x.shape)
+        if freq_x.shape != freq_y.shape or freq_x.ndim != 1 or len(freq_x) == 0:
+            raise ValueError("Spots must be given as two 1D arrays of the same length")
+        targets = np.ones(len(freq_x)) if intensities is None else np.sqrt(np.asarray(intensities, dtype = np.float64))
+        if targets.shape != freq_x.shape:
+            raise ValueError("One intensity per spot is needed")
+        _check_method(method)
+
+        # One propagator and one kernel per plane (no kernel for the focal plane)
+        planes = []
+        for z in np.unique(depth):
+            members = np.flatnonzero(depth == z)
+            propagator, _ = Holography._make_propagator(self.workspace, freq_x[members], freq_y[members], res_X, res_Y, "auto", padding)
+            kernel = None if z == 0 else defocus_kernel(wl, pixel_pitch, z, focal_length, (res_Y, res_X), method, self.kernels)
+            planes.append((members, propagator, kernel))
+        self.planes = len(planes)
+        # All the propagators share the same SLM field buffer, the phase-only field and the sum of the planes are kept apart
+        field = self.workspace.get(("multiplane field",), (res_Y, res_X), np.complex64)
+        total = self.workspace.get(("multiplane sum",), (res_Y, res_X), np.complex64)
+
+        def forward():
+            spots = np.empty(len(freq_x), dtype = np.complex128)
+            for members, propagator, kernel in planes:
+                plane_field = propagator.slm_field()
+                if kernel is None:
+                    plane_field[...] = field
+                else:
+                    _multiply_kernel(field, kernel, 1., False, plane_field)
+                spots[members] = propagator.forward()
+            return spots
+
+        def backward(spots):
+            total.fill(0)
+            for members, propagator, kernel in planes:
+                propagator.backward(spots[members])
+                # Adjoint of the propagation to the plane
+                if kernel is None:
+                    Holography._add_scaled(total, propagator.adjoint_scale, propagator.slm_field())
+                else:
+                    _accumulate_conjugate(total, propagator.slm_field(), kernel, propagator.adjoint_scale)
+            field[...] = total
+            Holography._normalize_field(field)
+
+        phases = np.random.default_rng(seed).uniform(0, 2*np.pi, len(targets))
+        backward(targets*np.exp(1j*phases))
+        weights = targets.copy()
+        fixed_phases = None
+        n_pixels = res_X*res_Y
+        for iteration in range(iterations + 1):
+            spots = forward()
+            amplitudes = np.abs(spots)
+            ratios = amplitudes/targets
+            intensity = ratios**2
+            self.uniformity = 1 - (intensity.max() - intensity.min())/max(intensity.max() + intensity.min(), 1e-30)
+            self.efficiency = np.sum(amplitudes**2)/n_pixels**2
+            self.iterations = iteration
+            if self.uniformity >= uniformity or iteration == iterations:
+                break
+            phases = spots/np.maximum(amplitudes, 1e-30)
+            weights *= np.mean(ratios)/np.maximum(ratios, 1e-30)
+            if iteration >= fix_phase_after:
+                if fixed_phases is None:
+                    fixed_phases = phases
+                phases = fixed_phases
+            backward(weights*phases)
+        Holography._field_to_levels(field, out)
+        return out
@@ -8,7 +8,9 @@ __license__ = "GNU GPL v3"
 __maintainer__ = "Matteo Mazzanti"
 
 # -*- coding: utf-8 -*-
-from flask import Flask, jsonify, abort, request, make_response, send_file
+import threading
+
+# Flask is imported when the server starts (see NetworkManager.get_app), not at program startup
 
 
 host_name = "127.0.0.1"
@@ -20,16 +22,42 @@ class NetworkManager(object):
     Based on Flask.
 
     Attributes:
-        app (Flask): Flask app used to manage the remote control.
+        app (Flask): Flask app used to manage the remote control (None till the server is started).
+        import_name (str): Name passed to Flask when the app is created.
+        pending_endpoints (list): Endpoints added before the app was created, registered when it is.
+        lock (threading.Lock): Lock protecting the creation of the app and the endpoints list.
     """
-    def __init__(self, app, **configs, ):
+    def __init__(self, app = None, import_name = "SLMcontroller", **configs, ):
         """Constructor for the NetworkManager class.
 
         Args:
-            app (Flask): Flask app used to manage the remote control.
+            app (Flask, optional): Flask app used to manage the remote control. If None the app is created (and Flask imported) when first needed. Defaults to None.
+            import_name (str, optional): Name passed to Flask when the app is created. Defaults to "SLMcontroller".
         """
         self.app = app
-        self.configs(**configs)
+        self.import_name = import_name
+        self.pending_endpoints = []
+        self.pending_configs = configs
+        self.lock = threading.Lock()
+        if self.app is not None:
+            self.configs(**configs)
+
+    def get_app(self):
+        """Returns the Flask app, creating it (and importing Flask) the first time.
+        Endpoints added before the app existed are registered here.
+
+        Returns:
+            Flask: Flask app used to manage the remote control.
+        """
+        with self.lock:
+            if self.app is None:
+                from flask import Flask
+                self.app = Flask(self.import_name)
+                self.configs(**self.pending_configs)
+                for args, kwargs in self.pending_endpoints:
+                    self.app.add_url_rule(*args, **kwargs)
+                self.pending_endpoints = []
+            return self.app
 
     def configs(self, **configs):
         """Sets the configuration of the Flask app.
@@ -47,6 +75,7 @@ class NetworkManager(object):
             abort(403): If the IP address is not the allowed one.
         """
         def limit_remote_addr(self):
+            from flask import request, abort
             if request.remote_addr != address:
                 abort(403)  # Forbidden
 
@@ -60,6 +89,7 @@ class NetworkManager(object):
         Returns:
             send_file: HTTP response containing the image.
         """
+        from flask import send_file
         return send_file(image, mimetype='image/PNG', as_attachment=False, download_name=name)
 
     def add_endpoint(self, endpoint=None, endpoint_name=None, handler=None, methods=['GET'], *args, **kwargs):
@@ -71,13 +101,18 @@ class NetworkManager(object):
             handler (function, optional): Function to call when the endpoint is called. Defaults to None.
             methods (list, optional): Allowed methods for the endpoint. Defaults to ['GET'].
         """
+        with self.lock:
+            if self.app is None:
+                # Registered once the server starts
+                self.pending_endpoints.append(((endpoint, endpoint_name, handler) + args, dict(kwargs, methods = methods)))
+                return
         self.app.add_url_rule(endpoint, endpoint_name, handler, methods=methods, *args, **kwargs)
 
 
     def run(self, **kwargs):
-        """Runs the Flask app.
+        """Runs the Flask app (blocking, usually called from a server thread).
         """
-        self.app.run(**kwargs)
+        self.get_app().run(**kwargs)
 
 # flask_app = Flask(__name__)
 # app = NetworkManager(flask_app)
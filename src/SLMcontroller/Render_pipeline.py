@@ -0,0 +1,755 @@
+#!/usr/bin/env python
+
+"""Render_pipeline.py: Converts the combined phase pattern into the 8-bit frame displayed on the SLM."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+import numba as nb
+from numba import literal_unroll
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+
+# Size of the phase buffer of a tile in the tiled render mode, small enough to stay in the L2 cache of a core
+TILE_BYTES = 1 << 18
+
+# Quantizers converting the continuous phase to gray levels: "truncate" drops the fractional level (original behaviour),
+# "round" takes the nearest level, "ordered" adds a Bayer threshold matrix and "diffusion" spreads the error to the neighbouring pixels (Floyd-Steinberg)
+QUANTIZERS = ("truncate", "round", "ordered", "diffusion")
+
+# Rows diffused serially by one thread, blocks are independent so that the result doesn't depend on the number of threads
+DIFFUSION_ROWS = 32
+
+# Encodings of the amplitude masks: "scaling" multiplies the gray levels by the mask (original behaviour),
+# "grating depth" scales the depth of the wrapped phase so that the first diffraction order has the amplitude of the mask,
+# "double phase" splits the field A exp(i phi) in two phase-only fields phi +- arccos(A) displayed on a checkerboard
+ENCODINGS = ("scaling", "grating depth", "double phase")
+
+# Number of intervals of the tables mapping an amplitude in [0,1] to the encoding parameter
+ENCODING_SAMPLES = 1024
+
+def _encoding_tables():
+    """Tabulates the encoding parameter of each amplitude: the phase depth M with sinc(1-M) = A for the grating depth encoding
+    (first order amplitude of a blazed grating of depth M), the phase offset arccos(A) (gray levels) for the double phase encoding.
+
+    Returns:
+        np.array: (len(ENCODINGS), ENCODING_SAMPLES+1) tables (the first one unused).
+    """
+    amplitudes = np.linspace(0, 1, ENCODING_SAMPLES + 1)
+    x = np.linspace(0, 1, 1 << 16)
+    tables = np.zeros((len(ENCODINGS), ENCODING_SAMPLES + 1))
+    tables[1] = 1 - np.interp(amplitudes, np.sinc(x)[::-1], x[::-1])
+    tables[2] = np.arccos(amplitudes)*128/np.pi
+    return tables
+
+ENCODING_TABLES = _encoding_tables()
+
+# Side (pixels) of the square blocks sharing the same interpolated table of a spatially varying LUT
+LUT_BLOCK = 16
+
+# 8x8 Bayer matrix, thresholds in (0,1)
+BAYER = np.array([[ 0, 32,  8, 40,  2, 34, 10, 42],
+                  [48, 16, 56, 24, 50, 18, 58, 26],
+                  [12, 44,  4, 36, 14, 46,  6, 38],
+                  [60, 28, 52, 20, 62, 30, 54, 22],
+                  [ 3, 35, 11, 43,  1, 33,  9, 41],
+                  [51, 19, 59, 27, 49, 17, 57, 25],
+                  [15, 47,  7, 39, 13, 45,  5, 37],
+                  [63, 31, 55, 23, 61, 29, 53, 21]], dtype = np.float64)/64 + 1/128
+
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _quantize(pattern, correction, mask, frame):
+    """Wraps the phase in [0,256), rescales it to the SLM 2pi value and writes the gray levels, in a single pass.
+    Matches (np.mod(pattern,256)*correction/255).astype(np.uint8), followed by np.mod(frame*mask,256).astype(np.uint8) if a mask is given.
+
+    Args:
+        pattern (np.array): Phase pattern (gray levels, not wrapped).
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        mask (np.array): Amplitude mask (can be None).
+        frame (np.array): uint8 output frame.
+    """
+    for i in nb.prange(pattern.shape[0]):
+        for j in range(pattern.shape[1]):
+            level = np.uint8(int(np.mod(pattern[i, j], 256)*correction/255) & 255)
+            if mask is not None:
+                level = np.uint8(int(np.mod(level*mask[i, j], 256)) & 255)
+            frame[i, j] = level
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _apply_mask(mask, frame):
+    """Scales the gray levels of a frame by an amplitude mask, in place.
+    Matches np.mod(np.multiply(frame,mask),256).astype(np.uint8).
+
+    Args:
+        mask (np.array): Amplitude mask.
+        frame (np.array): uint8 frame.
+    """
+    for i in nb.prange(frame.shape[0]):
+        for j in range(frame.shape[1]):
+            frame[i, j] = np.uint8(int(np.mod(frame[i, j]*mask[i, j], 256)) & 255)
+
+@nb.jit(nopython = True, cache = True)
+def _output_level(level, period, levels):
+    """Brings an integer gray level in the range of the SLM.
+    Phase levels are wrapped to [0, period), the gray level of a 2pi phase shift being equivalent to 0.
+    Precompensated levels (see CrosstalkCompensator) are clipped to [0, 255] instead.
+
+    Args:
+        level (int): Gray level, a few levels outside [0, period) at most.
+        period (int): Gray level corresponding to a 2pi phase shift.
+        levels (bool): True for precompensated levels.
+
+    Returns:
+        np.uint8: Gray level.
+    """
+    if levels:
+        return np.uint8(min(max(level, 0), 255))
+    while level >= period:
+        level -= period
+    while level < 0:
+        level += period
+    return np.uint8(level & 255)
+
+@nb.jit(nopython = True, cache = True)
+def _encode_phase(value, i, j, amplitude, encoding, table):
+    """Encodes the amplitude of a pixel in its phase (see ENCODINGS).
+
+    Args:
+        value (float): Phase (gray levels, not wrapped).
+        i (int): Row of the pixel.
+        j (int): Column of the pixel.
+        amplitude (np.array): Amplitude map in [0,1] (None for no encoding).
+        encoding (int): Index of the encoding in ENCODINGS.
+        table (np.array): Encoding parameter of each amplitude (row of ENCODING_TABLES).
+
+    Returns:
+        float: Encoded phase (gray levels).
+    """
+    if amplitude is None or encoding == 0:
+        return value
+    index = int(min(max(amplitude[i, j], 0.), 1.)*(table.shape[0] - 1) + 0.5)
+    if encoding == 1:
+        return np.mod(value, 256)*table[index]
+    # +arccos(A) on the even pixels of the checkerboard, -arccos(A) on the odd ones
+    return value + (1 - 2*((i + j) & 1))*table[index]
+
+@nb.jit(nopython = True, cache = True)
+def _input_level(value, scale, levels):
+    """Converts a value of the phase pattern to a continuous gray level.
+
+    Args:
+        value (float): Phase (gray levels, not wrapped), or gray level if levels is True.
+        scale (float): Ratio between the gray level of a 2pi phase shift on the SLM and 255.
+        levels (bool): True if the values are already gray levels (precompensated).
+
+    Returns:
+        float: Continuous gray level.
+    """
+    if levels:
+        return value
+    return np.mod(value, 256)*scale
+
+@nb.jit(nopython = True, cache = True, fastmath = True)
+def _dither_rows(rows, first, correction, mode, levels, amplitude, encoding, table, frame):
+    """Quantizes a block of rows of the phase pattern and writes the gray levels, wrapped to [0, correction).
+    Also quantizes precompensated gray levels (levels is True), which are clipped to [0, 255] instead.
+    An amplitude map can be encoded in the phase on the fly (see _encode_phase).
+
+    Args:
+        rows (np.array): Rows of the phase pattern (gray levels, not wrapped), or continuous gray levels.
+        first (int): Row of the frame corresponding to the first row of the block.
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        mode (int): Index of the quantizer in QUANTIZERS.
+        levels (bool): True if rows holds continuous gray levels instead of phases.
+        amplitude (np.array): Full frame amplitude map in [0,1] (None for no encoding).
+        encoding (int): Index of the encoding in ENCODINGS.
+        table (np.array): Encoding parameter of each amplitude (row of ENCODING_TABLES).
+        frame (np.array): uint8 output frame.
+    """
+    period = max(correction, 1)
+    scale = correction/255
+    n_rows, n_cols = rows.shape
+    if mode <= 1:
+        offset = 0.5 if mode == 1 else 0.
+        for i in range(n_rows):
+            for j in range(n_cols):
+                # The shift by a period makes the conversion to int a floor for negative values too
+                value = _encode_phase(rows[i, j], first + i, j, amplitude, encoding, table)
+                level = int(_input_level(value, scale, levels) + offset + period) - period
+                frame[first + i, j] = _output_level(level, period, levels)
+        return
+    if mode == 2:
+        for i in range(n_rows):
+            thresholds = BAYER[(first + i) & 7]
+            for j in range(n_cols):
+                value = _encode_phase(rows[i, j], first + i, j, amplitude, encoding, table)
+                level = int(_input_level(value, scale, levels) + thresholds[j & 7] + period) - period
+                frame[first + i, j] = _output_level(level, period, levels)
+        return
+    # Error diffused to the next row, padded by one pixel on each side
+    errors = np.zeros(n_cols + 2)
+    next_errors = np.zeros(n_cols + 2)
+    values = np.empty(n_cols)
+    for i in range(n_rows):
+        # Wrapping and scaling are vectorized, only the diffusion is sequential
+        for j in range(n_cols):
+            values[j] = _input_level(_encode_phase(rows[i, j], first + i, j, amplitude, encoding, table), scale, levels) + errors[j + 1]
+        # Serpentine scan, avoids the drift of the error along the scan direction
+        step = 1 - 2*(i & 1)
+        j = 0 if step == 1 else n_cols - 1
+        carry = 0.
+        # Errors of the previous two pixels diffused below them (kept in registers)
+        below = 0.
+        below_next = 0.
+        for k in range(n_cols):
+            value = values[j] + carry
+            level = int(value + 0.5 + period) - period
+            error = value - level
+            carry = error*(7/16)
+            next_errors[j + 1 - step] = below + error*(3/16)
+            below = below_next + error*(5/16)
+            below_next = error*(1/16)
+            frame[first + i, j] = _output_level(level, period, levels)
+            j += step
+        next_errors[j + 1 - step] = below
+        next_errors[j + 1] = below_next
+        errors, next_errors = next_errors, errors
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _quantize_dithered(pattern, correction, mode, levels, amplitude, encoding, table, frame):
+    """Quantizes the phase pattern (or precompensated gray levels) with _dither_rows, blocks of DIFFUSION_ROWS rows are handled in parallel.
+
+    Args:
+        pattern (np.array): Phase pattern (gray levels, not wrapped), or continuous gray levels.
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        mode (int): Index of the quantizer in QUANTIZERS.
+        levels (bool): True if pattern holds continuous gray levels instead of phases.
+        amplitude (np.array): Amplitude map in [0,1] (None for no encoding).
+        encoding (int): Index of the encoding in ENCODINGS.
+        table (np.array): Encoding parameter of each amplitude (row of ENCODING_TABLES).
+        frame (np.array): uint8 output frame.
+    """
+    n_blocks = (pattern.shape[0] + DIFFUSION_ROWS - 1)//DIFFUSION_ROWS
+    for b in nb.prange(n_blocks):
+        first = b*DIFFUSION_ROWS
+        _dither_rows(pattern[first:min(first + DIFFUSION_ROWS, pattern.shape[0])], first, correction, mode, levels, amplitude, encoding, table, frame)
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _wrapped_levels(pattern, correction, offset, amplitude, encoding, table, levels):
+    """Wraps the phase in [0,256) and rescales it to continuous gray levels (see _quantize), shifted by an offset.
+
+    Args:
+        pattern (np.array): Phase pattern (gray levels, not wrapped).
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        offset (float): Gray level added to all the pixels.
+        amplitude (np.array): Amplitude map in [0,1] encoded in the phase (None for no encoding).
+        encoding (int): Index of the encoding in ENCODINGS.
+        table (np.array): Encoding parameter of each amplitude (row of ENCODING_TABLES).
+        levels (np.array): float32 output gray levels.
+    """
+    scale = correction/255
+    for i in nb.prange(pattern.shape[0]):
+        for j in range(pattern.shape[1]):
+            levels[i, j] = np.mod(_encode_phase(pattern[i, j], i, j, amplitude, encoding, table), 256)*scale + offset
+
+def _inverse_crosstalk(width, regularization, spectrum):
+    """Evaluates the inverse filter of a Gaussian crosstalk kernel on the rfft2 frequencies of a frame.
+    The Wiener-like filter K(1+eps)/(K^2+eps) inverts the low frequencies, keeps the mean level and limits the gain at high frequencies to (1+eps)/(2 sqrt(eps)).
+
+    Args:
+        width (float): Standard deviation of the crosstalk kernel (pixels).
+        regularization (float): Regularization eps of the inverse filter.
+        spectrum (np.array): (res_Y, res_X//2+1) complex64 array, filled with the filter.
+    """
+    res_Y = spectrum.shape[0]
+    res_X = 2*(spectrum.shape[1] - 1)
+    fy = np.fft.fftfreq(res_Y)[:, None]
+    fx = np.fft.rfftfreq(res_X)[None, :]
+    kernel = np.exp(-2*(np.pi*width)**2*(fx**2 + fy**2))
+    spectrum[:] = kernel*(1 + regularization)/(kernel**2 + regularization)
+
+class CrosstalkCompensator:
+    """Precompensates the fringing-field crosstalk between neighbouring pixels, which smooths the displayed phase and lowers the efficiency
+    of high-frequency gratings. The crosstalk is modeled as a Gaussian blur of the gray levels, the frame is filtered with its regularized inverse
+    (one rfft2/irfft2 pair) before quantization. The sharper jumps at the 2pi wraps use the gray levels between the phase correction and 255,
+    the levels are shifted to the middle of the available range and clipped to [0, 255].
+
+    The filter spectra are evaluated once per (resolution, kernel) and kept in a KernelCache shared by all the compensators,
+    the float32 levels and the spectrum buffers are reused between frames.
+
+    Attributes:
+        width (float): Standard deviation of the crosstalk kernel (pixels).
+        regularization (float): Regularization of the inverse filter.
+        cache (:KernelCache:): Cache of the filter spectra.
+    """
+    # Filter spectra of all the compensators (about 9 MB each for a 1920x1152 SLM), created with the first compensator
+    spectra = None
+
+    def __init__(self, width, regularization = 0.05, cache = None):
+        """Constructor for the CrosstalkCompensator class.
+
+        Args:
+            width (float): Standard deviation of the crosstalk kernel (pixels).
+            regularization (float, optional): Regularization of the inverse filter, limits the gain at high frequencies. Defaults to 0.05.
+            cache (:KernelCache:, optional): Cache of the filter spectra. Defaults to None (shared cache).
+
+        Raises:
+            ValueError: If the width is negative or the regularization is not positive.
+        """
+        if width < 0 or regularization <= 0:
+            raise ValueError("The crosstalk width must be positive and the regularization strictly positive")
+        self.width = float(width)
+        self.regularization = float(regularization)
+        if cache is None:
+            # Propagation is only imported once the crosstalk precompensation is enabled
+            import SLMcontroller.Propagation as Propagation
+            if CrosstalkCompensator.spectra is None:
+                CrosstalkCompensator.spectra = Propagation.KernelCache(64 << 20)
+            cache = CrosstalkCompensator.spectra
+        self.cache = cache
+        self._levels = None
+        self._spectrum = None
+
+    def filter_spectrum(self, res_X, res_Y):
+        """Returns the inverse filter on the rfft2 frequencies of a frame (cached).
+
+        Args:
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+
+        Returns:
+            np.array: (res_Y, res_X//2+1) read-only complex64 filter.
+        """
+        key = ("crosstalk", self.width, self.regularization, res_Y, res_X)
+        return self.cache.get(key, (res_Y, res_X//2 + 1), lambda spectrum: _inverse_crosstalk(self.width, self.regularization, spectrum))
+
+    def precompensate(self, pattern, correction, amplitude = None, encoding = "scaling"):
+        """Converts a phase pattern to precompensated continuous gray levels.
+
+        Args:
+            pattern (np.array): Phase pattern (gray levels, not wrapped).
+            correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+            amplitude (np.array, optional): Amplitude map in [0,1] encoded in the phase before the precompensation. Defaults to None.
+            encoding (str, optional): Encoding of the amplitude, one of ENCODINGS. Defaults to "scaling" (amplitude ignored).
+
+        Returns:
+            np.array: float32 gray levels (overwritten by the next call), to be quantized and clipped to [0, 255].
+        """
+        res_Y, res_X = pattern.shape
+        if self._levels is None or self._levels.shape != pattern.shape:
+            self._levels = np.empty((res_Y, res_X), dtype = np.float32)
+            self._spectrum = np.empty((res_Y, res_X//2 + 1), dtype = np.complex64)
+        index = encoding_index(encoding) if amplitude is not None else 0
+        _wrapped_levels(pattern, correction, (255 - correction)/2, amplitude if index > 0 else None, index, ENCODING_TABLES[index], self._levels)
+        if self.width == 0:
+            return self._levels
+        # numpy < 2 has no out argument for the FFTs, the results are copied in the buffers
+        import SLMcontroller.Holography as Holography
+        if Holography.FFT_OUT:
+            np.fft.rfft2(self._levels, out = self._spectrum)
+        else:
+            self._spectrum[...] = np.fft.rfft2(self._levels)
+        np.multiply(self._spectrum, self.filter_spectrum(res_X, res_Y), out = self._spectrum)
+        if Holography.FFT_OUT:
+            return np.fft.irfft2(self._spectrum, s = (res_Y, res_X), out = self._levels)
+        self._levels[...] = np.fft.irfft2(self._spectrum, s = (res_Y, res_X))
+        return self._levels
+
+def encoding_index(encoding):
+    """Returns the index of an amplitude encoding in ENCODINGS.
+
+    Args:
+        encoding (str): Name of the encoding.
+
+    Raises:
+        ValueError: If the encoding is unknown.
+
+    Returns:
+        int: Index of the encoding.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown amplitude encoding " + str(encoding) + ", expected one of " + ", ".join(ENCODINGS))
+    return ENCODINGS.index(encoding)
+
+def amplitude_map(masks):
+    """Combines the amplitude masks in a single amplitude map.
+
+    Args:
+        masks (list): Amplitude masks (values in [0,1]).
+
+    Returns:
+        np.array: Product of the masks, None if there is no mask.
+    """
+    if len(masks) == 0:
+        return None
+    if len(masks) == 1:
+        return masks[0]
+    return np.prod(np.array(masks), axis = 0)
+
+def quantizer_index(quantizer):
+    """Returns the index of a quantizer in QUANTIZERS.
+
+    Args:
+        quantizer (str): Name of the quantizer.
+
+    Raises:
+        ValueError: If the quantizer is unknown.
+
+    Returns:
+        int: Index of the quantizer.
+    """
+    if quantizer not in QUANTIZERS:
+        raise ValueError("Unknown quantizer " + str(quantizer) + ", expected one of " + ", ".join(QUANTIZERS))
+    return QUANTIZERS.index(quantizer)
+
+def frame_buffer(frame, res_X, res_Y):
+    """Returns frame if it can hold a SLM frame of the given resolution, otherwise a new array.
+
+    Args:
+        frame (np.array): Candidate frame buffer (can be None).
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+
+    Returns:
+        np.array: (res_Y, res_X) uint8 frame buffer.
+    """
+    if frame is not None and frame.shape == (res_Y, res_X) and frame.dtype == np.uint8 and frame.flags.c_contiguous:
+        return frame
+    return np.empty((res_Y, res_X), dtype = np.uint8)
+
+def render_frame(pattern, correction, masks = (), frame = None, quantizer = "truncate", crosstalk = None, lut = None, encoding = "scaling"):
+    """Converts a phase pattern to the gray levels displayed on the SLM.
+    Wrapping, phase correction, quantization and the first amplitude mask are done in a single pass, further masks are applied in place.
+    The dithering quantizers remove the systematic error of the truncation (ghost orders of slowly varying phases), the masks are then applied in place.
+    With the grating depth and double phase encodings the masks are combined in an amplitude map encoded in the phase within the quantization pass.
+
+    Args:
+        pattern (np.array): Phase pattern (gray levels, not wrapped).
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        masks (list, optional): Amplitude masks, same shape as the pattern. Defaults to ().
+        frame (np.array, optional): Frame buffer to be reused (e.g. the previous frame). A new one is allocated if None or if it doesn't match the pattern. Defaults to None.
+        quantizer (str, optional): Quantizer, one of QUANTIZERS. Defaults to "truncate".
+        crosstalk (:CrosstalkCompensator:, optional): Crosstalk precompensation applied before the quantization. Defaults to None.
+        lut (:LookupTable:, optional): Gray-level lookup table applied last, in place. Defaults to None.
+        encoding (str, optional): Encoding of the amplitude masks, one of ENCODINGS. Defaults to "scaling".
+
+    Returns:
+        np.array: uint8 frame.
+    """
+    mode = quantizer_index(quantizer)
+    index = encoding_index(encoding)
+    frame = frame_buffer(frame, pattern.shape[1], pattern.shape[0])
+    amplitude = None
+    if index > 0 and len(masks) > 0:
+        amplitude = amplitude_map(masks)
+        masks = ()
+    else:
+        index = 0
+    table = ENCODING_TABLES[index]
+    if crosstalk is not None:
+        _quantize_dithered(crosstalk.precompensate(pattern, correction, amplitude, encoding), correction, mode, True, None, 0, table, frame)
+    elif mode == 0 and amplitude is None:
+        _quantize(pattern, correction, masks[0] if len(masks) > 0 else None, frame)
+        masks = masks[1:]
+    else:
+        _quantize_dithered(pattern, correction, mode, False, amplitude, index, table, frame)
+    for mask in masks:
+        _apply_mask(mask, frame)
+    if lut is not None:
+        lut.apply(frame)
+    return frame
+
+@nb.jit(nopython = True, parallel = True, cache = True)
+def _apply_lut(tables, block, column_cells, frame):
+    """Maps the gray levels of a frame through a set of tables, in place (a single gather per pixel).
+
+    Args:
+        tables (np.array): (cells_Y, cells_X, 256) uint8 tables, one per block of pixels.
+        block (int): Side of the blocks (pixels).
+        column_cells (np.array): Index of the block of each column.
+        frame (np.array): uint8 frame.
+    """
+    last = tables.shape[0] - 1
+    for i in nb.prange(frame.shape[0]):
+        row_tables = tables[min(i//block, last)]
+        for j in range(frame.shape[1]):
+            frame[i, j] = row_tables[column_cells[j], frame[i, j]]
+
+def _blend_tables(tables, res_X, res_Y, block):
+    """Interpolates a grid of tables at the centers of the blocks of pixels.
+    The tables of the grid are measured at the centers of the regions of a regular grid over the panel, tables are interpolated bilinearly
+    in between and kept constant beyond the outer centers.
+
+    Args:
+        tables (np.array): (grid_Y, grid_X, 256) tables.
+        res_X (int): SLM X resolution.
+        res_Y (int): SLM Y resolution.
+        block (int): Side of the blocks (pixels).
+
+    Returns:
+        np.array: (cells_Y, cells_X, 256) uint8 tables.
+    """
+    def weights(grid, res):
+        # Position of the block centers in units of grid regions, relative to the first region center
+        centers = ((np.arange((res + block - 1)//block) + 0.5)*block*grid/res - 0.5).clip(0, grid - 1)
+        low = np.minimum(np.floor(centers).astype(int), max(grid - 2, 0))
+        return low, np.minimum(low + 1, grid - 1), (centers - low)[:, None]
+    low_y, high_y, wy = weights(tables.shape[0], res_Y)
+    low_x, high_x, wx = weights(tables.shape[1], res_X)
+    rows = tables[low_y]*(1 - wy[:, :, None]) + tables[high_y]*wy[:, :, None]
+    blended = rows[:, low_x]*(1 - wx[None, :, :]) + rows[:, high_x]*wx[None, :, :]
+    return np.rint(blended).clip(0, 255).astype(np.uint8)
+
+class LookupTable:
+    """Gray-level lookup table (LUT) correcting the nonlinear phase response of the SLM: the gray level of each pixel is replaced by table[level].
+    The table can be global (256 entries) or spatially varying: a grid of tables measured over regions of the panel and interpolated in between.
+    The interpolation is done once per resolution: the panel is cut in blocks of LUT_BLOCK pixels, each with its own uint8 table (a few MB
+    for a 1920x1152 SLM), so that applying the LUT is a single gather in the uint8 domain.
+
+    Attributes:
+        tables (np.array): (grid_Y, grid_X, 256) float tables as loaded.
+        block (int): Side of the blocks sharing the same interpolated table (pixels).
+    """
+
+    def __init__(self, tables, block = LUT_BLOCK):
+        """Constructor for the LookupTable class.
+
+        Args:
+            tables (np.array): (256,) global table or (grid_Y, grid_X, 256) grid of tables, 8-bit gray levels.
+            block (int, optional): Side of the blocks sharing the same interpolated table (pixels). Defaults to LUT_BLOCK.
+
+        Raises:
+            ValueError: If the tables don't have 256 entries or the values are not 8-bit gray levels.
+        """
+        tables = np.asarray(tables, dtype = np.float64)
+        if tables.ndim == 1:
+            tables = tables[None, None, :]
+        if tables.ndim != 3 or tables.shape[2] != 256 or tables.shape[0] == 0 or tables.shape[1] == 0:
+            raise ValueError("A LUT needs 256 entries per table, got an array of shape " + str(tables.shape))
+        if tables.min() < 0 or tables.max() > 255:
+            raise ValueError("LUT values must be 8-bit gray levels")
+        self.tables = tables
+        self.block = max(int(block), 1)
+        self._resolution = None
+        self._cells = None
+        self._column_cells = None
+        self._row_block = None
+
+    def is_global(self):
+        """Returns True if the same table is used over the whole panel.
+        """
+        return self.tables.shape[:2] == (1, 1)
+
+    def prepare(self, res_X, res_Y):
+        """Interpolates the tables for a SLM resolution (done once, kept till the resolution changes).
+
+        Args:
+            res_X (int): SLM X resolution.
+            res_Y (int): SLM Y resolution.
+
+        Returns:
+            np.array: (cells_Y, cells_X, 256) uint8 tables of the blocks.
+        """
+        if self._resolution != (res_X, res_Y):
+            if self.is_global():
+                self._cells = np.rint(self.tables).astype(np.uint8)
+                self._column_cells = np.zeros(res_X, dtype = np.int32)
+                block = max(res_Y, 1)
+            else:
+                self._cells = _blend_tables(self.tables, res_X, res_Y, self.block)
+                self._column_cells = (np.arange(res_X)//self.block).astype(np.int32)
+                block = self.block
+            self._row_block = block
+            self._resolution = (res_X, res_Y)
+        return self._cells
+
+    def apply(self, frame):
+        """Maps the gray levels of a frame through the LUT, in place.
+
+        Args:
+            frame (np.array): uint8 frame.
+
+        Returns:
+            np.array: The frame.
+        """
+        self.prepare(frame.shape[1], frame.shape[0])
+        _apply_lut(self._cells, self._row_block, self._column_cells, frame)
+        return frame
+
+def load_lut(path, block = LUT_BLOCK):
+    """Loads a LUT file.
+    Text files (.lut, .blt, .txt, .csv, values separated by spaces, tabs, commas or semicolons) hold one table per column, 256 rows;
+    a first column with the input levels 0..255 is skipped. Several tables are read as a square grid of regions, row by row.
+    .npy files hold a (256,) table or a (grid_Y, grid_X, 256) grid of tables.
+    Tables with more than 8 bits (e.g. 0..2047) are rescaled to 8-bit gray levels.
+
+    Args:
+        path (str): Path to the LUT file.
+        block (int, optional): Side of the blocks sharing the same interpolated table (pixels). Defaults to LUT_BLOCK.
+
+    Raises:
+        ValueError: If the file can't be read as a LUT.
+
+    Returns:
+        :LookupTable: Lookup table.
+    """
+    if os.path.splitext(path)[1].lower() == ".npy":
+        tables = np.load(path)
+    else:
+        with open(path) as file:
+            rows = [line.replace(",", " ").replace(";", " ").split() for line in file]
+        try:
+            tables = np.array([[float(value) for value in row] for row in rows if len(row) > 0])
+        except ValueError:
+            raise ValueError("The LUT file " + path + " doesn't contain only numbers") from None
+        if tables.ndim != 2 or tables.shape[0] != 256:
+            raise ValueError("The LUT file " + path + " must contain 256 rows with the same number of columns")
+        if tables.shape[1] > 1 and np.array_equal(tables[:, 0], np.arange(256)):
+            tables = tables[:, 1:]
+        n = tables.shape[1]
+        side = int(round(np.sqrt(n)))
+        if side*side != n:
+            raise ValueError("The LUT file " + path + " contains " + str(n) + " tables, a square grid is expected")
+        tables = tables.T.reshape(side, side, 256)
+    tables = np.asarray(tables, dtype = np.float64)
+    if tables.size > 0 and tables.max() > 255:
+        # Tables of SLMs driven with more than 8 bits
+        bits = int(np.ceil(np.log2(tables.max() + 1)))
+        tables = tables*255/(2**bits - 1)
+    return LookupTable(tables, block)
+
+@nb.jit(nopython = True, cache = True)
+def _add_rows(patterns, first, tile):
+    """Adds rows of several patterns (possibly of different data types) to a tile.
+
+    Args:
+        patterns (tuple): Patterns to be added, empty (0, 0) arrays are skipped.
+        first (int): First row of the tile.
+        tile (np.array): Tile of the phase pattern.
+    """
+    for pattern in literal_unroll(patterns):
+        if pattern.shape[0] == 0:
+            continue
+        for i in range(tile.shape[0]):
+            for j in range(tile.shape[1]):
+                tile[i, j] += pattern[first + i, j]
+
+@nb.jit(nopython = True, cache = True)
+def _mask_level(masks, i, j, level):
+    """Applies several amplitude masks (see _apply_mask) to one gray level.
+
+    Args:
+        masks (tuple): Amplitude masks, empty (0, 0) arrays are skipped.
+        i (int): Row of the pixel.
+        j (int): Column of the pixel.
+        level (np.uint8): Gray level.
+
+    Returns:
+        np.uint8: Masked gray level.
+    """
+    for mask in literal_unroll(masks):
+        if mask.shape[0] == 0:
+            continue
+        level = np.uint8(int(np.mod(level*mask[i, j], 256)) & 255)
+    return level
+
+@nb.jit(nopython = True, parallel = True, cache = True, fastmath = True)
+def _render_tiles(x, y, ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials, patterns, masks, correction, mode, amplitude, encoding, table, tile_rows, frame):
+    """Generates, combines and quantizes the hologram tile by tile (blocks of rows), without building the full phase pattern.
+    Each tile is handled by one thread in a small buffer that stays in cache from the generation to the quantization.
+
+    Args:
+        x (np.array): X coordinates of the SLM columns.
+        y (np.array): Y coordinates of the SLM rows.
+        ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials: Closed-form elements (see Phase_pattern.AnalyticPattern.kernel_arguments).
+        patterns (tuple): Patterns of the elements without closed form (empty (0, 0) arrays are skipped).
+        masks (tuple): Amplitude masks (empty (0, 0) arrays are skipped).
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        mode (int): Index of the quantizer in QUANTIZERS.
+        amplitude (np.array): Amplitude map in [0,1] encoded in the phase (None for no encoding).
+        encoding (int): Index of the encoding in ENCODINGS.
+        table (np.array): Encoding parameter of each amplitude (row of ENCODING_TABLES).
+        tile_rows (int): Number of rows of a tile.
+        frame (np.array): uint8 output frame.
+    """
+    res_Y, res_X = frame.shape
+    n_tiles = (res_Y + tile_rows - 1)//tile_rows
+    for t in nb.prange(n_tiles):
+        first = t*tile_rows
+        last = min(first + tile_rows, res_Y)
+        tile = np.empty((last - first, res_X))
+        for i in range(first, last):
+            Phase_pattern._compose_row(i, x, y, ramp_x, ramp_y, lenses, zernike_shifts, zernike_columns, zernike_monomials, False, tile[i - first])
+        _add_rows(patterns, first, tile)
+        if mode == 0 and amplitude is None:
+            for i in range(first, last):
+                for j in range(res_X):
+                    level = np.uint8(int(np.mod(tile[i - first, j], 256)*correction/255) & 255)
+                    frame[i, j] = _mask_level(masks, i, j, level)
+        else:
+            # Same independent blocks of DIFFUSION_ROWS rows as _quantize_dithered (tiles start on a block boundary)
+            for block in range(first, last, DIFFUSION_ROWS):
+                _dither_rows(tile[block - first:min(block + DIFFUSION_ROWS, last) - first], block, correction, mode, False, amplitude, encoding, table, frame)
+            for i in range(first, last):
+                for j in range(res_X):
+                    frame[i, j] = _mask_level(masks, i, j, frame[i, j])
+
+def render_tiled(pattern_generator, analytic, patterns, correction, masks = (), frame = None, tile_bytes = TILE_BYTES, quantizer = "truncate", lut = None, encoding = "scaling", crosstalk = None):
+    """Renders the hologram tile by tile: closed-form elements are generated, the other patterns added and the result quantized
+    while the tile is in cache. The working set is bounded by the tile size times the number of threads, not by the frame size
+    times the number of elements. Gives the same frame as generating the pattern, adding the patterns and calling render_frame.
+    The crosstalk precompensation filters the whole frame: when it is enabled the pattern is built in full and rendered with render_frame.
+
+    Args:
+        pattern_generator (:Patter_generator:): Pattern generator (provides the SLM coordinates).
+        analytic (:AnalyticPattern:): Closed-form elements.
+        patterns (list): Patterns of the elements without closed form.
+        correction (int): Gray level corresponding to a 2pi phase shift on the SLM.
+        masks (list, optional): Amplitude masks. Defaults to ().
+        frame (np.array, optional): Frame buffer to be reused (e.g. the previous frame). Defaults to None.
+        tile_bytes (int, optional): Size of the phase buffer of a tile. Defaults to TILE_BYTES.
+        quantizer (str, optional): Quantizer, one of QUANTIZERS. With error diffusion the tiles are a multiple of DIFFUSION_ROWS rows, so that the frame matches render_frame. Defaults to "truncate".
+        lut (:LookupTable:, optional): Gray-level lookup table applied last, in place. Defaults to None.
+        encoding (str, optional): Encoding of the amplitude masks, one of ENCODINGS. Defaults to "scaling".
+        crosstalk (:CrosstalkCompensator:, optional): Crosstalk precompensation, disables the tiles if its width is not 0. Defaults to None.
+
+    Returns:
+        np.array: uint8 frame.
+    """
+    if crosstalk is not None and crosstalk.width > 0:
+        pattern = pattern_generator.GenerateAnalytic(analytic)
+        for array in patterns:
+            pattern += array
+        return render_frame(pattern, correction, masks, frame, quantizer = quantizer, crosstalk = crosstalk, lut = lut, encoding = encoding)
+    mode = quantizer_index(quantizer)
+    index = encoding_index(encoding)
+    res_X, res_Y = analytic.res_X, analytic.res_Y
+    for array in list(patterns) + list(masks):
+        if array.shape != (res_Y, res_X):
+            raise ValueError("Pattern of shape " + str(array.shape) + " doesn't match the SLM resolution")
+    frame = frame_buffer(frame, res_X, res_Y)
+    X, Y = pattern_generator.generate_mesh(res_X, res_Y)
+    # Empty tuples can't be typed, an empty array stands for "nothing"
+    empty = np.zeros((0, 0))
+    amplitude = None
+    if index > 0 and len(masks) > 0:
+        amplitude = amplitude_map(masks)
+        masks = ()
+    else:
+        index = 0
+    patterns = tuple(patterns) if len(patterns) > 0 else (empty,)
+    masks = tuple(masks) if len(masks) > 0 else (empty,)
+    tile_rows = max(1, tile_bytes//(8*res_X))
+    if QUANTIZERS[mode] == "diffusion":
+        tile_rows = max(1, tile_rows//DIFFUSION_ROWS)*DIFFUSION_ROWS
+    _render_tiles(X[0], Y[:, 0], *analytic.kernel_arguments(), patterns, masks, correction, mode, amplitude, index, ENCODING_TABLES[index], tile_rows, frame)
+    if lut is not None:
+        lut.apply(frame)
+    return frame
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""SpotArray.py: Generates a tab used to control a spot array element. The hologram is computed with the (weighted) Gerchberg-Saxton algorithm, optionally refined with L-BFGS."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+from PyQt6.QtWidgets import QDoubleSpinBox, QSpinBox, QGridLayout, QVBoxLayout, QWidget, QCheckBox, QLabel, QPushButton, QMessageBox, QComboBox
+from PyQt6.QtCore import Qt
+
+import SLMcontroller.utils as utils
+import numpy as np
+
+class SpotArrayTab(QWidget):
+    """Generates a tab used to control a spot array element: a rectangular array of spots in the Fourier plane, or a stack of such arrays
+    in several planes around it (the focal length of the Fourier lens is then needed).
+    Spots positions are given in lines per mm, as for the grating (a single spot at (l/mm, 0) is deflected like a grating with the same line density).
+    Arrays with several planes are computed with GenerateSpotArray3D (no L-BFGS refinement).
+    The hologram is computed with the GenerateSpotArray function of the PatternGenerator class, or with GenerateSpotArrayOptimized
+    when the L-BFGS refinement is enabled (starting from the current hologram if warm start is enabled).
+
+    Attributes:
+        pattern (:numpy.ndarray:): Array containing the computed hologram.
+        pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+        settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution and pixel pitch.
+        hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        maxlmm (float): Maximum spot position (lines per mm) reachable with the SLM pixel pitch.
+        lastvals (list): Parameters used to compute the last hologram (used to avoid re-computing it).
+    """
+    def __init__(self, pattern_generator, settings_manager, hologram_manager):
+        """Constructor for the SpotArrayTab class.
+
+        Args:
+            pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+            settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution and pixel pitch.
+            hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        """
+        super().__init__()
+        self.pattern = None
+        self.pattern_generator = pattern_generator
+        self.settings_manager = settings_manager
+        self.hologram_manager = hologram_manager
+        self.maxlmm = 1e-3/(2*self.settings_manager.get_pixel_pitch()*1e-6)
+        self.lastvals = []
+        self.init_GUI()
+
+    def init_GUI(self):
+        """Generates the GUI elements of the tab.
+        The tab contains:
+        - Spinboxes for the number of spots, their spacing and the center of the array.
+        - Spinboxes for the number of planes, their spacing and the focal length of the Fourier lens, a selector of the defocus kernels.
+        - Spinboxes for the maximum number of iterations and the target uniformity, a checkbox to use the weighted algorithm.
+        - A checkbox to refine the hologram with L-BFGS, spinboxes for its iterations and the weight of the uniformity, a checkbox to start from the current hologram.
+        - A button to compute the hologram and a label with the result of the last computation.
+        - A checkbox to activate the element and one to enable live updating.
+        - An image preview of the hologram.
+        """
+        self.general_controls_layout = QVBoxLayout()
+        self.isactive = QCheckBox("Activate element : ")
+        self.isactive.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.liveupdate = QCheckBox("Live updating : ")
+        self.liveupdate.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.general_controls_layout.addWidget(self.isactive)
+        self.general_controls_layout.addWidget(self.liveupdate)
+
+        self.make_array_controls()
+        self.make_algorithm_controls()
+        self.make_image_preview()
+
+        self.layout = QGridLayout()
+        self.layout.addLayout(self.array_layout,0,0)
+        self.layout.addLayout(self.algorithm_layout,1,0)
+        self.layout.addLayout(self.image_preview_layout,2,0)
+        self.layout.addLayout(self.general_controls_layout,3,0)
+
+        self.setLayout(self.layout)
+
+    def make_spinbox(self, text, suffix, minimum, maximum, value, decimals = 4):
+        """Generates a spinbox connected to update_parameters.
+
+        Args:
+            text (str): Prefix shown in the spinbox.
+            suffix (str): Unit shown in the spinbox.
+            minimum (float): Minimum value.
+            maximum (float): Maximum value.
+            value (float): Initial value.
+            decimals (int, optional): Number of decimals (0 for an integer spinbox). Defaults to 4.
+
+        Returns:
+            QAbstractSpinBox: The spinbox.
+        """
+        spin = QSpinBox() if decimals == 0 else QDoubleSpinBox()
+        if decimals > 0:
+            spin.setDecimals(decimals)
+        spin.setPrefix(text)
+        spin.setSuffix(suffix)
+        spin.setKeyboardTracking(False)
+        spin.setMinimum(minimum)
+        spin.setMaximum(maximum)
+        spin.setValue(value)
+        spin.valueChanged.connect(self.update_parameters)
+        return spin
+
+    def make_array_controls(self):
+        """Generates the spinboxes used to define the spot array and adds them to the GUI.
+        """
+        self.array_layout = QGridLayout()
+        self.spin_nx = self.make_spinbox("Spots X: ", "", 1, 100, 3, 0)
+        self.spin_ny = self.make_spinbox("Spots Y: ", "", 1, 100, 3, 0)
+        self.spin_dx = self.make_spinbox("Spacing X: ", " l/mm", 0, self.maxlmm, 1.)
+        self.spin_dy = self.make_spinbox("Spacing Y: ", " l/mm", 0, self.maxlmm, 1.)
+        self.spin_cx = self.make_spinbox("Center X: ", " l/mm", -self.maxlmm, self.maxlmm, 5.)
+        self.spin_cy = self.make_spinbox("Center Y: ", " l/mm", -self.maxlmm, self.maxlmm, 0.)
+        self.array_layout.addWidget(self.spin_nx,0,0)
+        self.array_layout.addWidget(self.spin_ny,0,1)
+        self.array_layout.addWidget(self.spin_dx,1,0)
+        self.array_layout.addWidget(self.spin_dy,1,1)
+        self.spin_nz = self.make_spinbox("Planes: ", "", 1, 50, 1, 0)
+        self.spin_dz = self.make_spinbox("Spacing Z: ", " um", 0, 1e5, 10., 2)
+        self.spin_focal = self.make_spinbox("Fourier lens: ", " mm", 0.1, 1e4, 200., 2)
+        self.propagation = QComboBox()
+        self.propagation.addItems(["angular", "fresnel"])
+        self.propagation.currentIndexChanged.connect(self.update_parameters)
+        self.array_layout.addWidget(self.spin_cx,2,0)
+        self.array_layout.addWidget(self.spin_cy,2,1)
+        self.array_layout.addWidget(self.spin_nz,3,0)
+        self.array_layout.addWidget(self.spin_dz,3,1)
+        self.array_layout.addWidget(self.spin_focal,4,0)
+        self.array_layout.addWidget(self.propagation,4,1)
+
+    def make_algorithm_controls(self):
+        """Generates the controls of the Gerchberg-Saxton algorithm and adds them to the GUI.
+        """
+        self.algorithm_layout = QGridLayout()
+        self.spin_iterations = self.make_spinbox("Max iterations: ", "", 0, 1000, 30, 0)
+        self.spin_uniformity = self.make_spinbox("Target uniformity: ", "", 0, 1, 0.99, 3)
+        self.spin_uniformity.setSingleStep(0.001)
+        self.weighted = QCheckBox("Weighted GS : ")
+        self.weighted.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.weighted.setChecked(True)
+        self.weighted.stateChanged.connect(self.update_parameters)
+        self.compute_button = QPushButton("Compute hologram")
+        self.compute_button.clicked.connect(self.compute_pattern)
+        self.result_label = QLabel("Not computed")
+        self.algorithm_layout.addWidget(self.spin_iterations,0,0)
+        self.algorithm_layout.addWidget(self.spin_uniformity,0,1)
+        self.refine = QCheckBox("L-BFGS refinement : ")
+        self.refine.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.refine.stateChanged.connect(self.update_parameters)
+        self.warm_start = QCheckBox("Warm start : ")
+        self.warm_start.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.warm_start.setChecked(True)
+        self.spin_refine_iterations = self.make_spinbox("L-BFGS iterations: ", "", 1, 1000, 50, 0)
+        self.spin_uniformity_weight = self.make_spinbox("Uniformity weight: ", "", 0, 1e6, 100., 1)
+        self.algorithm_layout.addWidget(self.weighted,1,0)
+        self.algorithm_layout.addWidget(self.refine,1,1)
+        self.algorithm_layout.addWidget(self.spin_refine_iterations,2,0)
+        self.algorithm_layout.addWidget(self.spin_uniformity_weight,2,1)
+        self.algorithm_layout.addWidget(self.warm_start,3,0)
+        self.algorithm_layout.addWidget(self.compute_button,3,1)
+        self.algorithm_layout.addWidget(self.result_label,4,0,1,2)
+
+    def make_image_preview(self):
+        """Generates the image preview of the hologram.
+        """
+        self.image_preview_layout = QVBoxLayout()
+        self.pattern_image = utils.ImageWidget()
+        self.image_preview_layout.addWidget(self.pattern_image)
+
+    def get_spots(self):
+        """Returns the positions of the spots of the array.
+
+        Returns:
+            tuple: X and Y positions of the spots (lines per mm) and their distance from the focal plane (mm).
+        """
+        nx, ny, nz = self.spin_nx.value(), self.spin_ny.value(), self.spin_nz.value()
+        x = self.spin_cx.value() + (np.arange(nx) - (nx - 1)/2)*self.spin_dx.value()
+        y = self.spin_cy.value() + (np.arange(ny) - (ny - 1)/2)*self.spin_dy.value()
+        z = (np.arange(nz) - (nz - 1)/2)*self.spin_dz.value()*1e-3
+        X, Y, Z = np.meshgrid(x, y, z)
+        return X.ravel(), Y.ravel(), Z.ravel()
+
+    def get_values(self):
+        """Returns the parameters the hologram depends on.
+        """
+        return [self.spin_nx.value(), self.spin_ny.value(), self.spin_dx.value(), self.spin_dy.value(), self.spin_cx.value(), self.spin_cy.value(),
+                self.spin_nz.value(), self.spin_dz.value(), self.spin_focal.value(), self.propagation.currentText(), self.settings_manager.get_wavelength(),
+                self.spin_iterations.value(), self.spin_uniformity.value(), self.weighted.isChecked(),
+                self.refine.isChecked(), self.spin_refine_iterations.value(), self.spin_uniformity_weight.value(),
+                self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res()]
+
+    def needs_updates(self):
+        """Checks if the hologram needs to be re-computed.
+
+        Returns:
+            bool: True if the hologram needs to be re-computed, False otherwise.
+        """
+        return self.lastvals != self.get_values()
+
+    def update_parameters(self):
+        """Re-computes the hologram when a parameter is changed, if live updating is enabled.
+        """
+        if self.liveupdate.isChecked():
+            self.update_pattern()
+            self.hologram_manager.updateSLMWindow()
+
+    def compute_pattern(self):
+        """Computes the hologram (connected to the compute button) and updates the SLM window if live updating is enabled.
+        """
+        self.update_pattern()
+        if self.liveupdate.isChecked():
+            self.hologram_manager.updateSLMWindow()
+
+    def update_pattern(self):
+        """Computes the hologram (the previous pattern buffer is reused, and is the starting point of the L-BFGS refinement with warm start).
+        """
+        spots_x, spots_y, spots_z = self.get_spots()
+        # Spots overlapping (e.g. zero spacing) are computed once
+        spots = np.unique(np.stack((spots_x, spots_y, spots_z)), axis = 1)
+        multiplane = np.any(spots[2] != 0)
+        try:
+            if multiplane:
+                self.pattern = self.pattern_generator.GenerateSpotArray3D(spots[0], spots[1], spots[2], self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.spin_focal.value(),
+                                                                          self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(), iterations = self.spin_iterations.value(),
+                                                                          uniformity = self.spin_uniformity.value(), method = self.propagation.currentText(), out = self.pattern)
+            elif self.refine.isChecked():
+                initial = self.pattern if self.warm_start.isChecked() else None
+                self.pattern = self.pattern_generator.GenerateSpotArrayOptimized(spots[0], spots[1], self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(),
+                                                                                 iterations = self.spin_refine_iterations.value(), uniformity_weight = self.spin_uniformity_weight.value(),
+                                                                                 initial = initial, gs_iterations = self.spin_iterations.value(), out = self.pattern)
+            else:
+                self.pattern = self.pattern_generator.GenerateSpotArray(spots[0], spots[1], self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(),
+                                                                        iterations = self.spin_iterations.value(), uniformity = self.spin_uniformity.value(), weighted = self.weighted.isChecked(), out = self.pattern)
+        except ValueError as error:
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText(str(error))
+            dlg.exec()
+            # No hologram for these parameters (not re-computed till they change)
+            self.pattern = self.pattern_generator.empty_pattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+            self.result_label.setText("Not computed")
+            self.lastvals = self.get_values()
+            return
+        if multiplane:
+            engine = self.pattern_generator.multiplane_engine
+            self.result_label.setText("Uniformity: %.4f, %d iterations (%d planes)" % (engine.uniformity, engine.iterations, engine.planes))
+        else:
+            engine = self.pattern_generator.gradient_engine if self.refine.isChecked() else self.pattern_generator.spot_engine
+            self.result_label.setText("Uniformity: %.4f, efficiency: %.1f %%, %d iterations (%s)" % (engine.uniformity, 100*engine.efficiency, engine.iterations, engine.method))
+        self.pattern_image.setImage(self.pattern)
+        self.lastvals = self.get_values()
+
+    def get_pattern(self):
+        """Returns the hologram.
+        """
+        if self.pattern is None or self.needs_updates():
+            self.update_pattern()
+        return self.pattern
+
+    def is_active(self):
+        """Returns the state of the isactive checkbox.
+        """
+        return self.isactive.isChecked()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""Startup_timing.py: Measures the time to the first window and to the first hologram, to keep an eye on the startup time.
+Enabled by setting the SLMCONTROLLER_STARTUP_TIMING environment variable:
+- SLMCONTROLLER_STARTUP_TIMING=1 prints the times while the program is used normally.
+- SLMCONTROLLER_STARTUP_TIMING=exit renders an empty hologram as soon as the window is up, prints the times and quits (startup benchmark).
+
+Times are measured from the import of the package (i.e. they include the import of the GUI and of its dependencies, not the Python interpreter startup)."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+START_TIME = time.perf_counter()
+
+# Startup events already reported
+_reported = set()
+
+def mode():
+    """Returns the startup timing mode set in the environment.
+
+    Returns:
+        str: "" (disabled), "1" (print the times) or "exit" (benchmark, quit after the first hologram).
+    """
+    return os.environ.get("SLMCONTROLLER_STARTUP_TIMING", "").strip().lower()
+
+def enabled():
+    """Returns True if the startup times should be printed.
+    """
+    return mode() not in ("", "0")
+
+def benchmark():
+    """Returns True if the program should render a hologram and quit once started (startup benchmark).
+    """
+    return mode() == "exit"
+
+def mark(event):
+    """Prints the time elapsed since the import of the package, the first time an event happens.
+
+    Args:
+        event (str): Name of the event (e.g. "first window").
+
+    Returns:
+        bool: True if the event was reported now, False if timing is disabled or the event was already reported.
+    """
+    if not enabled() or event in _reported:
+        return False
+    _reported.add(event)
+    print("Startup timing: %s after %.3f s" % (event, time.perf_counter() - START_TIME))
+    return True
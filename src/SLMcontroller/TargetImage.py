@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""TargetImage.py: Generates a tab used to control a target image element. The hologram reproducing the image in the Fourier plane is computed with the MRAF algorithm."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+from PyQt6.QtWidgets import QDoubleSpinBox, QSpinBox, QGridLayout, QVBoxLayout, QWidget, QCheckBox, QLabel, QPushButton, QMessageBox, QComboBox, QLineEdit, QFileDialog
+from PyQt6.QtCore import Qt
+
+import SLMcontroller.utils as utils
+import cv2
+import numpy as np
+
+class TargetImageTab(QWidget):
+    """Generates a tab used to control a target image element: an intensity pattern (flat-top disk, line or image loaded from a file) in the Fourier plane.
+    The position of the center of the image is given in lines per mm, as for the grating.
+    The hologram is computed with the GenerateTargetImage function of the PatternGenerator class.
+
+    Attributes:
+        pattern (:numpy.ndarray:): Array containing the computed hologram.
+        pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+        settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution and pixel pitch.
+        hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        maxlmm (float): Maximum position (lines per mm) reachable with the SLM pixel pitch.
+        image_data (:numpy.ndarray:): Target image loaded from a file.
+        loaded_file (str): Path to the loaded target image.
+        lastvals (list): Parameters used to compute the last hologram (used to avoid re-computing it).
+    """
+    targets = ["Flat-top disk", "Line", "Image file"]
+
+    def __init__(self, pattern_generator, settings_manager, hologram_manager):
+        """Constructor for the TargetImageTab class.
+
+        Args:
+            pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+            settings_manager (:SettingsManager:): Settings manager object used to get the SLM resolution and pixel pitch.
+            hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        """
+        super().__init__()
+        self.pattern = None
+        self.pattern_generator = pattern_generator
+        self.settings_manager = settings_manager
+        self.hologram_manager = hologram_manager
+        self.maxlmm = 1e-3/(2*self.settings_manager.get_pixel_pitch()*1e-6)
+        self.image_data = None
+        self.loaded_file = ""
+        self.lastvals = []
+        self.init_GUI()
+
+    def init_GUI(self):
+        """Generates the GUI elements of the tab.
+        The tab contains:
+        - A selector of the target, its size (for the built-in targets) and a text field and button to load an image file.
+        - Spinboxes for the scale and the center of the target.
+        - Spinboxes for the padding of the Fourier plane, the MRAF mixing parameter and the number of iterations.
+        - A button to compute the hologram and a label with the result of the last computation.
+        - A checkbox to activate the element and one to enable live updating.
+        - An image preview of the hologram.
+        """
+        self.general_controls_layout = QVBoxLayout()
+        self.isactive = QCheckBox("Activate element : ")
+        self.isactive.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.liveupdate = QCheckBox("Live updating : ")
+        self.liveupdate.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.general_controls_layout.addWidget(self.isactive)
+        self.general_controls_layout.addWidget(self.liveupdate)
+
+        self.make_target_controls()
+        self.make_algorithm_controls()
+        self.make_image_preview()
+
+        self.layout = QGridLayout()
+        self.layout.addLayout(self.target_layout,0,0)
+        self.layout.addLayout(self.algorithm_layout,1,0)
+        self.layout.addLayout(self.image_preview_layout,2,0)
+        self.layout.addLayout(self.general_controls_layout,3,0)
+
+        self.setLayout(self.layout)
+
+    def make_spinbox(self, text, suffix, minimum, maximum, value, decimals = 4):
+        """Generates a spinbox connected to update_parameters.
+
+        Args:
+            text (str): Prefix shown in the spinbox.
+            suffix (str): Unit shown in the spinbox.
+            minimum (float): Minimum value.
+            maximum (float): Maximum value.
+            value (float): Initial value.
+            decimals (int, optional): Number of decimals (0 for an integer spinbox). Defaults to 4.
+
+        Returns:
+            QAbstractSpinBox: The spinbox.
+        """
+        spin = QSpinBox() if decimals == 0 else QDoubleSpinBox()
+        if decimals > 0:
+            spin.setDecimals(decimals)
+        spin.setPrefix(text)
+        spin.setSuffix(suffix)
+        spin.setKeyboardTracking(False)
+        spin.setMinimum(minimum)
+        spin.setMaximum(maximum)
+        spin.setValue(value)
+        spin.valueChanged.connect(self.update_parameters)
+        return spin
+
+    def make_target_controls(self):
+        """Generates the controls used to choose and place the target and adds them to the GUI.
+        """
+        self.target_layout = QGridLayout()
+        self.target_selector = QComboBox()
+        self.target_selector.addItems(self.targets)
+        self.target_selector.currentIndexChanged.connect(self.update_parameters)
+        self.spin_size = self.make_spinbox("Size: ", " px", 1, 4096, 64, 0)
+        self.image_path = QLineEdit("")
+        self.selectfile = QPushButton("Open target image")
+        self.selectfile.clicked.connect(self.loadTargetFromFile)
+        self.spin_scale = self.make_spinbox("Scale: ", " bins/px", 0.01, 100, 1., 2)
+        self.spin_cx = self.make_spinbox("Center X: ", " l/mm", -self.maxlmm, self.maxlmm, 5.)
+        self.spin_cy = self.make_spinbox("Center Y: ", " l/mm", -self.maxlmm, self.maxlmm, 0.)
+        self.target_layout.addWidget(self.target_selector,0,0)
+        self.target_layout.addWidget(self.spin_size,0,1)
+        self.target_layout.addWidget(self.image_path,1,0)
+        self.target_layout.addWidget(self.selectfile,1,1)
+        self.target_layout.addWidget(self.spin_scale,2,0,1,2)
+        self.target_layout.addWidget(self.spin_cx,3,0)
+        self.target_layout.addWidget(self.spin_cy,3,1)
+
+    def make_algorithm_controls(self):
+        """Generates the controls of the MRAF algorithm and adds them to the GUI.
+        """
+        self.algorithm_layout = QGridLayout()
+        self.spin_padding = self.make_spinbox("Padding: ", "x", 1, 4, 2, 0)
+        self.spin_mixing = self.make_spinbox("Mixing: ", "", 0.01, 1, 0.5, 2)
+        self.spin_mixing.setSingleStep(0.05)
+        self.spin_iterations = self.make_spinbox("Iterations: ", "", 0, 1000, 30, 0)
+        self.compute_button = QPushButton("Compute hologram")
+        self.compute_button.clicked.connect(self.compute_pattern)
+        self.result_label = QLabel("Not computed")
+        self.algorithm_layout.addWidget(self.spin_padding,0,0)
+        self.algorithm_layout.addWidget(self.spin_mixing,0,1)
+        self.algorithm_layout.addWidget(self.spin_iterations,1,0)
+        self.algorithm_layout.addWidget(self.compute_button,1,1)
+        self.algorithm_layout.addWidget(self.result_label,2,0,1,2)
+
+    def make_image_preview(self):
+        """Generates the image preview of the hologram.
+        """
+        self.image_preview_layout = QVBoxLayout()
+        self.pattern_image = utils.ImageWidget()
+        self.image_preview_layout.addWidget(self.pattern_image)
+
+    def loadTargetFromFile(self):
+        """Opens a prompt to select the target image and selects the image file target.
+        """
+        name = QFileDialog.getOpenFileName(self,"Open File","${HOME}","Image files (*.bmp *.png);;",)
+        self.image_path.setText(name[0])
+        self.target_selector.setCurrentText("Image file")
+        self.update_parameters()
+
+    def get_target(self):
+        """Returns the target intensity image.
+
+        Raises:
+            ValueError: If the image file cannot be read.
+
+        Returns:
+            np.array: Target intensity image.
+        """
+        target = self.target_selector.currentText()
+        size = self.spin_size.value()
+        if target == "Flat-top disk":
+            r = np.arange(size) - (size - 1)/2
+            return (r[:, None]**2 + r[None, :]**2 <= (size/2)**2).astype(np.float32)
+        if target == "Line":
+            return np.ones((1, size), dtype = np.float32)
+        if self.loaded_file != self.image_path.text() or self.image_data is None:
+            img = cv2.imread(self.image_path.text(), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise ValueError("Wrong path to image")
+            self.image_data = img.astype(np.float32)
+            self.loaded_file = self.image_path.text()
+        return self.image_data
+
+    def get_values(self):
+        """Returns the parameters the hologram depends on.
+        """
+        return [self.target_selector.currentText(), self.spin_size.value(), self.image_path.text(), self.spin_scale.value(), self.spin_cx.value(), self.spin_cy.value(),
+                self.spin_padding.value(), self.spin_mixing.value(), self.spin_iterations.value(),
+                self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res()]
+
+    def needs_updates(self):
+        """Checks if the hologram needs to be re-computed.
+
+        Returns:
+            bool: True if the hologram needs to be re-computed, False otherwise.
+        """
+        return self.lastvals != self.get_values()
+
+    def update_parameters(self):
+        """Re-computes the hologram when a parameter is changed, if live updating is enabled.
+        """
+        if self.liveupdate.isChecked():
+            self.update_pattern()
+            self.hologram_manager.updateSLMWindow()
+
+    def compute_pattern(self):
+        """Computes the hologram (connected to the compute button) and updates the SLM window if live updating is enabled.
+        """
+        self.update_pattern()
+        if self.liveupdate.isChecked():
+            self.hologram_manager.updateSLMWindow()
+
+    def update_pattern(self):
+        """Computes the hologram (the previous pattern buffer is reused, and the previous hologram is the starting guess).
+        """
+        try:
+            self.pattern = self.pattern_generator.GenerateTargetImage(self.get_target(), self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(),
+                                                                      self.spin_cx.value(), self.spin_cy.value(), self.spin_scale.value(), self.spin_padding.value(),
+                                                                      self.spin_mixing.value(), self.spin_iterations.value(), out = self.pattern)
+        except ValueError as error:
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText(str(error))
+            dlg.exec()
+            # No hologram for these parameters (not re-computed till they change)
+            self.pattern = self.pattern_generator.empty_pattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+            self.result_label.setText("Not computed")
+            self.lastvals = self.get_values()
+            return
+        engine = self.pattern_generator.target_engine
+        self.result_label.setText("Efficiency: %.1f %%, RMS error: %.3f, %d iterations" % (100*engine.efficiency, engine.error, engine.iterations))
+        self.pattern_image.setImage(self.pattern)
+        self.lastvals = self.get_values()
+
+    def get_pattern(self):
+        """Returns the hologram.
+        """
+        if self.pattern is None or self.needs_updates():
+            self.update_pattern()
+        return self.pattern
+
+    def is_active(self):
+        """Returns the state of the isactive checkbox.
+        """
+        return self.isactive.isChecked()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""Traps.py: Generates a tab used to control a set of moving spots (e.g. optical tweezers). The hologram is the direct superposition of a tilt and a lens per spot, updated incrementally when a spot is moved."""
+
+__author__ = "Matteo Mazzanti"
+__copyright__ = "Copyright 2023, Matteo Mazzanti"
+__license__ = "GNU GPL v3"
+__maintainer__ = "Matteo Mazzanti"
+
+# -*- coding: utf-8 -*-
+
+from PyQt6.QtWidgets import QDoubleSpinBox, QSpinBox, QGridLayout, QVBoxLayout, QWidget, QCheckBox, QLabel, QPushButton, QMessageBox
+from PyQt6.QtCore import Qt
+
+import SLMcontroller.utils as utils
+import numpy as np
+import time
+
+class TrapsTab(QWidget):
+    """Generates a tab used to control a set of moving spots. Each spot has a position in the Fourier plane (lines per mm, as for the grating)
+    and a lens power moving it along the optical axis. Spots are edited one at a time: with live updating on, moving a spot only updates
+    its contribution to the hologram (see the GenerateTraps function of the PatternGenerator class).
+
+    Attributes:
+        pattern (:numpy.ndarray:): Array containing the computed hologram.
+        pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+        settings_manager (:SettingsManager:): Settings manager object used to get the wavelength, SLM resolution and pixel pitch.
+        hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        maxlmm (float): Maximum spot position (lines per mm) reachable with the SLM pixel pitch.
+        spots_x (np.array): X position of each spot (lines per mm).
+        spots_y (np.array): Y position of each spot (lines per mm).
+        spots_power (np.array): Lens power of each spot (1/m).
+        lastvals (list): Parameters used to compute the last hologram (used to avoid re-computing it).
+    """
+    def __init__(self, pattern_generator, settings_manager, hologram_manager):
+        """Constructor for the TrapsTab class.
+
+        Args:
+            pattern_generator (:Pattern_generator:): Pattern generator object used to compute the hologram.
+            settings_manager (:SettingsManager:): Settings manager object used to get the wavelength, SLM resolution and pixel pitch.
+            hologram_manager (:HologramsManager:): Hologram manager object used to update the SLM window.
+        """
+        super().__init__()
+        self.pattern = None
+        self.pattern_generator = pattern_generator
+        self.settings_manager = settings_manager
+        self.hologram_manager = hologram_manager
+        self.maxlmm = 1e-3/(2*self.settings_manager.get_pixel_pitch()*1e-6)
+        self.spots_x = np.zeros(0)
+        self.spots_y = np.zeros(0)
+        self.spots_power = np.zeros(0)
+        self.lastvals = []
+        self.init_GUI()
+        self.set_spots_number()
+
+    def init_GUI(self):
+        """Generates the GUI elements of the tab.
+        The tab contains:
+        - Spinboxes for the number of spots and the spot being edited, and for its position and lens power.
+        - A spinbox for the iterations of the phase optimization, a button to optimize the phases and a label with the result of the last computation.
+        - A checkbox to activate the element and one to enable live updating.
+        - An image preview of the hologram.
+        """
+        self.general_controls_layout = QVBoxLayout()
+        self.isactive = QCheckBox("Activate element : ")
+        self.isactive.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.liveupdate = QCheckBox("Live updating : ")
+        self.liveupdate.setLayoutDirection(Qt.LayoutDirection.RightToLeft)
+        self.general_controls_layout.addWidget(self.isactive)
+        self.general_controls_layout.addWidget(self.liveupdate)
+
+        self.make_spot_controls()
+        self.make_algorithm_controls()
+        self.make_image_preview()
+
+        self.layout = QGridLayout()
+        self.layout.addLayout(self.spot_layout,0,0)
+        self.layout.addLayout(self.algorithm_layout,1,0)
+        self.layout.addLayout(self.image_preview_layout,2,0)
+        self.layout.addLayout(self.general_controls_layout,3,0)
+
+        self.setLayout(self.layout)
+
+    def make_spinbox(self, text, suffix, minimum, maximum, value, decimals = 4):
+        """Generates a spinbox.
+
+        Args:
+            text (str): Prefix shown in the spinbox.
+            suffix (str): Unit shown in the spinbox.
+            minimum (float): Minimum value.
+            maximum (float): Maximum value.
+            value (float): Initial value.
+            decimals (int, optional): Number of decimals (0 for an integer spinbox). Defaults to 4.
+
+        Returns:
+            QAbstractSpinBox: The spinbox.
+        """
+        spin = QSpinBox() if decimals == 0 else QDoubleSpinBox()
+        if decimals > 0:
+            spin.setDecimals(decimals)
+        spin.setPrefix(text)
+        spin.setSuffix(suffix)
+        spin.setKeyboardTracking(False)
+        spin.setMinimum(minimum)
+        spin.setMaximum(maximum)
+        spin.setValue(value)
+        return spin
+
+    def make_spot_controls(self):
+        """Generates the spinboxes used to define the spots and adds them to the GUI.
+        """
+        self.spot_layout = QGridLayout()
+        self.spin_number = self.make_spinbox("Spots: ", "", 1, 500, 4, 0)
+        self.spin_number.valueChanged.connect(self.set_spots_number)
+        self.spin_selected = self.make_spinbox("Edit spot: ", "", 0, 3, 0, 0)
+        self.spin_selected.valueChanged.connect(self.show_spot)
+        self.spin_x = self.make_spinbox("X: ", " l/mm", -self.maxlmm, self.maxlmm, 0.)
+        self.spin_y = self.make_spinbox("Y: ", " l/mm", -self.maxlmm, self.maxlmm, 0.)
+        self.spin_power = self.make_spinbox("Lens power: ", " 1/m", -1000, 1000, 0., 3)
+        for spin in (self.spin_x, self.spin_y, self.spin_power):
+            spin.valueChanged.connect(self.edit_spot)
+        self.spot_layout.addWidget(self.spin_number,0,0)
+        self.spot_layout.addWidget(self.spin_selected,0,1)
+        self.spot_layout.addWidget(self.spin_x,1,0)
+        self.spot_layout.addWidget(self.spin_y,1,1)
+        self.spot_layout.addWidget(self.spin_power,2,0,1,2)
+
+    def make_algorithm_controls(self):
+        """Generates the controls of the phase optimization and adds them to the GUI.
+        """
+        self.algorithm_layout = QGridLayout()
+        self.spin_iterations = self.make_spinbox("Iterations: ", "", 1, 1000, 10, 0)
+        self.optimize_button = QPushButton("Optimize phases")
+        self.optimize_button.clicked.connect(self.optimize_phases)
+        self.result_label = QLabel("Not computed")
+        self.algorithm_layout.addWidget(self.spin_iterations,0,0)
+        self.algorithm_layout.addWidget(self.optimize_button,0,1)
+        self.algorithm_layout.addWidget(self.result_label,1,0,1,2)
+
+    def make_image_preview(self):
+        """Generates the image preview of the hologram.
+        """
+        self.image_preview_layout = QVBoxLayout()
+        self.pattern_image = utils.ImageWidget()
+        self.image_preview_layout.addWidget(self.pattern_image)
+
+    def set_spots_number(self):
+        """Adds or removes spots to match the number of spots spinbox. New spots are placed on a line along X, 1 l/mm apart.
+        """
+        n = self.spin_number.value()
+        old = len(self.spots_x)
+        self.spots_x = np.resize(self.spots_x, n)
+        self.spots_y = np.resize(self.spots_y, n)
+        self.spots_power = np.resize(self.spots_power, n)
+        if n > old:
+            self.spots_x[old:] = np.clip(5. + np.arange(old, n), -self.maxlmm, self.maxlmm)
+            self.spots_y[old:] = 0.
+            self.spots_power[old:] = 0.
+        self.spin_selected.setMaximum(n - 1)
+        self.show_spot()
+        self.update_parameters()
+
+    def show_spot(self):
+        """Shows the parameters of the selected spot in the spinboxes.
+        """
+        k = self.spin_selected.value()
+        for spin, value in ((self.spin_x, self.spots_x[k]), (self.spin_y, self.spots_y[k]), (self.spin_power, self.spots_power[k])):
+            spin.blockSignals(True)
+            spin.setValue(value)
+            spin.blockSignals(False)
+
+    def edit_spot(self):
+        """Moves the selected spot to the values of the spinboxes.
+        """
+        self.move_spot(self.spin_selected.value(), self.spin_x.value(), self.spin_y.value(), self.spin_power.value())
+
+    def move_spot(self, index, x, y, power = None):
+        """Moves a spot and re-computes the hologram if live updating is enabled.
+
+        Args:
+            index (int): Index of the spot.
+            x (float): X position (lines per mm).
+            y (float): Y position (lines per mm).
+            power (float, optional): Lens power (1/m). Defaults to None (unchanged).
+        """
+        self.spots_x[index] = x
+        self.spots_y[index] = y
+        if power is not None:
+            self.spots_power[index] = power
+        if index == self.spin_selected.value():
+            self.show_spot()
+        self.update_parameters()
+
+    def get_values(self):
+        """Returns the parameters the hologram depends on.
+        """
+        return [self.spots_x.tolist(), self.spots_y.tolist(), self.spots_power.tolist(), self.settings_manager.get_wavelength(),
+                self.settings_manager.get_pixel_pitch(), self.settings_manager.get_X_res(), self.settings_manager.get_Y_res()]
+
+    def needs_updates(self):
+        """Checks if the hologram needs to be re-computed.
+
+        Returns:
+            bool: True if the hologram needs to be re-computed, False otherwise.
+        """
+        return self.lastvals != self.get_values()
+
+    def update_parameters(self):
+        """Re-computes the hologram when a spot is changed, if live updating is enabled.
+        """
+        if self.liveupdate.isChecked():
+            self.update_pattern()
+            self.hologram_manager.updateSLMWindow()
+
+    def optimize_phases(self):
+        """Optimizes the phases of the spots (connected to the optimize button) and updates the SLM window if live updating is enabled.
+        """
+        self.update_pattern(self.spin_iterations.value())
+        if self.liveupdate.isChecked():
+            self.hologram_manager.updateSLMWindow()
+
+    def update_pattern(self, optimize = 0):
+        """Computes the hologram (the previous pattern buffer is reused, only the moved spots are updated).
+
+        Args:
+            optimize (int, optional): Iterations of the phase optimization. Defaults to 0 (phases kept).
+        """
+        start = time.perf_counter()
+        try:
+            self.pattern = self.pattern_generator.GenerateTraps(self.spots_x, self.spots_y, self.spots_power, self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(),
+                                                               self.settings_manager.get_X_res(), self.settings_manager.get_Y_res(), optimize = optimize, out = self.pattern)
+        except ValueError as error:
+            dlg = QMessageBox(self)
+            dlg.setIcon(QMessageBox.Icon.Warning)
+            dlg.setWindowTitle("WARNING!")
+            dlg.setText(str(error))
+            dlg.exec()
+            # No hologram for these parameters (not re-computed till they change)
+            self.pattern = self.pattern_generator.empty_pattern(self.settings_manager.get_X_res(), self.settings_manager.get_Y_res())
+            self.result_label.setText("Not computed")
+            self.lastvals = self.get_values()
+            return
+        engine = self.pattern_generator.trap_engine
+        text = "%d spots, %.1f ms (%s)" % (len(self.spots_x), 1e3*(time.perf_counter() - start), "incremental" if engine.incremental and optimize == 0 else "full")
+        if optimize > 0:
+            text += ", uniformity: %.4f, efficiency: %.1f %%" % (engine.uniformity, 100*engine.efficiency)
+        self.result_label.setText(text)
+        self.pattern_image.setImage(self.pattern)
+        self.lastvals = self.get_values()
+
+    def get_pattern(self):
+        """Returns the hologram.
+        """
+        if self.pattern is None or self.needs_updates():
+            self.update_pattern()
+        return self.pattern
+
+    def is_active(self):
+        """Returns the state of the isactive checkbox.
+        """
+        return self.isactive.isChecked()
@@ -15,9 +15,10 @@ from PyQt6.QtCore import QThread, QMutex, QWaitCondition
 
 
 import SLMcontroller.utils as utils
+import SLMcontroller.Phase_pattern as Phase_pattern
 import numpy as np
 
-from numba import jit
+from numba import jit, prange
 from numba.typed import List
 
 from PIL import Image
@@ -49,7 +50,7 @@ class SpotOptimTab_ext(QWidget):
     First the user has to define the probe and references zones on the SLM. This can be done using gmsh.
     Mesh parameters and algorithms can be choosen in the tab. Once obtaining a satisfactory meshing this can be saved and loaded later.
     The mesh can be visualized using the gmsh GUI. This requires to start the GUI on another process as certain OS do not allow GUI to be started outside the main thread.
-    The second process is started at the start of the program and kept dormant if not used.
+    The second process is started when the first of these tabs is opened and kept dormant if not used.
     
     It allows for an user to choose the parameters for 2 gratings:
         - one to "dump" the 1st order power of the SLM to an unused zone
@@ -783,6 +784,9 @@ class OptimizerAlgorithm(QThread):
             self._active = False
             self.waitCond = waitCond
 
+            # Grating patterns (buffers reused when the gratings are re-generated)
+            self.grating_pattern = None
+            self.interf_grating_pattern = None
             # Save last grating parameters to avoid re-generating the grating
             self.grating_lastvals = np.array([])
             self.interf_grating_lastvals = np.array([])
@@ -802,6 +806,7 @@ class OptimizerAlgorithm(QThread):
     def run(self):
         """Runs the optimization algorithm. The algorithm will wait for a waitCond signal before proceeding to the next step.
         """
+        Phase_pattern.apply_threads()
         if self._phase is None:
            self.phase = 0
         self.initPattern()
@@ -1000,8 +1005,9 @@ class OptimizerAlgorithm(QThread):
         """
         if not np.array_equal(self.grating_lastvals,np.array([self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.grating_lmm, self.grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res])) or not np.array_equal(self.interf_grating_lastvals,np.array([self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.interf_grating_lmm, self.interf_grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res])):
             print("remeshing")
-            self.grating_pattern = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.grating_lmm, self.grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res)
-            self.interf_grating_pattern = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.interf_grating_lmm, self.interf_grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res)
+            # Gratings are re-generated in place
+            self.grating_pattern = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.grating_lmm, self.grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res, out = self.grating_pattern)
+            self.interf_grating_pattern = self.pattern_generator.GenerateGrating(self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.interf_grating_lmm, self.interf_grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res, out = self.interf_grating_pattern)
             self.grating_lastvals = np.array([self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.grating_lmm, self.grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res])
             self.interf_grating_lastvals = np.array([self.settings_manager.get_wavelength(), self.settings_manager.get_pixel_pitch(), self.interf_grating_lmm, self.interf_grating_angle*np.pi, self.SLM_x_res, self.SLM_y_res])
 
@@ -1012,15 +1018,15 @@ class OptimizerAlgorithm(QThread):
         print("Initializating ... ")
         self.SLM_x_res = self.settings_manager.get_X_res()
         self.SLM_y_res = self.settings_manager.get_Y_res()
-        self.pattern = np.zeros((self.SLM_y_res,self.SLM_x_res))
+        self.pattern = np.zeros((self.SLM_y_res,self.SLM_x_res), dtype = self.pattern_generator.dtype)
         self.remeshing()
         self.pattern = load_pattern(self._mesh, self.grating_pattern,self.interf_grating_pattern,self._phase,self.SLM_x_res,self.SLM_y_res,self._refZoneID,self._probZoneID)
         print("... done")
 
 
-@jit(nopython=True)
+@jit(nopython=True, parallel = True, cache = True)
 def next_step_fast(SIZEX, SIZEY, mesh, interf_grating, probZoneID, pattern, phase):
-    """Generates the next step of the optimization algorithm. Uses jit from numba to speed up the computation.
+    """Generates the next step of the optimization algorithm. Uses jit from numba to speed up the computation (rows are processed in parallel).
     This updates only the part of the pattern corresponding to the probe zone.
     In case the probe/reference zones have been changed load_pattern should be used instead.
 
@@ -1036,7 +1042,7 @@ def next_step_fast(SIZEX, SIZEY, mesh, interf_grating, probZoneID, pattern, phas
     Returns:
         np.array: New phase pattern.
     """
-    for i in range(0,SIZEY):
+    for i in prange(0,SIZEY):
         for j in range(0,SIZEX):
             tmp = mesh[i,j]
             if tmp == probZoneID:
@@ -1047,7 +1053,7 @@ def next_step_fast(SIZEX, SIZEY, mesh, interf_grating, probZoneID, pattern, phas
 
 @jit(nopython=True, parallel = True, cache = True) # Set "nopython" mode for best performance, equivalent to @njit
 def load_pattern(mesh, grating, interf_grating, phase, SIZEX, SIZEY, refZoneID, probZoneID):
-    """Loads the phase pattern. Uses jit from numba to speed up the computation.
+    """Loads the phase pattern. Uses jit from numba to speed up the computation (rows are processed in parallel).
 
     Args:
         mesh (np.array): Mesh used to separate the SLM in zones.
@@ -1060,10 +1066,10 @@ def load_pattern(mesh, grating, interf_grating, phase, SIZEX, SIZEY, refZoneID,
         probZoneID (int): Probe zone ID.
 
     Returns:
-        np.array: Phase pattern.
+        np.array: Phase pattern (same data type as the gratings).
     """
-    pattern = np.zeros((SIZEY,SIZEX))
-    for i in range(0,SIZEY):
+    pattern = np.zeros_like(grating)
+    for i in prange(0,SIZEY):
             for j in range(0,SIZEX):
                 tmp = mesh[i,j]
                 if tmp == refZoneID:
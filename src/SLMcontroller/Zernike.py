@@ -15,6 +15,7 @@ from PyQt6.QtGui import QRegularExpressionValidator
 from PyQt6.QtCore import Qt
 
 import SLMcontroller.utils as utils
+import SLMcontroller.Phase_pattern as Phase_pattern
 import numpy as np
 
 from numba import jit
@@ -57,6 +58,13 @@ class ZernikeTab(QWidget):
         self.labelY = QLabel('Y: ', self)
         self.centerY.setMinimum(0)
         self.centerY.setMaximum(self.SLM_y_res)
+        # Pupil radius, polynomials are evaluated only inside the pupil (0 = whole SLM)
+        self.pupilRadius = QSpinBox(text="Pupil radius")
+        self.pupilRadius.setMinimumWidth(120)
+        self.pupilRadius.setSuffix(' px')
+        self.labelPupil = QLabel('Radius: ', self)
+        self.pupilRadius.setMinimum(0)
+        self.pupilRadius.setMaximum(max(self.SLM_x_res, self.SLM_y_res))
         self.ZernikeOrders = 1
 
         # Create Zernike table
@@ -97,6 +105,7 @@ class ZernikeTab(QWidget):
         self.ZernikeLayout = QVBoxLayout()
         self.ZernikeLayout.addWidget(self.make_group("Load/save coefficients", self.loadZernikebutton, self.saveZernikebutton))
         self.ZernikeLayout.addWidget(self.make_group("Zernike Center", self.labelX, self.centerX, self.labelY, self.centerY))
+        self.ZernikeLayout.addWidget(self.make_group("Pupil (0 = whole SLM)", self.labelPupil, self.pupilRadius))
         self.ZernikeLayout.addWidget(self.make_group("Polynomials coefficients (OSA/ANSI)", self.ZernikeTable))
         self.ZernikeLayout.addLayout(self.add_remove_Zernike)
         
@@ -181,7 +190,7 @@ class ZernikeTab(QWidget):
         """
         # Opens a prompt for the user to select a mesh file
         ZernikeFile = QFileDialog.getSaveFileName(self,"Save File","","Numpy (*.npy);;")
-        datadict={'centerX':self.centerX.value(), 'centerY':self.centerY.value(),'coefficients':self.readZernikeTable()}
+        datadict={'centerX':self.centerX.value(), 'centerY':self.centerY.value(),'pupilRadius':self.pupilRadius.value(),'coefficients':self.readZernikeTable()}
         np.save(ZernikeFile[0], datadict)
     
     def loadZernikeFromFile(self):
@@ -193,6 +202,7 @@ class ZernikeTab(QWidget):
             data = np.load(ZernikeFile[0], allow_pickle=True)
             self.centerX.setValue(data.item().get('centerX'))
             self.centerY.setValue(data.item().get('centerY'))
+            self.pupilRadius.setValue(data.item().get('pupilRadius', 0))
 
             coefficients = data.item().get('coefficients')
             # Clear the table
@@ -224,7 +234,7 @@ class ZernikeTab(QWidget):
         self.SLM_last_params = []
 
         # No need to re-read the SLM resolution here as it was just checked (needs_updates)
-        self.lastvals = np.concatenate((np.array([self.SLM_x_res, self.SLM_y_res,self.centerX.value(),self.centerY.value()]),self.readZernikeTable()))
+        self.lastvals = np.concatenate((np.array([self.SLM_x_res, self.SLM_y_res,self.centerX.value(),self.centerY.value(),self.pupilRadius.value()]),self.readZernikeTable()))
         # for order in range(self.ZernikeOrders):
         #     if order == 0:
         #         n,m = 0,0
@@ -232,9 +242,20 @@ class ZernikeTab(QWidget):
         #         n = int(np.floor(np.sqrt(4/np.sqrt(3)*order))-1)
         #         m = n+2+2*(order-np.round(np.sqrt(3)/4*n**2))
         #     self.lastvals[order]
-        self.pattern = self.pattern_generator.GenerateZernike(self.readZernikeTable(), self.SLM_x_res, self.SLM_y_res, self.centerX.value(), self.centerY.value())
+        self.pattern = self.pattern_generator.GenerateZernike(self.readZernikeTable(), self.SLM_x_res, self.SLM_y_res, self.centerX.value(), self.centerY.value(), self.get_pupil())
         self.pattern_image.setImage(self.pattern)
         
+    def get_pupil(self):
+        """Returns the pupil centered on the Zernike center.
+
+        Returns:
+            :Aperture: Pupil used to restrict the polynomials evaluation, None if the pupil radius is 0 (whole SLM).
+        """
+        if self.pupilRadius.value() == 0:
+            return None
+        # The polynomials Y axis is flipped with respect to the SLM rows
+        return Phase_pattern.Aperture(self.centerX.value(), self.SLM_y_res - 1 - self.centerY.value(), self.pupilRadius.value())
+
     def make_image_preview(self):
         """Generates the image preview of the Zernike pattern.
         """
@@ -252,7 +273,7 @@ class ZernikeTab(QWidget):
         self.SLM_x_res = self.settings_manager.get_X_res()
         self.SLM_y_res = self.settings_manager.get_Y_res()
 
-        news_vals = np.concatenate((np.array([self.SLM_x_res, self.SLM_y_res,self.centerX.value(),self.centerY.value()]),self.readZernikeTable()))
+        news_vals = np.concatenate((np.array([self.SLM_x_res, self.SLM_y_res,self.centerX.value(),self.centerY.value(),self.pupilRadius.value()]),self.readZernikeTable()))
         if len(self.lastvals) != len(news_vals):
             return True
         for i in range(len(self.lastvals)):
@@ -260,6 +281,20 @@ class ZernikeTab(QWidget):
             return True
         return False
 
+    def get_analytic_terms(self, terms):
+        """Adds the Zernike expansion to a closed-form pattern description (used by the fused render mode).
+
+        Args:
+            terms (:AnalyticPattern:): Pattern description the Zernike expansion is added to.
+
+        Returns:
+            bool: True if the expansion was added, False if the tab resolution doesn't match (the pattern has to be added as an array).
+        """
+        if self.SLM_x_res != terms.res_X or self.SLM_y_res != terms.res_Y:
+            return False
+        terms.add_zernike(self.readZernikeTable(), self.centerX.value(), self.centerY.value(), self.get_pupil())
+        return True
+
     def get_pattern(self):
         """Returns the lens pattern.
 
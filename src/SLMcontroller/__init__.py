@@ -9,18 +9,39 @@ __maintainer__ = "Matteo Mazzanti"
 
 # -*- coding: utf-8 -*-
 
+import SLMcontroller.Startup_timing as Startup_timing
+
 from PyQt6 import QtWidgets
 
+import os
 import sys
 
+import SLMcontroller.settings as settings
+
+def _numba_environment():
+    """Sets the size of the numba thread pool and its threading layer from the settings 
+    (the environment variables SLMCONTROLLER_NUMBA_THREADS and SLMCONTROLLER_NUMBA_LAYER take precedence, NUMBA_* variables already set are kept).
+    numba reads them only when it is imported, so this runs before importing the modules using numba.
+    """
+    settings_manager = settings.SettingsManager()
+    num_threads = int(os.environ.get("SLMCONTROLLER_NUMBA_THREADS", settings_manager.get_numba_threads()))
+    threading_layer = os.environ.get("SLMCONTROLLER_NUMBA_LAYER", settings_manager.get_numba_threading_layer())
+    if num_threads > 0:
+        os.environ.setdefault("NUMBA_NUM_THREADS", str(min(num_threads, os.cpu_count() or num_threads)))
+    if threading_layer != "default":
+        os.environ.setdefault("NUMBA_THREADING_LAYER", threading_layer)
+
+_numba_environment()
+
 import SLMcontroller.MainGUI as MainGUI
-import SLMcontroller.Meshing_process as Meshing_process
 import SLMcontroller.Remote_control as Remote_control
+import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Kernel_warmup as Kernel_warmup
 
 from multiprocessing import Event, Queue, Condition, freeze_support
 
 def closeSecondProcess(eventsDict):
-    """Closes the GMSH GUI process
+    """Closes the GMSH GUI process (if it was started)
     """
     eventsDict['terminate'].set()
     eventsDict['generalEvent'].set()
@@ -47,20 +68,21 @@ def main():
     # 2 - Load meshing file
     conditionsDict = {"parsingCond":Condition(), "savefile":Condition(), "loadfile":Condition()}
 
-    # Flask app for remote control
-    flask_app = Remote_control.Flask(__name__)
-    app = Remote_control.NetworkManager(flask_app)
+    # Flask app for remote control (created, and Flask imported, by the server thread)
+    app = Remote_control.NetworkManager(import_name = __name__)
     # Queue for inter-processing communication
     queue = Queue()
 
-    # Start meshing process, this will be needed to show GMESH GUI in another process
-    mesh_process = Meshing_process.MeshingHandler(eventsDict, conditionsDict, queue, 0, 0, 0 , "")
-    mesh_process.start()
+    # Threads used by the kernels (the pool was sized by _numba_environment), then compile the kernels while the GUI comes up
+    settings_manager = settings.SettingsManager()
+    Phase_pattern.configure_threads(settings_manager.get_numba_threads(), settings_manager.get_numba_threading_layer())
+    Kernel_warmup.start()
 
     # Start GUI
     GUIapp = QtWidgets.QApplication(sys.argv)
     GUIapp.setStyle('macos')
-    main = MainGUI.First(mesh_process,app, queue, eventsDict, conditionsDict)
+    # The meshing process (needed to show GMESH GUI in another process) is started when the first optimizer tab needs it
+    main = MainGUI.First(None, app, queue, eventsDict, conditionsDict)
     main.show()
     retval = GUIapp.exec()
 
@@ -10,7 +10,7 @@ __maintainer__ = "Matteo Mazzanti"
 # -*- coding: utf-8 -*-
 
 from PyQt6.QtCore import QSettings, QRegularExpression
-from PyQt6.QtWidgets import QDialog, QDialogButtonBox, QGridLayout, QGroupBox, QDoubleSpinBox, QRadioButton, QVBoxLayout, QSpinBox,QLineEdit
+from PyQt6.QtWidgets import QDialog, QDialogButtonBox, QGridLayout, QGroupBox, QDoubleSpinBox, QRadioButton, QVBoxLayout, QSpinBox,QLineEdit, QComboBox
 from PyQt6.QtGui import QValidator, QRegularExpressionValidator
 
 
@@ -27,6 +27,7 @@ class SettingsManager:
                 'QSpinBox': ('value', 'setValue',int),
                 'QDoubleSpinBox': ('value', 'setValue',float),
                 'QRadioButton': ('isChecked', 'setChecked',int),
+                'QComboBox': ('currentIndex', 'setCurrentIndex',int),
             }
 
         self.defaults = {'SLM_size_X' : 800,
@@ -38,7 +39,13 @@ class SettingsManager:
                          'Phase_correction' : 255,
                          #'IPserver' : '127.0.0.1',
                          'IPclient' : '0.0.0.0',
-                         'Portclient' : '5000'
+                         'Portclient' : '5000',
+                         'Render_mode' : 0,
+                         'Pattern_dtype' : 0,
+                         'Quantizer' : 0,
+                         'Crosstalk_width' : 0.,
+                         'Numba_threads' : 0,
+                         'Numba_threading_layer' : 0
                          #'Strict' : 0
         }
 
@@ -113,6 +120,52 @@ class SettingsManager:
         else:
             return int(self.defaults["SLM_window"])
 
+    # 0 : every element generates its own pattern and they are summed
+    # 1 : closed-form elements (lens, grating, Zernike) are evaluated together in a single pass
+    # 2 : as 1, but the hologram is generated, combined and quantized tile by tile (no full-frame phase pattern)
+    def get_render_mode(self):
+        if self.settings.value("Render_mode") is not None:
+            return int(self.settings.value("Render_mode"))
+        else:
+            return int(self.defaults["Render_mode"])
+
+    # Data type of the phase patterns, float32 is enough for an 8-bit SLM
+    def get_pattern_dtype(self):
+        if self.settings.value("Pattern_dtype") is not None:
+            index = int(self.settings.value("Pattern_dtype"))
+        else:
+            index = int(self.defaults["Pattern_dtype"])
+        return ('float32', 'float64')[index]
+
+    # Conversion of the continuous phase to gray levels (see Render_pipeline.QUANTIZERS)
+    def get_quantizer(self):
+        if self.settings.value("Quantizer") is not None:
+            index = int(self.settings.value("Quantizer"))
+        else:
+            index = int(self.defaults["Quantizer"])
+        return ('truncate', 'round', 'ordered', 'diffusion')[index]
+
+    # Width (pixels) of the crosstalk between neighbouring pixels precompensated before quantization (0 = off)
+    def get_crosstalk_width(self):
+        if self.settings.value("Crosstalk_width") is not None:
+            return float(self.settings.value("Crosstalk_width"))
+        else:
+            return float(self.defaults["Crosstalk_width"])
+
+    # Number of threads of the pattern generation kernels (0 = all cores)
+    def get_numba_threads(self):
+        if self.settings.value("Numba_threads") is not None:
+            return int(self.settings.value("Numba_threads"))
+        else:
+            return int(self.defaults["Numba_threads"])
+
+    def get_numba_threading_layer(self):
+        if self.settings.value("Numba_threading_layer") is not None:
+            index = int(self.settings.value("Numba_threading_layer"))
+        else:
+            index = int(self.defaults["Numba_threading_layer"])
+        return ('default', 'tbb', 'omp', 'workqueue')[index]
+
 class SettingsDialog(QDialog):
     """Create a settings dialog to edit all the settings of the application."""
     def __init__(self,settings_manager, parent = None):
@@ -168,6 +221,30 @@ class SettingsDialog(QDialog):
         self.IPclient = QLineEdit(text = "0.0.0.0")
         self.Portclient = QLineEdit(text = "5000")
 
+        self.render_mode = QComboBox()
+        self.render_mode.addItems(["Element by element", "Fused analytic elements (single pass)", "Tiled (large panels)"])
+        self.pattern_dtype = QComboBox()
+        self.pattern_dtype.addItems(["float32 patterns (faster)", "float64 patterns"])
+        self.quantizer = QComboBox()
+        self.quantizer.addItems(["Truncate phase levels", "Round to nearest level", "Ordered dithering", "Error diffusion (lowest noise near the zero order)"])
+        self.crosstalk_width = QDoubleSpinBox(text="Pixel crosstalk width")
+        self.crosstalk_width.setPrefix('Crosstalk precompensation: ')
+        self.crosstalk_width.setSuffix(' px')
+        self.crosstalk_width.setSpecialValueText('Crosstalk precompensation: off')
+        self.crosstalk_width.setDecimals(2)
+        self.crosstalk_width.setSingleStep(0.05)
+        self.crosstalk_width.setMinimum(0)
+        self.crosstalk_width.setMaximum(3)
+        self.crosstalk_width.setToolTip("Standard deviation of the fringing-field blur between pixels (the tiled render mode renders whole frames when it is set)")
+
+        self.numba_threads = QSpinBox(text="Computation threads")
+        self.numba_threads.setPrefix('Threads: ')
+        self.numba_threads.setSpecialValueText('Threads: all cores')
+        self.numba_threads.setMinimum(0)
+        self.numba_threads.setMaximum(256)
+        self.numba_threading_layer = QComboBox()
+        self.numba_threading_layer.addItems(["Default threading layer", "TBB", "OpenMP", "Workqueue"])
+
         Octet = "(?:[0-1]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5])"
 
         #self.IPserver.setValidator(QRegularExpressionValidator(QRegularExpression("^" + Octet + "\." + Octet + "\." + Octet + "\." + Octet + "$"),self.IPserver))
@@ -187,7 +264,13 @@ class SettingsDialog(QDialog):
                     'SLM_pixel_pitch': self.pixel_pitch,
                     #'IPserver': self.IPserver,
                     'IPclient': self.IPclient,
-                    'Portclient': self.Portclient
+                    'Portclient': self.Portclient,
+                    'Render_mode': self.render_mode,
+                    'Pattern_dtype': self.pattern_dtype,
+                    'Quantizer': self.quantizer,
+                    'Crosstalk_width': self.crosstalk_width,
+                    'Numba_threads': self.numba_threads,
+                    'Numba_threading_layer': self.numba_threading_layer
                     #'Strict' : self.Strict
                 }
         #self.settings_manager = SettingsManager()
@@ -212,6 +295,8 @@ class SettingsDialog(QDialog):
         slayout.addWidget(self.make_group("SLM phase correction", self.correction))
         slayout.addWidget(self.make_group("Pattern window size", self.SLM_winsize_X,self.SLM_winsize_Y))
         slayout.addWidget(self.make_group("Network", self.IPclient,self.Portclient))
+        slayout.addWidget(self.make_group("Rendering", self.render_mode, self.pattern_dtype, self.quantizer, self.crosstalk_width))
+        slayout.addWidget(self.make_group("Parallelism (more threads or a new layer applied at restart)", self.numba_threads, self.numba_threading_layer))
 
         #Ok/cancel settings buttons
         _buttons = QDialogButtonBox.StandardButton
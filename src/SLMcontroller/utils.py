@@ -14,9 +14,8 @@ from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QThread, QRunnable, pyqtSlot, Q
 from PyQt6.QtGui import QImage, QPainter
 from PyQt6 import QtCore
 
-import cv2
+# cv2 and gmsh are slow to import, they are imported where they are used
 import numpy as np
-import gmsh
 
 
 class ImageWidget(QWidget):
@@ -27,6 +26,7 @@ class ImageWidget(QWidget):
         self.scale = 1
 
     def setImage(self, image):
+        import cv2
         self.image_data = image.astype(np.uint8)
         self.scale = self.image_data.shape[1]/self.frameGeometry().width()
         disp_size = int(self.image_data.shape[1]//self.scale), int(self.image_data.shape[0]//self.scale)
@@ -118,6 +118,7 @@ class OpticalTabBar(QTabBar):
 class MeshVisualizer(QRunnable):
     def __init__(self, *args, **kwargs):
         super(MeshVisualizer, self).__init__()
+        import gmsh
         gmsh.fltk.initialize()
         self._active = True
     # def __init__(self,parent=None):
@@ -128,6 +129,7 @@ class MeshVisualizer(QRunnable):
         #t = threading.Thread(target=self.showMesh)
         #gmsh.fltk.initialize()
         #gmsh.fltk.run()
+        import gmsh
         while self._active:
             gmsh.fltk.wait()
             #self.wait()
@@ -144,6 +146,7 @@ class MeshVisualizer(QRunnable):
     #     self.wait()
         
     def stop(self):
+        import gmsh
         gmsh.fltk.finalize()
         self.wait(2)
         self._active = False
@@ -0,0 +1,20 @@
+"""Checks of the iterative hologram engines."""
+
+import numpy as np
+
+import SLMcontroller.Holography as Holography
+import SLMcontroller.Phase_pattern as Phase_pattern
+
+
+def test_target_image_after_workspace_clear():
+    # The work arrays of the target placement are reallocated, the same target must be placed again on the new arrays
+    generator = Phase_pattern.Patter_generator(np.float64)
+    target = np.random.default_rng(0).random((12, 16))
+    generator.GenerateTargetImage(target, 8, 64, 48, lmm_x = 20., iterations = 3)
+    generator.spot_engine.workspace.clear()
+    pattern = generator.GenerateTargetImage(target, 8, 64, 48, lmm_x = 20., iterations = 3)
+    assert np.all((pattern >= 0) & (pattern < 256))
+    amplitude, signal = generator.target_engine.place_target(target, (96, 128), 10, 0, 1.)
+    reference_amplitude, reference_signal = Holography.MRAFEngine().place_target(target, (96, 128), 10, 0, 1.)
+    np.testing.assert_array_equal(amplitude, reference_amplitude)
+    np.testing.assert_array_equal(signal, reference_signal)
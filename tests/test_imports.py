@@ -0,0 +1,14 @@
+"""Checks the import budget of the application startup."""
+
+import subprocess
+import sys
+
+import pytest
+
+
+def test_startup_does_not_load_the_hologram_engines():
+    # Importing the package (as the launcher does) must not load the holography modules and their kernels
+    pytest.importorskip("PyQt6")
+    code = "import sys, SLMcontroller; print(sorted(m for m in ('SLMcontroller.Holography', 'SLMcontroller.Propagation') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True, check = True)
+    assert result.stdout.strip() == "[]"
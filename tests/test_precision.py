@@ -0,0 +1,56 @@
+"""Checks that patterns stored in float32 give the same frames as float64 once quantized to gray levels."""
+
+import numpy as np
+import pytest
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Render_pipeline as Render_pipeline
+
+
+def compose(dtype, res_X, res_Y):
+    """Grating, lens, Zernike expansions (with and without pupil) and an analytic layer, as composed by the hologram manager."""
+    generator = Phase_pattern.Patter_generator(dtype)
+    # Zernike coordinates are in pixels, coefficients of order n scaled by radius**-n give a few tens of 2pi across the SLM
+    orders = np.array([Phase_pattern._osa_to_nm(j)[0] for j in range(28)])
+    coefficients = np.random.default_rng(1).normal(size = 28)*0.2/(res_Y/2.)**orders
+    aperture = Phase_pattern.Aperture(res_X/2 + 10, res_Y/2 - 5, res_Y/3)
+    analytic = Phase_pattern.AnalyticPattern(res_X, res_Y)
+    analytic.add_grating(800, 8, 12.5, 0.3)
+    analytic.add_lens(500, 800, 8)
+    pattern = generator.GenerateAnalytic(analytic)
+    pattern += generator.GenerateGrating(800, 8, 3.3, 0.1, res_X, res_Y)
+    pattern += generator.GenerateLens(150, 800, 8, res_X, res_Y)
+    pattern += generator.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    pattern += generator.GenerateZernike(coefficients[:15], res_X, res_Y, res_X//2 + 10, res_Y//2 - 5, aperture)
+    assert pattern.dtype == dtype
+    return pattern
+
+def level_errors(frame, reference, correction):
+    """Gray level differences, a 2pi wrap (correction levels) is not an error."""
+    error = np.abs(frame.astype(np.int64) - reference)
+    return np.minimum(error, np.abs(error - correction))
+
+
+@pytest.mark.parametrize("res_X, res_Y", [(800, 600), (1272, 1024)])
+@pytest.mark.parametrize("correction", [226, 255])
+@pytest.mark.parametrize("quantizer", ["truncate", "round", "ordered"])
+def test_float32_frames_match_float64(res_X, res_Y, correction, quantizer):
+    single = Render_pipeline.render_frame(compose(np.float32, res_X, res_Y), correction, quantizer = quantizer)
+    double = Render_pipeline.render_frame(compose(np.float64, res_X, res_Y), correction, quantizer = quantizer)
+    errors = level_errors(single, double, correction)
+    assert errors.max() <= 1
+    assert np.mean(errors > 0) < 0.005
+
+@pytest.mark.parametrize("n_terms", [105, 300])
+def test_high_order_zernike_stays_finite_in_float32(n_terms):
+    # Beyond order 13 the pixel-radius polynomials exceed the float32 range, the basis must stay in float64
+    res_X, res_Y = 1920, 1152
+    orders = np.array([Phase_pattern._osa_to_nm(j)[0] for j in range(n_terms)])
+    coefficients = np.zeros(n_terms)
+    coefficients[4] = 1e-5
+    coefficients[-5:] = 0.2/(res_Y/2.)**orders[-5:]
+    single = Phase_pattern.Patter_generator().GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    double = Phase_pattern.Patter_generator(np.float64).GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    assert single.dtype == np.float32
+    assert np.all(np.isfinite(single))
+    np.testing.assert_allclose(single, double, rtol = 1e-6, atol = 1e-3)
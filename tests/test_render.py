@@ -0,0 +1,53 @@
+"""Checks that the tiled render mode (with and without crosstalk precompensation) and the numpy 1.x FFT fallback give the same frames as render_frame."""
+
+import numpy as np
+import pytest
+
+import SLMcontroller.Holography as Holography
+import SLMcontroller.Phase_pattern as Phase_pattern
+import SLMcontroller.Render_pipeline as Render_pipeline
+
+
+@pytest.mark.parametrize("res_X, res_Y", [(320, 240), (333, 217)])
+@pytest.mark.parametrize("quantizer", Render_pipeline.QUANTIZERS)
+@pytest.mark.parametrize("encoding", Render_pipeline.ENCODINGS)
+def test_tiled_frames_match_render_frame(res_X, res_Y, quantizer, encoding):
+    generator = Phase_pattern.Patter_generator(np.float64)
+    analytic = Phase_pattern.AnalyticPattern(res_X, res_Y)
+    analytic.add_grating(800, 8, 3.3, 0.1)
+    analytic.add_lens(300, 800, 8)
+    lens = generator.GenerateLens(200, 800, 8, res_X, res_Y)
+    mask = np.random.default_rng(0).random((res_Y, res_X))
+    reference = Render_pipeline.render_frame(generator.GenerateAnalytic(analytic) + lens, 226, (mask,), quantizer = quantizer, encoding = encoding)
+    # Tiles of 45 rows (not a multiple of DIFFUSION_ROWS), about 1 and 4 diffusion blocks
+    for tile_bytes in (8*res_X*45, 1 << 12, 8*res_X*130):
+        frame = Render_pipeline.render_tiled(generator, analytic, [lens], 226, [mask], tile_bytes = tile_bytes, quantizer = quantizer, encoding = encoding)
+        np.testing.assert_array_equal(frame, reference)
+
+@pytest.mark.parametrize("quantizer", Render_pipeline.QUANTIZERS)
+def test_crosstalk_without_fft_out(monkeypatch, quantizer):
+    # numpy < 2 has no out argument for the FFTs, the fallback must give the same frames
+    pattern = Phase_pattern.Patter_generator().GenerateLens(200, 800, 8, 320, 240)
+    crosstalk = Render_pipeline.CrosstalkCompensator(0.7)
+    reference = Render_pipeline.render_frame(pattern, 226, quantizer = quantizer, crosstalk = crosstalk)
+    monkeypatch.setattr(Holography, "FFT_OUT", False)
+    for name in ("rfft2", "irfft2"):
+        transform = getattr(np.fft, name)
+        monkeypatch.setattr(np.fft, name, lambda a, s = None, transform = transform: transform(a, s = s))
+    frame = Render_pipeline.render_frame(pattern, 226, quantizer = quantizer, crosstalk = Render_pipeline.CrosstalkCompensator(0.7))
+    np.testing.assert_array_equal(frame, reference)
+
+@pytest.mark.parametrize("quantizer", Render_pipeline.QUANTIZERS)
+def test_tiled_frames_keep_the_crosstalk_precompensation(quantizer):
+    res_X, res_Y = 320, 240
+    generator = Phase_pattern.Patter_generator(np.float64)
+    analytic = Phase_pattern.AnalyticPattern(res_X, res_Y)
+    analytic.add_grating(800, 8, 30., 0.1)
+    lens = generator.GenerateLens(200, 800, 8, res_X, res_Y)
+    crosstalk = Render_pipeline.CrosstalkCompensator(0.7)
+    reference = Render_pipeline.render_frame(generator.GenerateAnalytic(analytic) + lens, 226, quantizer = quantizer, crosstalk = crosstalk)
+    frame = Render_pipeline.render_tiled(generator, analytic, [lens], 226, tile_bytes = 1 << 12, quantizer = quantizer, crosstalk = crosstalk)
+    np.testing.assert_array_equal(frame, reference)
+    # A compensator of width 0 keeps the tiles
+    frame = Render_pipeline.render_tiled(generator, analytic, [lens], 226, tile_bytes = 1 << 12, quantizer = quantizer, crosstalk = Render_pipeline.CrosstalkCompensator(0))
+    np.testing.assert_array_equal(frame, Render_pipeline.render_frame(generator.GenerateAnalytic(analytic) + lens, 226, quantizer = quantizer))
@@ -0,0 +1,58 @@
+"""Checks that patterns computed on one quadrant and mirrored match the full evaluation."""
+
+import numpy as np
+import pytest
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+
+
+def generators():
+    mirrored = Phase_pattern.Patter_generator(np.float64)
+    full = Phase_pattern.Patter_generator(np.float64)
+    full.use_symmetry = False
+    full.zernike_cache.use_symmetry = False
+    return mirrored, full
+
+RESOLUTIONS = [(64, 48), (65, 47), (320, 240), (1, 7)]
+
+@pytest.fixture
+def mirrored_modes(monkeypatch):
+    """Counts the patterns mirrored from a quadrant, so that the tests can't silently compare two full evaluations."""
+    calls = []
+    for name in ("_mirror_quadrant", "_mirror_modes"):
+        def count(*args, mirror = getattr(Phase_pattern, name)):
+            calls.append(args[-1].shape)
+            mirror(*args)
+        monkeypatch.setattr(Phase_pattern, name, count)
+    return calls
+
+
+@pytest.mark.parametrize("res_X, res_Y", RESOLUTIONS)
+@pytest.mark.parametrize("focus", [100, -250, 2000])
+def test_lens_mirroring(res_X, res_Y, focus, mirrored_modes):
+    mirrored, full = generators()
+    lens = mirrored.GenerateLens(focus, 800, 8, res_X, res_Y)
+    assert len(mirrored_modes) == 1
+    reference = full.GenerateLens(focus, 800, 8, res_X, res_Y)
+    assert len(mirrored_modes) == 1
+    np.testing.assert_allclose(lens, reference, rtol = 1e-12, atol = 1e-9)
+
+@pytest.mark.parametrize("res_X, res_Y", RESOLUTIONS)
+def test_zernike_mirroring(res_X, res_Y, mirrored_modes):
+    mirrored, full = generators()
+    # Up to n = 7, even and odd polynomials along both axes (coordinates are in pixels, coefficients scaled by radius**-n)
+    orders = np.array([Phase_pattern._osa_to_nm(j)[0] for j in range(36)])
+    coefficients = np.random.default_rng(0).normal(size = 36)*0.2/(max(res_X, res_Y)/2.)**orders
+    zernike = mirrored.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    assert len(mirrored_modes) == 1
+    reference = full.GenerateZernike(coefficients, res_X, res_Y, res_X//2, res_Y//2)
+    assert len(mirrored_modes) == 1
+    np.testing.assert_allclose(zernike, reference, rtol = 0, atol = 1e-12*np.abs(reference).max())
+
+def test_off_center_patterns_are_not_mirrored(mirrored_modes):
+    mirrored, full = generators()
+    coefficients = np.full(15, 1e-2)
+    zernike = mirrored.GenerateZernike(coefficients, 64, 48, 37, 21)
+    reference = full.GenerateZernike(coefficients, 64, 48, 37, 21)
+    assert len(mirrored_modes) == 0
+    np.testing.assert_array_equal(zernike, reference)
@@ -0,0 +1,97 @@
+"""Accuracy checks of the Zernike polynomial kernels against the reference implementations."""
+
+from fractions import Fraction
+from math import comb
+
+import numpy as np
+import pytest
+
+import SLMcontroller.Phase_pattern as Phase_pattern
+
+
+def exact_radial(n, m, r):
+    """R_n^m(r) from the factorial sum, evaluated with exact rational arithmetic."""
+    m = abs(m)
+    r = Fraction(r)
+    value = sum((-1)**k*comb(n - k, k)*comb(n - 2*k, (n - m)//2 - k)*r**(n - 2*k) for k in range((n - m)//2 + 1))
+    return float(value)
+
+def radial_table(r, n_max):
+    table = np.zeros((n_max + 1, n_max + 1))
+    Phase_pattern._radial_table(r, table)
+    return table
+
+def orders(n_max):
+    return [(n, m) for n in range(n_max + 1) for m in range(n % 2, n + 1, 2)]
+
+
+def test_recurrence_matches_factorial_reference():
+    rho = np.linspace(0, 1, 257).reshape(1, -1)
+    n_max = 20
+    n_list, m_list = (np.array(v, dtype = np.int64) for v in zip(*orders(n_max)))
+    recurrence = np.empty((len(n_list),) + rho.shape)
+    Phase_pattern._radial_polynomials(n_list, m_list, rho, recurrence)
+    for k in range(len(n_list)):
+        reference = Phase_pattern._radialfunc(n_list[k], m_list[k], rho)
+        assert np.max(np.abs(recurrence[k] - reference)) < 1e-9
+
+@pytest.mark.parametrize("n_max", [30, 60])
+def test_recurrence_is_exact_at_high_orders(n_max):
+    # Beyond n = 20 the factorial table overflows, compare with exact rational sums
+    for r in (0., 0.13, 0.5, 0.77, 0.99, 1.):
+        table = radial_table(r, n_max)
+        for n, m in orders(n_max)[-3*n_max:]:
+            assert abs(table[n, m] - exact_radial(n, m, r)) < 1e-10
+
+def test_polynomials_match_reference_on_the_slm():
+    res_X, res_Y = 64, 48
+    x = (np.arange(res_X) - res_X//2)/(res_X//2)
+    y = (np.arange(res_Y) - res_Y//2)/(res_Y//2)
+    spans = Phase_pattern._full_spans(res_X, res_Y)
+    nm = np.array([Phase_pattern._osa_to_nm(j) for j in range(36)], dtype = np.int64)
+    out = np.empty((len(nm), res_X*res_Y))
+    Phase_pattern._zernike_polynomials(nm[:, 0], nm[:, 1], x, y, *spans, out)
+    X, Y = np.meshgrid(x, y)
+    for k, (n, m) in enumerate(nm):
+        reference = Phase_pattern._ZernikePolynomial(n, m, X, Y)
+        np.testing.assert_allclose(out[k].reshape(res_Y, res_X), reference, rtol = 0, atol = 1e-9)
+
+def test_recurrence_is_exact_at_pixel_radii():
+    # Production coordinates are in pixels, check the highest usable orders through the cache on a real SLM
+    res_X, res_Y = 1920, 1152
+    generator = Phase_pattern.Patter_generator()
+    X, Y = generator.generate_mesh(res_X, res_Y)
+    x, y = Phase_pattern._zernike_coordinates(X, Y, res_X//2, res_Y//2)
+    n_max = Phase_pattern._max_zernike_order(np.hypot(x[0], y[0]), 200)
+    assert n_max >= 80
+    n_terms = (n_max + 1)*(n_max + 2)//2
+    for aperture in (Phase_pattern.Aperture(30, 40, 3), Phase_pattern.Aperture(700, 500, 3)):
+        basis, (rows, starts, stops, offsets) = generator.zernike_cache.get_basis(n_terms, X, Y, res_X//2, res_Y//2, aperture)
+        assert np.all(np.isfinite(basis))
+        for j in range(n_terms - 2*n_max, n_terms):
+            n, m = Phase_pattern._osa_to_nm(j)
+            for s in range(len(rows)):
+                rho = np.hypot(x[starts[s]], y[rows[s]])
+                theta = np.arctan2(x[starts[s]], y[rows[s]])
+                radial = exact_radial(n, m, rho)*(np.sqrt(n + 1) if m == 0 else np.sqrt(2*n + 2))
+                angular = 1. if m == 0 else (np.cos(m*theta) if m > 0 else np.sin(m*theta))
+                assert abs(basis[j, offsets[s]] - radial*angular) <= 1e-12*abs(radial)
+
+def test_highest_order_pattern_in_default_dtype():
+    res_X, res_Y = 1920, 1152
+    x_offset, y_offset = res_X//2, res_Y//2
+    generator = Phase_pattern.Patter_generator()
+    X, Y = generator.generate_mesh(res_X, res_Y)
+    x, y = Phase_pattern._zernike_coordinates(X, Y, x_offset, y_offset)
+    rho_max = np.hypot(x[0], y[0])
+    n_max = Phase_pattern._max_zernike_order(rho_max, 200)
+    coefficients = np.zeros((n_max + 1)*(n_max + 2)//2)
+    coefficients[-1] = 0.2/rho_max**n_max
+    aperture = Phase_pattern.Aperture(40, 40, 20)
+    pattern = generator.GenerateZernike(coefficients, res_X, res_Y, x_offset, y_offset, aperture)
+    assert pattern.dtype == np.float32
+    assert np.all(np.isfinite(pattern))
+    assert np.max(np.abs(pattern)) > 1.
+    # One more order overflows float64 at the SLM corners and is refused
+    with pytest.raises(ValueError):
+        generator.GenerateZernike(np.zeros(len(coefficients) + n_max + 2), res_X, res_Y, x_offset, y_offset, aperture)